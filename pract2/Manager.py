@@ -1,219 +1,303 @@
-import customtkinter as ctk
-import tkinter as tk
-from tkinter import ttk
-from db import get_all_meters, get_meter_history, add_meter, delete_meter
-
-
-class ManagerApp(ctk.CTk):
-    def __init__(self):
-        super().__init__()
-
-        self.title("Менеджер-Адміністратор")
-        self.geometry("600x500")
-
-        self.admin_password = "123123"
-        self.init_login_ui()
-
-    def init_login_ui(self):
-        self.clear_ui()
-        ctk.CTkLabel(self, text="Вхід для адміністратора", font=("Arial", 16)).pack(pady=10)
-        self.pass_entry = ctk.CTkEntry(self, show="*")
-        self.pass_entry.pack(pady=5)
-        ctk.CTkButton(self, text="Увійти", command=self.try_login).pack(pady=10)
-        self.status_label = ctk.CTkLabel(self, text="")
-        self.status_label.pack()
-
-    def try_login(self):
-        if self.pass_entry.get() == self.admin_password:
-            self.show_main_menu()
-        else:
-            self.status_label.configure(text="Невірний пароль", text_color="red")
-
-    def show_main_menu(self):
-        self.clear_ui()
-        ctk.CTkLabel(self, text="Панель адміністратора", font=("Arial", 16)).pack(pady=10)
-
-        table_frame = self.create_meter_table()
-        table_frame.pack(pady=10, fill="both", expand=True)
-
-        ctk.CTkButton(self, text="Переглянути історію", command=self.display_selected_meter_history).pack(pady=5)
-        ctk.CTkButton(self, text="Видалити лічильник", command=self.delete_selected_meter).pack(pady=5)
-        ctk.CTkButton(self, text="Додати лічильник", command=self.add_meter_ui).pack(pady=5)
-        ctk.CTkButton(self, text="Редагувати тарифи", command=self.edit_tariffs_ui).pack(pady=5)
-
-    def edit_tariffs_ui(self):
-        from db import get_tariffs, update_tariff
-
-        self.clear_ui()
-        ctk.CTkLabel(self, text="Редагування тарифів", font=("Arial", 16)).pack(pady=10)
-
-        tariffs = get_tariffs()
-
-        self.day_tariff_entry = ctk.CTkEntry(self, placeholder_text="Тариф день")
-        self.day_tariff_entry.insert(0, str(tariffs["day_tariff"]))
-        self.day_tariff_entry.pack(pady=5)
-
-        self.night_tariff_entry = ctk.CTkEntry(self, placeholder_text="Тариф ніч")
-        self.night_tariff_entry.insert(0, str(tariffs["night_tariff"]))
-        self.night_tariff_entry.pack(pady=5)
-
-        self.status_label = ctk.CTkLabel(self, text="")
-        self.status_label.pack()
-
-        def save():
-            try:
-                update_tariff("day_tariff", float(self.day_tariff_entry.get()))
-                update_tariff("night_tariff", float(self.night_tariff_entry.get()))
-                self.status_label.configure(text="Тарифи оновлено", text_color="green")
-            except Exception as e:
-                self.status_label.configure(text=f"Помилка: {e}", text_color="red")
-
-        ctk.CTkButton(self, text="Зберегти", command=save).pack(pady=5)
-        ctk.CTkButton(self, text="Назад", command=self.show_main_menu).pack(pady=5)
-
-
-    def create_meter_table(self):
-        meters = get_all_meters()
-
-        frame = tk.Frame(self)
-        columns = ("meter_id", "day_value", "night_value")
-
-        self.meter_table = ttk.Treeview(frame, columns=columns, show="headings", height=10)
-        self.meter_table.heading("meter_id", text="ID")
-        self.meter_table.heading("day_value", text="День")
-        self.meter_table.heading("night_value", text="Ніч")
-
-        for meter in meters:
-            self.meter_table.insert("", "end", values=(meter["meter_id"], meter["day_value"], meter["night_value"]))
-
-        self.meter_table.pack(side="left", fill="both", expand=True)
-        scrollbar = ttk.Scrollbar(frame, orient="vertical", command=self.meter_table.yview)
-        scrollbar.pack(side="right", fill="y")
-        self.meter_table.configure(yscrollcommand=scrollbar.set)
-
-        return frame
-
-    def display_selected_meter_history(self):
-        selected = self.meter_table.selection()
-        if not selected:
-            return
-        item = self.meter_table.item(selected[0])
-        meter_id = item["values"][0]
-
-        history = get_meter_history(meter_id)
-        self.clear_ui()
-        ctk.CTkLabel(self, text=f"Історія для лічильника {meter_id}", font=("Arial", 16)).pack(pady=5)
-
-        text = ""
-        for row in history:
-            date = row['reading_time'].strftime("%Y-%m-%d")
-            text += f"{date} | День: {row['day_value']} | Ніч: {row['night_value']}\n"
-
-        ctk.CTkLabel(self, text=text, justify="left", wraplength=550).pack(pady=10)
-
-        ctk.CTkButton(self, text="Очистити історію", command=lambda: self.clear_meter_history_ui(meter_id)).pack(pady=5)
-        ctk.CTkButton(self, text="Назад", command=self.show_main_menu).pack(pady=5)
-
-
-    def delete_selected_meter(self):
-        selected = self.meter_table.selection()
-        if not selected:
-            return
-        item = self.meter_table.item(selected[0])
-        meter_id = item["values"][0]
-
-        try:
-            delete_meter(meter_id)
-            self.show_main_menu()
-        except Exception as e:
-            self.clear_ui()
-            ctk.CTkLabel(self, text=f"Помилка: {e}", text_color="red").pack(pady=5)
-            ctk.CTkButton(self, text="Назад", command=self.show_main_menu).pack(pady=5)
-
-    def add_meter_ui(self):
-        self.clear_ui()
-        ctk.CTkLabel(self, text="Додати новий лічильник").pack(pady=5)
-
-        self.new_id = ctk.CTkEntry(self, placeholder_text="ID")
-        self.new_id.pack()
-        self.new_pass = ctk.CTkEntry(self, placeholder_text="Пароль")
-        self.new_pass.pack()
-        self.new_day = ctk.CTkEntry(self, placeholder_text="Денні показання")
-        self.new_day.pack()
-        self.new_night = ctk.CTkEntry(self, placeholder_text="Нічні показання")
-        self.new_night.pack()
-
-        self.status = ctk.CTkLabel(self, text="")
-        self.status.pack()
-
-        ctk.CTkButton(self, text="Додати", command=self.submit_add_meter).pack(pady=5)
-        ctk.CTkButton(self, text="Назад", command=self.show_main_menu).pack()
-
-    def submit_add_meter(self):
-        try:
-            existing_ids = [m["meter_id"] for m in get_all_meters()]
-            if self.new_id.get() in existing_ids:
-                self.status.configure(text="Такий ID вже існує", text_color="red")
-                return
-
-            add_meter(
-                self.new_id.get(),
-                self.new_pass.get(),
-                float(self.new_day.get()),
-                float(self.new_night.get())
-            )
-            self.status.configure(text="Лічильник додано", text_color="green")
-        except Exception as e:
-            self.status.configure(text=f"Помилка: {e}", text_color="red")
-
-    def clear_meter_history_ui(self, meter_id):
-        confirm_window = ctk.CTkToplevel(self)
-        confirm_window.title("Підтвердження")
-        confirm_window.geometry("300x150")
-        confirm_window.grab_set()
-
-        ctk.CTkLabel(confirm_window, text=f"Очистити історію лічильника {meter_id}?", font=("Arial", 14)).pack(pady=20)
-
-        def confirm():
-            try:
-                from db import clear_meter_history
-                clear_meter_history(meter_id)
-                confirm_window.destroy()
-
-                # Після очищення історії — показати знову історію, оновлену
-                self.show_main_menu()
-                self.display_specific_meter_history(meter_id)
-            except Exception as e:
-                confirm_window.destroy()
-                self.clear_ui()
-                ctk.CTkLabel(self, text=f"Помилка при очищенні: {e}", text_color="red").pack(pady=5)
-                ctk.CTkButton(self, text="Назад", command=self.show_main_menu).pack(pady=5)
-
-        ctk.CTkButton(confirm_window, text="Так, очистити", command=confirm).pack(pady=5)
-        ctk.CTkButton(confirm_window, text="Скасувати", command=confirm_window.destroy).pack(pady=5)
-
-
-    def display_specific_meter_history(self, meter_id):
-        history = get_meter_history(meter_id)
-        self.clear_ui()
-        ctk.CTkLabel(self, text=f"Історія для лічильника {meter_id}", font=("Arial", 16)).pack(pady=5)
-
-        text = ""
-        for row in history:
-            date = row['reading_time'].strftime("%Y-%m-%d")
-            text += f"{date} | День: {row['day_value']} | Ніч: {row['night_value']}\n"
-
-        ctk.CTkLabel(self, text=text, justify="left", wraplength=550).pack(pady=10)
-
-        ctk.CTkButton(self, text="Очистити історію", command=lambda: self.clear_meter_history_ui(meter_id)).pack(pady=5)
-        ctk.CTkButton(self, text="Назад", command=self.show_main_menu).pack(pady=5)
-
-
-    def clear_ui(self):
-        for widget in self.winfo_children():
-            widget.destroy()
-
-
-if __name__ == "__main__":
-    app = ManagerApp()
-    app.mainloop()
+import customtkinter as ctk
+import tkinter as tk
+from tkinter import ttk
+from db import get_meters_page, get_meter_history_page, add_meter, delete_meter, clear_meter_history, METER_PAGE_SIZE
+from tariffs import get_tariffs, update_tariffs
+from ui_tasks import BackgroundTasks
+
+# Рядок-заглушка в кінці таблиці, поки довантажується наступна сторінка
+LOADING_ROW = "__loading__"
+# Пауза після введення в пошук перед запитом до БД, мс
+SEARCH_DELAY_MS = 300
+
+
+class ManagerApp(ctk.CTk):
+    def __init__(self):
+        super().__init__()
+
+        self.title("Менеджер-Адміністратор")
+        self.geometry("600x500")
+
+        # Усі запити до БД — у фонових потоках, щоб вікно не зависало
+        self.tasks = BackgroundTasks(self)
+
+        self.admin_password = "123123"
+        self.init_login_ui()
+
+    def init_login_ui(self):
+        self.clear_ui()
+        ctk.CTkLabel(self, text="Вхід для адміністратора", font=("Arial", 16)).pack(pady=10)
+        self.pass_entry = ctk.CTkEntry(self, show="*")
+        self.pass_entry.pack(pady=5)
+        ctk.CTkButton(self, text="Увійти", command=self.try_login).pack(pady=10)
+        self.status_label = ctk.CTkLabel(self, text="")
+        self.status_label.pack()
+
+    def try_login(self):
+        if self.pass_entry.get() == self.admin_password:
+            self.show_main_menu()
+        else:
+            self.status_label.configure(text="Невірний пароль", text_color="red")
+
+    def show_main_menu(self):
+        self.clear_ui()
+        ctk.CTkLabel(self, text="Панель адміністратора", font=("Arial", 16)).pack(pady=10)
+
+        table_frame = self.create_meter_table()
+        table_frame.pack(pady=10, fill="both", expand=True)
+
+        ctk.CTkButton(self, text="Переглянути історію", command=self.display_selected_meter_history).pack(pady=5)
+        ctk.CTkButton(self, text="Видалити лічильник", command=self.delete_selected_meter).pack(pady=5)
+        ctk.CTkButton(self, text="Додати лічильник", command=self.add_meter_ui).pack(pady=5)
+        ctk.CTkButton(self, text="Редагувати тарифи", command=self.edit_tariffs_ui).pack(pady=5)
+
+    def edit_tariffs_ui(self):
+        self.clear_ui()
+        ctk.CTkLabel(self, text="Редагування тарифів", font=("Arial", 16)).pack(pady=10)
+
+        self.day_tariff_entry = ctk.CTkEntry(self, placeholder_text="Тариф день")
+        self.day_tariff_entry.pack(pady=5)
+
+        self.night_tariff_entry = ctk.CTkEntry(self, placeholder_text="Тариф ніч")
+        self.night_tariff_entry.pack(pady=5)
+
+        self.status_label = ctk.CTkLabel(self, text="Завантаження...")
+        self.status_label.pack()
+
+        def show_tariffs(tariffs):
+            self.day_tariff_entry.insert(0, str(tariffs["day_tariff"]))
+            self.night_tariff_entry.insert(0, str(tariffs["night_tariff"]))
+            self.status_label.configure(text="")
+
+        self.tasks.run("tariffs", get_tariffs, on_done=show_tariffs, on_error=self.show_status_error)
+
+        def save():
+            try:
+                day = float(self.day_tariff_entry.get())
+                night = float(self.night_tariff_entry.get())
+            except ValueError as e:
+                self.show_status_error(e)
+                return
+            if self.tasks.run("save_tariffs", update_tariffs, day, night,
+                              on_done=lambda _: self.status_label.configure(text="Тарифи оновлено", text_color="green"),
+                              on_error=self.show_status_error, write=True):
+                self.status_label.configure(text="Збереження...", text_color="gray")
+
+        ctk.CTkButton(self, text="Зберегти", command=save).pack(pady=5)
+        ctk.CTkButton(self, text="Назад", command=self.show_main_menu).pack(pady=5)
+
+    def show_status_error(self, error):
+        self.status_label.configure(text=f"Помилка: {error}", text_color="red")
+
+
+    def create_meter_table(self):
+        # Таблиця не тримає всі лічильники: сторінки по METER_PAGE_SIZE довантажуються з БД,
+        # коли користувач догортає до кінця. Пошук і сортування виконує сама БД
+        frame = tk.Frame(self)
+
+        search_entry = ctk.CTkEntry(frame, placeholder_text="Пошук за ID")
+        search_entry.pack(side="top", fill="x", pady=(0, 5))
+        search_entry.bind("<KeyRelease>", lambda event: self.schedule_meter_search(search_entry.get().strip()))
+
+        columns = ("meter_id", "day_value", "night_value", "last_update")
+        self.meter_table = ttk.Treeview(frame, columns=columns, show="headings", height=10)
+        self.meter_headings = {"meter_id": "ID", "day_value": "День", "night_value": "Ніч", "last_update": "Оновлено"}
+        for column in columns:
+            self.meter_table.heading(column, command=lambda c=column: self.sort_meters(c))
+
+        self.meter_table.pack(side="left", fill="both", expand=True)
+        scrollbar = ttk.Scrollbar(frame, orient="vertical", command=self.meter_table.yview)
+        scrollbar.pack(side="right", fill="y")
+
+        def on_scroll(first, last):
+            scrollbar.set(first, last)
+            # Догорнули майже до кінця — просимо наступну сторінку
+            if float(last) > 0.9 and self.meter_cursor is not None:
+                self.load_meter_page()
+
+        self.meter_table.configure(yscrollcommand=on_scroll)
+
+        self.meter_query = ("", "meter_id", False)
+        self.meter_search_job = None
+        self.reload_meters()
+        return frame
+
+    def schedule_meter_search(self, prefix):
+        # Запит іде лише коли користувач перестав друкувати
+        if self.meter_search_job is not None:
+            self.after_cancel(self.meter_search_job)
+        self.meter_search_job = self.after(SEARCH_DELAY_MS, lambda: self.search_meters(prefix))
+
+    def search_meters(self, prefix):
+        self.meter_search_job = None
+        if prefix != self.meter_query[0]:
+            self.meter_query = (prefix,) + self.meter_query[1:]
+            self.reload_meters()
+
+    def sort_meters(self, column):
+        prefix, order, descending = self.meter_query
+        self.meter_query = (prefix, column, not descending if column == order else False)
+        self.reload_meters()
+
+    def reload_meters(self):
+        prefix, order, descending = self.meter_query
+        for column, title in self.meter_headings.items():
+            arrow = (" ▼" if descending else " ▲") if column == order else ""
+            self.meter_table.heading(column, text=title + arrow)
+        self.meter_table.delete(*self.meter_table.get_children())
+        self.meter_cursor = None
+        self.load_meter_page()
+
+    def load_meter_page(self):
+        query, after = self.meter_query, self.meter_cursor
+        prefix, order, descending = query
+
+        def fill(page):
+            # Поки сторінка вантажилась, пошук чи сортування могли змінитись
+            if query != self.meter_query or after != self.meter_cursor:
+                return
+            rows, cursor = page
+            if self.meter_table.exists(LOADING_ROW):
+                self.meter_table.delete(LOADING_ROW)
+            for meter in rows:
+                last_update = meter["last_update"].strftime("%Y-%m-%d %H:%M") if meter["last_update"] else ""
+                values = (meter["meter_id"], meter["day_value"], meter["night_value"], last_update)
+                # Сортування за показниками: лічильник, що отримав новий показник,
+                # міг перейти за курсор і прийти ще раз — оновлюємо наявний рядок
+                if self.meter_table.exists(meter["meter_id"]):
+                    self.meter_table.item(meter["meter_id"], values=values)
+                else:
+                    self.meter_table.insert("", "end", iid=meter["meter_id"], values=values)
+            # Курсор — лише після того, як уся сторінка в таблиці
+            self.meter_cursor = cursor
+
+        # Ключ задачі містить курсор: події прокрутки під час завантаження не дублюють запит
+        if self.tasks.run(("meters", query, after), get_meters_page, METER_PAGE_SIZE, after, prefix, order, descending,
+                          on_done=fill, on_error=self.show_error_screen):
+            if not self.meter_table.exists(LOADING_ROW):
+                self.meter_table.insert("", "end", iid=LOADING_ROW, values=("Завантаження...", "", "", ""))
+
+    def selected_meter_id(self):
+        # iid рядка — це сам meter_id (рядком, без перетворення Treeview на число)
+        selected = [iid for iid in self.meter_table.selection() if iid != LOADING_ROW]
+        if not selected:
+            return None
+        return selected[0]
+
+    def display_selected_meter_history(self):
+        meter_id = self.selected_meter_id()
+        if meter_id is None:
+            return
+
+        self.display_specific_meter_history(meter_id)
+
+    def delete_selected_meter(self):
+        meter_id = self.selected_meter_id()
+        if meter_id is None:
+            return
+
+        self.tasks.run(("delete", meter_id), delete_meter, meter_id,
+                       on_done=lambda _: self.show_main_menu(), on_error=self.show_error_screen, write=True)
+
+    def show_error_screen(self, error, prefix="Помилка"):
+        self.clear_ui()
+        ctk.CTkLabel(self, text=f"{prefix}: {error}", text_color="red").pack(pady=5)
+        ctk.CTkButton(self, text="Назад", command=self.show_main_menu).pack(pady=5)
+
+    def add_meter_ui(self):
+        self.clear_ui()
+        ctk.CTkLabel(self, text="Додати новий лічильник").pack(pady=5)
+
+        self.new_id = ctk.CTkEntry(self, placeholder_text="ID")
+        self.new_id.pack()
+        self.new_pass = ctk.CTkEntry(self, placeholder_text="Пароль")
+        self.new_pass.pack()
+        self.new_day = ctk.CTkEntry(self, placeholder_text="Денні показання")
+        self.new_day.pack()
+        self.new_night = ctk.CTkEntry(self, placeholder_text="Нічні показання")
+        self.new_night.pack()
+
+        self.status = ctk.CTkLabel(self, text="")
+        self.status.pack()
+
+        ctk.CTkButton(self, text="Додати", command=self.submit_add_meter).pack(pady=5)
+        ctk.CTkButton(self, text="Назад", command=self.show_main_menu).pack()
+
+    def submit_add_meter(self):
+        try:
+            args = (self.new_id.get(), self.new_pass.get(), float(self.new_day.get()), float(self.new_night.get()))
+        except Exception as e:
+            self.status.configure(text=f"Помилка: {e}", text_color="red")
+            return
+
+        # Дублікат ID перевіряє сама БД (унікальний ключ) — add_meter поверне повідомлення
+        def done(result):
+            ok = result == "Лічильник додано."
+            self.status.configure(text=result, text_color="green" if ok else "red")
+
+        if self.tasks.run("add_meter", add_meter, *args, on_done=done,
+                          on_error=lambda e: self.status.configure(text=f"Помилка: {e}", text_color="red"), write=True):
+            self.status.configure(text="Збереження...", text_color="gray")
+
+    def clear_meter_history_ui(self, meter_id):
+        confirm_window = ctk.CTkToplevel(self)
+        confirm_window.title("Підтвердження")
+        confirm_window.geometry("300x150")
+        confirm_window.grab_set()
+
+        ctk.CTkLabel(confirm_window, text=f"Очистити історію лічильника {meter_id}?", font=("Arial", 14)).pack(pady=20)
+
+        def confirm():
+            confirm_window.destroy()
+            # Після очищення історії — показати знову історію, оновлену
+            self.tasks.run(("clear_history", meter_id), clear_meter_history, meter_id,
+                           on_done=lambda _: self.display_specific_meter_history(meter_id),
+                           on_error=lambda e: self.show_error_screen(e, "Помилка при очищенні"), write=True)
+
+        ctk.CTkButton(confirm_window, text="Так, очистити", command=confirm).pack(pady=5)
+        ctk.CTkButton(confirm_window, text="Скасувати", command=confirm_window.destroy).pack(pady=5)
+
+
+    def display_specific_meter_history(self, meter_id, cursors=None):
+        # cursors — стек курсорів уже переглянутих сторінок; None — перша сторінка
+        cursors = cursors or [None]
+        self.clear_ui()
+        ctk.CTkLabel(self, text=f"Історія для лічильника {meter_id} (сторінка {len(cursors)})",
+                     font=("Arial", 16)).pack(pady=5)
+        history_label = ctk.CTkLabel(self, text="Завантаження...", justify="left", wraplength=550)
+        history_label.pack(pady=10)
+        nav_frame = ctk.CTkFrame(self, fg_color="transparent")
+        nav_frame.pack()
+
+        def show_page(page):
+            history, next_cursor = page
+            text = ""
+            for row in history:
+                date = row['reading_time'].strftime("%Y-%m-%d")
+                text += f"{date} | День: {row['day_value']} | Ніч: {row['night_value']}\n"
+            history_label.configure(text=text)
+
+            if len(cursors) > 1:
+                ctk.CTkButton(nav_frame, text="Новіші",
+                              command=lambda: self.display_specific_meter_history(meter_id, cursors[:-1])).pack(pady=5)
+            if next_cursor is not None:
+                ctk.CTkButton(nav_frame, text="Старіші",
+                              command=lambda: self.display_specific_meter_history(meter_id, cursors + [next_cursor])).pack(pady=5)
+
+        self.tasks.run(("history", meter_id, cursors[-1]), get_meter_history_page, meter_id, 20, cursors[-1],
+                       on_done=show_page, on_error=self.show_error_screen)
+
+        ctk.CTkButton(self, text="Очистити історію", command=lambda: self.clear_meter_history_ui(meter_id)).pack(pady=5)
+        ctk.CTkButton(self, text="Назад", command=self.show_main_menu).pack(pady=5)
+
+
+    def clear_ui(self):
+        # Новий екран: результати запитів для попереднього вже не потрібні
+        self.tasks.next_screen()
+        for widget in self.winfo_children():
+            widget.destroy()
+
+
+if __name__ == "__main__":
+    app = ManagerApp()
+    app.mainloop()
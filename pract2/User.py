@@ -1,151 +1,199 @@
-import customtkinter as ctk
-from db import get_meter, save_meter_data_and_bill, get_meter_history, update_password
-from datetime import datetime
-
-
-class UserApp(ctk.CTk):
-    def __init__(self):
-        super().__init__()
-
-        self.title("Кабінет користувача")
-        self.geometry("450x500")
-
-        self.logged_in = False
-        self.meter_data = None
-
-        self.init_login_ui()
-
-    def init_login_ui(self):
-        self.clear_ui()
-
-        ctk.CTkLabel(self, text="Номер лічильника:").pack(pady=5)
-        self.entry_id = ctk.CTkEntry(self)
-        self.entry_id.pack()
-
-        ctk.CTkLabel(self, text="Пароль:").pack(pady=5)
-        self.entry_pass = ctk.CTkEntry(self, show="*")
-        self.entry_pass.pack()
-
-        ctk.CTkButton(self, text="Увійти", command=self.try_login).pack(pady=10)
-        self.status_label = ctk.CTkLabel(self, text="")
-        self.status_label.pack()
-
-    def try_login(self):
-        meter_id = self.entry_id.get().strip()
-        password = self.entry_pass.get().strip()
-
-        data = get_meter(meter_id)
-        if data and data["password"] == password:
-            self.meter_data = data
-            self.logged_in = True
-            self.show_main_menu()
-        else:
-            self.status_label.configure(text="Невірний логін або пароль", text_color="red")
-
-    def show_main_menu(self):
-        self.clear_ui()
-
-        ctk.CTkLabel(self, text=f"Вітаємо! Ви залогінились за № {self.meter_data['meter_id']}",
-                     font=("Arial", 16)).pack(pady=10)
-
-        ctk.CTkButton(self, text="Історія", command=self.show_history).pack(pady=10)
-        ctk.CTkButton(self, text="Нові показники", command=self.show_new_readings).pack(pady=10)
-        ctk.CTkButton(self, text="Змінити пароль", command=self.change_password_ui).pack(pady=10)
-
-    def show_history(self):
-        self.clear_ui()
-
-        history = get_meter_history(self.meter_data['meter_id'])
-
-        ctk.CTkLabel(self, text="Історія показників", font=("Arial", 16)).pack(pady=5)
-        text = ""
-        for row in history:
-            date = row['reading_time'].strftime("%Y-%m-%d")
-            text += f"{date} | День: {row['day_value']} кВт | Ніч: {row['night_value']} кВт\n"
-
-        ctk.CTkLabel(self, text=text, justify="left", wraplength=420).pack(pady=10)
-        ctk.CTkButton(self, text="Назад", command=self.show_main_menu).pack(pady=10)
-
-    def show_new_readings(self):
-        self.clear_ui()
-
-        ctk.CTkLabel(self, text="Нові денні показання:").pack()
-        self.entry_day = ctk.CTkEntry(self)
-        self.entry_day.pack()
-
-        ctk.CTkLabel(self, text="Нові нічні показання:").pack()
-        self.entry_night = ctk.CTkEntry(self)
-        self.entry_night.pack()
-
-        self.result_label = ctk.CTkLabel(self, text="")
-        self.result_label.pack(pady=5)
-
-        ctk.CTkButton(self, text="Оновити", command=self.submit_readings).pack(pady=10)
-        ctk.CTkButton(self, text="Назад", command=self.show_main_menu).pack(pady=5)
-
-    def submit_readings(self):
-        try:
-            new_day = float(self.entry_day.get())
-            new_night = float(self.entry_night.get())
-            prev_day = self.meter_data["day_value"]
-            prev_night = self.meter_data["night_value"]
-
-            if new_day < prev_day or new_night < prev_night:
-                self.show_warning_popup(
-                    "Показання не можуть бути меншими за попередні.\nБудь ласка, введіть коректні значення.")
-                return
-
-            result = save_meter_data_and_bill(self.meter_data["meter_id"], new_day, new_night)
-
-            # Оновити локальні дані
-            self.meter_data["day_value"] = new_day
-            self.meter_data["night_value"] = new_night
-
-            self.result_label.configure(text=result, text_color="green")
-        except ValueError:
-            self.result_label.configure(text="Некоректний ввід", text_color="red")
-        except Exception as e:
-            self.result_label.configure(text=f"Помилка: {e}", text_color="red")
-
-    def show_warning_popup(self, message):
-        popup = ctk.CTkToplevel(self)
-        popup.title("Увага!")
-        popup.geometry("300x150")
-        popup.grab_set()
-
-        ctk.CTkLabel(popup, text=message, wraplength=280, text_color="red").pack(pady=15)
-        ctk.CTkButton(popup, text="ОК", command=popup.destroy).pack(pady=10)
-
-    def change_password_ui(self):
-        self.clear_ui()
-
-        ctk.CTkLabel(self, text="Зміна паролю").pack(pady=10)
-
-        ctk.CTkLabel(self, text="Старий пароль:").pack()
-        self.old_pass_entry = ctk.CTkEntry(self, show="*")
-        self.old_pass_entry.pack(pady=5)
-
-        ctk.CTkLabel(self, text="Новий пароль:").pack()
-        self.new_pass_entry = ctk.CTkEntry(self, show="*")
-        self.new_pass_entry.pack(pady=5)
-
-        ctk.CTkButton(self, text="Змінити", command=self.submit_password_change).pack(pady=10)
-
-        self.pass_change_status = ctk.CTkLabel(self, text="")
-        self.pass_change_status.pack()
-
-        ctk.CTkButton(self, text="Назад", command=self.show_main_menu).pack(pady=5)
-
-    def submit_password_change(self):
-        old = self.old_pass_entry.get()
-        new = self.new_pass_entry.get()
-        result = update_password(self.meter_data['meter_id'], old, new)
-        self.pass_change_status.configure(text=result)
-
-    def clear_ui(self):
-        for widget in self.winfo_children():
-            widget.destroy()
-
-if __name__ == "__main__":
-    app = UserApp()
+import customtkinter as ctk
+from db import get_meter, save_meter_data_and_bill, get_meter_history_page, update_password
+from datetime import datetime
+from ui_tasks import BackgroundTasks
+from reading_log import ReadingLog
+from config import READINGS_LOG
+
+
+class UserApp(ctk.CTk):
+    def __init__(self):
+        super().__init__()
+
+        self.title("Кабінет користувача")
+        self.geometry("450x500")
+
+        self.logged_in = False
+        self.meter_data = None
+
+        # Усі запити до БД — у фонових потоках, щоб вікно не зависало
+        self.tasks = BackgroundTasks(self)
+
+        # Показники спершу йдуть у локальний журнал; те, що не дійшло до БД, дожене фоновий потік
+        self.readings_log = ReadingLog(READINGS_LOG) if READINGS_LOG else None
+        if self.readings_log:
+            self.readings_log.start_drainer(interval=5.0)
+
+        self.init_login_ui()
+
+    def init_login_ui(self):
+        self.clear_ui()
+
+        ctk.CTkLabel(self, text="Номер лічильника:").pack(pady=5)
+        self.entry_id = ctk.CTkEntry(self)
+        self.entry_id.pack()
+
+        ctk.CTkLabel(self, text="Пароль:").pack(pady=5)
+        self.entry_pass = ctk.CTkEntry(self, show="*")
+        self.entry_pass.pack()
+
+        ctk.CTkButton(self, text="Увійти", command=self.try_login).pack(pady=10)
+        self.status_label = ctk.CTkLabel(self, text="")
+        self.status_label.pack()
+
+    def try_login(self):
+        meter_id = self.entry_id.get().strip()
+        password = self.entry_pass.get().strip()
+
+        def check(data):
+            if data and data["password"] == password:
+                self.meter_data = data
+                self.logged_in = True
+                self.show_main_menu()
+            else:
+                self.status_label.configure(text="Невірний логін або пароль", text_color="red")
+
+        if self.tasks.run("login", get_meter, meter_id, on_done=check, on_error=self.show_status_error):
+            self.status_label.configure(text="Перевірка...", text_color="gray")
+
+    def show_status_error(self, error):
+        self.status_label.configure(text=f"Помилка: {error}", text_color="red")
+
+    def show_main_menu(self):
+        self.clear_ui()
+
+        ctk.CTkLabel(self, text=f"Вітаємо! Ви залогінились за № {self.meter_data['meter_id']}",
+                     font=("Arial", 16)).pack(pady=10)
+
+        ctk.CTkButton(self, text="Історія", command=self.show_history).pack(pady=10)
+        ctk.CTkButton(self, text="Нові показники", command=self.show_new_readings).pack(pady=10)
+        ctk.CTkButton(self, text="Змінити пароль", command=self.change_password_ui).pack(pady=10)
+
+    def show_history(self, cursors=None):
+        # cursors — стек курсорів уже переглянутих сторінок; None — перша сторінка
+        cursors = cursors or [None]
+        self.clear_ui()
+
+        ctk.CTkLabel(self, text=f"Історія показників (сторінка {len(cursors)})", font=("Arial", 16)).pack(pady=5)
+        history_label = ctk.CTkLabel(self, text="Завантаження...", justify="left", wraplength=420)
+        history_label.pack(pady=10)
+        nav_frame = ctk.CTkFrame(self, fg_color="transparent")
+        nav_frame.pack()
+
+        def show_page(page):
+            history, next_cursor = page
+            text = ""
+            for row in history:
+                date = row['reading_time'].strftime("%Y-%m-%d")
+                text += f"{date} | День: {row['day_value']} кВт | Ніч: {row['night_value']} кВт\n"
+            history_label.configure(text=text)
+
+            if len(cursors) > 1:
+                ctk.CTkButton(nav_frame, text="Новіші", command=lambda: self.show_history(cursors[:-1])).pack(pady=5)
+            if next_cursor is not None:
+                ctk.CTkButton(nav_frame, text="Старіші",
+                              command=lambda: self.show_history(cursors + [next_cursor])).pack(pady=5)
+
+        meter_id = self.meter_data['meter_id']
+        self.tasks.run(("history", cursors[-1]), get_meter_history_page, meter_id, 20, cursors[-1],
+                       on_done=show_page,
+                       on_error=lambda e: history_label.configure(text=f"Помилка: {e}", text_color="red"))
+        ctk.CTkButton(self, text="Назад", command=self.show_main_menu).pack(pady=10)
+
+    def show_new_readings(self):
+        self.clear_ui()
+
+        ctk.CTkLabel(self, text="Нові денні показання:").pack()
+        self.entry_day = ctk.CTkEntry(self)
+        self.entry_day.pack()
+
+        ctk.CTkLabel(self, text="Нові нічні показання:").pack()
+        self.entry_night = ctk.CTkEntry(self)
+        self.entry_night.pack()
+
+        self.result_label = ctk.CTkLabel(self, text="")
+        self.result_label.pack(pady=5)
+
+        ctk.CTkButton(self, text="Оновити", command=self.submit_readings).pack(pady=10)
+        ctk.CTkButton(self, text="Назад", command=self.show_main_menu).pack(pady=5)
+
+    def submit_readings(self):
+        try:
+            new_day = float(self.entry_day.get())
+            new_night = float(self.entry_night.get())
+        except ValueError:
+            self.result_label.configure(text="Некоректний ввід", text_color="red")
+            return
+
+        prev_day = self.meter_data["day_value"]
+        prev_night = self.meter_data["night_value"]
+
+        if new_day < prev_day or new_night < prev_night:
+            self.show_warning_popup(
+                "Показання не можуть бути меншими за попередні.\nБудь ласка, введіть коректні значення.")
+            return
+
+        def save():
+            if self.readings_log:
+                result = self.readings_log.save(self.meter_data["meter_id"], new_day, new_night)
+            else:
+                result = save_meter_data_and_bill(self.meter_data["meter_id"], new_day, new_night)
+            # Оновити локальні дані одразу після запису — навіть якщо користувач уже пішов з екрана
+            self.meter_data["day_value"] = new_day
+            self.meter_data["night_value"] = new_night
+            return result
+
+        # Повторне натискання "Оновити", поки йде збереження, не створить другий рахунок
+        if self.tasks.run("readings", save,
+                          on_done=lambda result: self.result_label.configure(text=result, text_color="green"),
+                          on_error=lambda e: self.result_label.configure(text=f"Помилка: {e}", text_color="red"),
+                          write=True):
+            self.result_label.configure(text="Збереження...", text_color="gray")
+
+    def show_warning_popup(self, message):
+        popup = ctk.CTkToplevel(self)
+        popup.title("Увага!")
+        popup.geometry("300x150")
+        popup.grab_set()
+
+        ctk.CTkLabel(popup, text=message, wraplength=280, text_color="red").pack(pady=15)
+        ctk.CTkButton(popup, text="ОК", command=popup.destroy).pack(pady=10)
+
+    def change_password_ui(self):
+        self.clear_ui()
+
+        ctk.CTkLabel(self, text="Зміна паролю").pack(pady=10)
+
+        ctk.CTkLabel(self, text="Старий пароль:").pack()
+        self.old_pass_entry = ctk.CTkEntry(self, show="*")
+        self.old_pass_entry.pack(pady=5)
+
+        ctk.CTkLabel(self, text="Новий пароль:").pack()
+        self.new_pass_entry = ctk.CTkEntry(self, show="*")
+        self.new_pass_entry.pack(pady=5)
+
+        ctk.CTkButton(self, text="Змінити", command=self.submit_password_change).pack(pady=10)
+
+        self.pass_change_status = ctk.CTkLabel(self, text="")
+        self.pass_change_status.pack()
+
+        ctk.CTkButton(self, text="Назад", command=self.show_main_menu).pack(pady=5)
+
+    def submit_password_change(self):
+        old = self.old_pass_entry.get()
+        new = self.new_pass_entry.get()
+        if self.tasks.run("password", update_password, self.meter_data['meter_id'], old, new,
+                          on_done=lambda result: self.pass_change_status.configure(text=result, text_color="gray"),
+                          on_error=lambda e: self.pass_change_status.configure(text=f"Помилка: {e}", text_color="red"),
+                          write=True):
+            self.pass_change_status.configure(text="Збереження...", text_color="gray")
+
+    def clear_ui(self):
+        # Новий екран: результати запитів для попереднього вже не потрібні
+        self.tasks.next_screen()
+        for widget in self.winfo_children():
+            widget.destroy()
+
+if __name__ == "__main__":
+    app = UserApp()
     app.mainloop()
\ No newline at end of file
@@ -0,0 +1,106 @@
+import math
+from datetime import datetime
+from config import ANOMALY_ALPHA, ANOMALY_Z, ANOMALY_MIN_READINGS, ANOMALY_MAX_KW
+
+# Показники, ближчі за хвилину, для перевірки "стрибка" вважаємо рознесеними на хвилину:
+# інакше два майже одночасні показники дають нескінченну потужність.
+# Показник з тим самим часом, що й попередній (повтор), на стрибок не перевіряється
+MIN_INTERVAL_HOURS = 1 / 60
+
+DAY_NIGHT = ('day', 'night')
+
+
+# Стан одного лічильника: кілька чисел, незалежно від довжини історії
+class _MeterStats:
+    __slots__ = ('time', 'names', 'values', 'mean', 'var', 'count')
+
+    def __init__(self, moment, names, values):
+        self.time = moment
+        self.names = names
+        self.values = values
+        self.mean = 0.0
+        self.var = 0.0
+        self.count = 0
+
+
+def _components(message):
+    # Показник як (назви, значення): день/ніч або регістри лічильника з N регістрами
+    if 'registers' in message:
+        names = tuple(sorted(message['registers']))
+        return names, tuple(float(message['registers'][name]) for name in names)
+    return DAY_NIGHT, (float(message['day_value']), float(message['night_value']))
+
+
+# Потокове виявлення підозрілих показників перед рахунком.
+# Для кожного лічильника тримає EWMA середнього і дисперсії споживання (кВт·год за годину),
+# тож кожен показник перевіряється за O(1) без запитів до БД:
+#   rollback — хоча б один регістр зменшився (скручування лічильника);
+#   jump     — спожито більше, ніж фізично можливо за цей час при ANOMALY_MAX_KW;
+#   spike    — споживання на ANOMALY_Z стандартних відхилень вище звичного.
+# rollback і jump не потрапляють у статистику, щоб підробка не зсувала "звичне" споживання.
+# Стан лише в пам'яті: після перезапуску перший показник лічильника — нова точка відліку.
+# Один детектор — для одного обробника (process_queue шардує лічильники між обробниками).
+class AnomalyDetector:
+    def __init__(self, alpha=ANOMALY_ALPHA, z_limit=ANOMALY_Z, min_readings=ANOMALY_MIN_READINGS,
+                 max_kw=ANOMALY_MAX_KW):
+        self.alpha = alpha
+        self.z_limit = z_limit
+        self.min_readings = min_readings
+        self.max_kw = max_kw
+        self.meters = {}
+
+    def check(self, meter_id, names, values, moment):
+        # Повертає список (причина, оцінка); порожній — показник звичайний
+        stats = self.meters.get(meter_id)
+        if stats is None:
+            self.meters[meter_id] = _MeterStats(moment, names, values)
+            return []
+
+        flags = []
+        if names != stats.names:
+            # Змінився набір регістрів — порівнювати нема з чим, починаємо відлік заново
+            stats.names, stats.values, stats.time = names, values, moment
+            return flags
+
+        diffs = [new - old for new, old in zip(values, stats.values)]
+        hours = max((moment - stats.time).total_seconds() / 3600, 0.0)
+        stats.values, stats.time = values, max(moment, stats.time)
+
+        if min(diffs) < 0:
+            flags.append(('rollback', min(diffs)))
+            return flags
+
+        if hours <= 0:
+            return flags
+        used = sum(diffs)
+        if self.max_kw is not None and used > self.max_kw * max(hours, MIN_INTERVAL_HOURS):
+            flags.append(('jump', used / max(hours, MIN_INTERVAL_HOURS)))
+            return flags
+
+        rate = used / hours
+        if stats.count >= self.min_readings and stats.var > 0:
+            z = (rate - stats.mean) / math.sqrt(stats.var)
+            if z > self.z_limit:
+                flags.append(('spike', z))
+
+        # EWMA середнього і дисперсії: перші показники просто накопичують середнє
+        if stats.count == 0:
+            stats.mean = rate
+        else:
+            delta = rate - stats.mean
+            stats.mean += self.alpha * delta
+            stats.var = (1 - self.alpha) * (stats.var + self.alpha * delta * delta)
+        stats.count += 1
+        return flags
+
+    def check_batch(self, batch):
+        # Повідомлення обробника -> рядки (meter_id, час, причина, оцінка) для save_anomalies().
+        # Час показника — 'timestamp' повідомлення (момент надходження, його ставлять parse_reading
+        # і generate_test_data); без нього — момент перевірки
+        anomalies = []
+        for message in batch:
+            moment = message.get('timestamp') or datetime.now()
+            names, values = _components(message)
+            for reason, score in self.check(message['meter_id'], names, values, moment):
+                anomalies.append((message['meter_id'], moment, reason, score))
+        return anomalies
@@ -0,0 +1,166 @@
+import time
+import random
+import argparse
+from db import (get_connection, add_meter, save_meter_data_and_bill, save_meter_readings_bulk,
+                get_pool_stats)
+from storage import get_backend, set_backend, SQLiteBackend
+import query_stats
+from process_queue import next_reading
+
+# Префікс ID тестових лічильників, щоб не змішувати їх зі справжніми
+METER_PREFIX = 'bench-'
+
+
+def make_readings(meters, count, backward_fraction, seed=42):
+    # Готуємо показники наперед, щоб час генерації не потрапляв у вимірювання
+    rnd_state = random.getstate()
+    random.seed(seed)
+    last = {f"{METER_PREFIX}{i}": (0, 0) for i in range(1, meters + 1)}
+    ids = list(last)
+    readings = []
+    for _ in range(count):
+        meter_id = random.choice(ids)
+        last[meter_id] = next_reading(*last[meter_id], backward_fraction)
+        readings.append((meter_id, *last[meter_id]))
+    random.setstate(rnd_state)
+    return readings
+
+
+def cleanup():
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM meters WHERE meter_id LIKE %s", (METER_PREFIX + '%',))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run_benchmark(meters=100, count=5000, backward_fraction=0.1, mode='single', batch_size=200):
+    readings = make_readings(meters, count, backward_fraction)
+
+    # Лічильники створюємо заздалегідь — міряємо саме виставлення рахунків
+    cleanup()
+    for i in range(1, meters + 1):
+        add_meter(f"{METER_PREFIX}{i}", "000000", 0, 0)
+
+    latencies = []
+    # Запити рахує сам застосунок (query_stats), тож це працює і на MySQL, і на SQLite,
+    # і не зачіпає запитів інших клієнтів сервера
+    query_stats.reset()
+    started = time.perf_counter()
+
+    if mode == 'single':
+        for meter_id, day, night in readings:
+            t0 = time.perf_counter()
+            save_meter_data_and_bill(meter_id, day, night)
+            latencies.append(time.perf_counter() - t0)
+    else:
+        for i in range(0, len(readings), batch_size):
+            batch = [(m, d, n, None) for m, d, n in readings[i:i + batch_size]]
+            t0 = time.perf_counter()
+            save_meter_readings_bulk(batch)
+            # Кожен показник пакета чекав на весь пакет
+            latencies.extend([time.perf_counter() - t0] * len(batch))
+
+    elapsed = time.perf_counter() - started
+    stats = query_stats.snapshot()
+
+    latencies.sort()
+    return {
+        'mode': mode,
+        'readings': count,
+        'seconds': elapsed,
+        'readings_per_sec': count / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'queries_per_reading': query_stats.total_queries(stats) / count,
+        'top_queries': query_stats.format_report(),
+        'pool': get_pool_stats()
+    }
+
+
+def server_statement_counts():
+    # Лічильники сервера MySQL: скільки запитів підготовлено і скільки виконано підготовленими
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SHOW GLOBAL STATUS WHERE Variable_name IN ('Com_stmt_prepare', 'Com_stmt_execute')")
+        return {name: int(value) for name, value in cursor.fetchall()}
+    finally:
+        conn.close()
+
+
+def compare_prepared(meters=100, count=5000, backward_fraction=0.1):
+    # Той самий набір показників (режим single) без і з підготовленими запитами.
+    # Різниця в часі — те, що сервер витрачав на розбір однакових SQL на кожен показник
+    backend = get_backend()
+    if backend.name != 'mysql':
+        raise RuntimeError("Підготовлені запити є лише в MySQL: sqlite3 і так кешує скомпільовані запити")
+    previous = backend.config.get('prepared_statements', True)
+    reports = []
+    try:
+        for enabled in (False, True):
+            # Зміна параметра перебудовує пул, тож кожен варіант стартує з порожнім кешем
+            backend.config['prepared_statements'] = enabled
+            before = server_statement_counts()
+            report = run_benchmark(meters, count, backward_fraction, 'single')
+            after = server_statement_counts()
+            report['mode'] = 'single, prepared' if enabled else 'single, text'
+            report['server'] = {name: after[name] - before.get(name, 0) for name in after}
+            reports.append(report)
+    finally:
+        backend.config['prepared_statements'] = previous
+    return reports
+
+
+def print_report(report):
+    print(f"Режим: {report['mode']}, показників: {report['readings']}, час: {report['seconds']:.2f} с")
+    print(f"Пропускна здатність: {report['readings_per_sec']:.1f} показників/с")
+    print(f"Затримка p50/p95/p99: {report['p50_ms']:.2f} / {report['p95_ms']:.2f} / {report['p99_ms']:.2f} мс")
+    print(f"Запитів до БД на показник (з COMMIT): {report['queries_per_reading']:.2f}")
+    print(report['top_queries'])
+    print(f"Пул: {report['pool']}")
+    if 'server' in report:
+        print(f"Сервер: підготовлено {report['server'].get('Com_stmt_prepare', 0)}, "
+              f"виконано підготовлених {report['server'].get('Com_stmt_execute', 0)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарк виставлення рахунків")
+    parser.add_argument('--meters', type=int, default=100)
+    parser.add_argument('--readings', type=int, default=5000)
+    parser.add_argument('--backward', type=float, default=0.1, help="частка зменшених показників")
+    parser.add_argument('--mode', choices=['single', 'bulk'], default='single')
+    parser.add_argument('--batch-size', type=int, default=200)
+    parser.add_argument('--keep', action='store_true', help="не видаляти тестові лічильники після запуску")
+    parser.add_argument('--sqlite', metavar='PATH', help="запустити на вбудованому SQLite замість MySQL")
+    parser.add_argument('--compare-prepared', action='store_true',
+                        help="порівняти режим single без і з підготовленими запитами (лише MySQL)")
+    args = parser.parse_args()
+
+    if args.sqlite:
+        set_backend(SQLiteBackend(args.sqlite))
+
+    try:
+        if args.compare_prepared:
+            reports = compare_prepared(args.meters, args.readings, args.backward)
+            for report in reports:
+                print_report(report)
+                print()
+            text, prepared = reports
+            print(f"Прискорення: {prepared['readings_per_sec'] / text['readings_per_sec']:.2f}x, "
+                  f"p50 {text['p50_ms']:.2f} -> {prepared['p50_ms']:.2f} мс")
+        else:
+            print_report(run_benchmark(args.meters, args.readings, args.backward, args.mode, args.batch_size))
+    finally:
+        if not args.keep:
+            cleanup()
@@ -1,8 +1,49 @@
-DB_CONFIG = {
-    'host': 'localhost',
-    'user': 'root',
-    'password': '123456',
-    'database': 'electricity_db',
-    'port': 3306
-}
-
+# Рушій збереження: 'mysql' (DB_CONFIG) або 'sqlite' (вбудований, файл SQLITE_PATH)
+DB_BACKEND = 'mysql'
+SQLITE_PATH = 'electricity.db'
+
+DB_CONFIG = {
+    'host': 'localhost',
+    'user': 'root',
+    'password': '123456',
+    'database': 'electricity_db',
+    'port': 3306,
+    'pool_size': 5,       # кількість з'єднань у пулі (макс. 32 для mysql.connector)
+    'pool_timeout': 10,   # скільки секунд чекати вільне з'єднання
+    'prepared_statements': True  # готувати на сервері запити, що виконуються на кожен показник
+}
+
+# Скільки секунд тримати тарифи/налаштування в пам'яті процесу.
+# У межах процесу кеш скидається одразу після update_tariffs/update_tariff,
+# TTL потрібен для змін, зроблених з іншого процесу (наприклад, Manager.py).
+SETTINGS_CACHE_TTL = 60
+
+# Локальний журнал показників для UserApp: показник спершу пишеться у файл,
+# і не губиться, якщо БД недоступна (None — писати одразу в БД)
+READINGS_LOG = 'user_readings.log'
+
+# Запити, довші за SLOW_QUERY_MS мілісекунд, пишуться в SLOW_QUERY_LOG (None — не писати)
+SLOW_QUERY_MS = 200
+SLOW_QUERY_LOG = 'slow_queries.log'
+
+# Порт, на якому ingest_server.py віддає статистику запитів для Prometheus (None — не віддавати)
+METRICS_PORT = 9108
+
+# Зберігання історії (retention.py): показники, старші за HISTORY_RETENTION_DAYS днів,
+# стискаються до одного знімка на день; рахунки, старші за BILL_RETENTION_DAYS, видаляються
+# (їх суми лишаються в consumption_daily/monthly; None — не видаляти);
+# ключі ідемпотентності зберігаються PROCESSED_RETENTION_DAYS днів, показники регістрів
+# (register_readings) — REGISTER_RETENTION_DAYS, підозрілі показники — ANOMALY_RETENTION_DAYS
+HISTORY_RETENTION_DAYS = 365
+BILL_RETENTION_DAYS = None
+PROCESSED_RETENTION_DAYS = 30
+REGISTER_RETENTION_DAYS = 365
+ANOMALY_RETENTION_DAYS = 180
+
+# Виявлення підозрілих показників (anomaly.py): вага нового значення в EWMA,
+# поріг z-оцінки, скільки показників потрібно до першої перевірки z-оцінки
+# і найбільша правдоподібна потужність, кВт (None — не перевіряти "стрибки")
+ANOMALY_ALPHA = 0.1
+ANOMALY_Z = 4.0
+ANOMALY_MIN_READINGS = 10
+ANOMALY_MAX_KW = 50.0
@@ -1,235 +1,676 @@
-import mysql.connector
-from datetime import datetime
-from config import DB_CONFIG
-
-
-def get_all_meters():
-    conn = get_connection()
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM meters")
-    result = cursor.fetchall()
-    conn.close()
-    return result
-
-def delete_meter(meter_id):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM meters WHERE meter_id = %s", (meter_id,))
-    conn.commit()
-    conn.close()
-    return "Лічильник видалено."
-
-def add_meter(meter_id, password, day_value=0.0, night_value=0.0):
-    conn = get_connection()
-    cursor = conn.cursor()
-    now = datetime.now()
-    try:
-        cursor.execute("""
-            INSERT INTO meters (meter_id, password, day_value, night_value, last_update)
-            VALUES (%s, %s, %s, %s, %s)
-        """, (meter_id, password, day_value, night_value, now))
-        conn.commit()
-        return "Лічильник додано."
-    except mysql.connector.IntegrityError:
-        return "Такий лічильник вже існує."
-    finally:
-        conn.close()
-
-
-def get_connection():
-    return mysql.connector.connect(**DB_CONFIG)
-
-
-def get_settings():
-    conn = get_connection()
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT setting_key, setting_value FROM settings")
-    result = {row["setting_key"]: row["setting_value"] for row in cursor.fetchall()}
-    conn.close()
-    return result
-
-
-def get_meter(meter_id):
-    conn = get_connection()
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM meters WHERE meter_id = %s", (meter_id,))
-    result = cursor.fetchone()
-    conn.close()
-    return result
-
-
-def save_meter_data_and_bill(meter_id, new_day, new_night):
-    conn = get_connection()
-    cursor = conn.cursor(dictionary=True)
-    settings = get_settings()
-
-    day_tariff = float(settings["day_tariff"])
-    night_tariff = float(settings["night_tariff"])
-    day_fake = float(settings["day_fake_increment"])
-    night_fake = float(settings["night_fake_increment"])
-    now = datetime.now()
-
-    cursor.execute("SELECT * FROM meters WHERE meter_id = %s", (meter_id,))
-    existing = cursor.fetchone()
-
-    if existing:
-        last_day = existing["day_value"]
-        last_night = existing["night_value"]
-
-        day_diff = new_day - last_day
-        night_diff = new_night - last_night
-        fake_used = False
-
-        if day_diff < 0:
-            day_diff = day_fake
-            fake_used = True
-        if night_diff < 0:
-            night_diff = night_fake
-            fake_used = True
-
-        total_cost = day_diff * day_tariff + night_diff * night_tariff
-
-        cursor.execute("""
-            INSERT INTO meter_readings_history (meter_id, reading_time, day_value, night_value)
-            VALUES (%s, %s, %s, %s)
-        """, (meter_id, now, new_day, new_night))
-
-        cursor.execute("""
-            INSERT INTO bills (meter_id, bill_time, day_kwh_used, night_kwh_used, total_cost)
-            VALUES (%s, %s, %s, %s, %s)
-        """, (meter_id, now, day_diff, night_diff, total_cost))
-
-        cursor.execute("""
-            UPDATE meters SET day_value=%s, night_value=%s, last_update=%s WHERE meter_id=%s
-        """, (new_day, new_night, now, meter_id))
-
-        conn.commit()
-        conn.close()
-
-        return f"Вартість: {total_cost:.2f} грн\n(День: {day_diff} кВт, Ніч: {night_diff} кВт)\n{'Накручено!' if fake_used else ''}"
-    else:
-        password = '000000' #def pass
-        cursor.execute("""
-            INSERT INTO meters (meter_id, password, last_update, day_value, night_value)
-            VALUES (%s, %s, %s, %s, %s)
-        """, (meter_id, password, now, new_day, new_night))
-
-        cursor.execute("""
-            INSERT INTO meter_readings_history (meter_id, reading_time, day_value, night_value)
-            VALUES (%s, %s, %s, %s)
-        """, (meter_id, now, new_day, new_night))
-
-        conn.commit()
-        conn.close()
-
-        return "Додано новий лічильник. Початкові дані збережено."
-
-
-def get_all_meter_data():
-    conn = get_connection()
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM meter_readings_history ORDER BY reading_time DESC")
-    result = cursor.fetchall()
-    conn.close()
-    return result
-
-
-def update_tariffs(day_tariff, night_tariff):
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        UPDATE settings
-        SET setting_value = %s
-        WHERE setting_key = 'day_tariff'
-    """, (day_tariff,))
-
-    cursor.execute("""
-        UPDATE settings
-        SET setting_value = %s
-        WHERE setting_key = 'night_tariff'
-    """, (night_tariff,))
-
-    conn.commit()
-    conn.close()
-
-
-def get_meter_history(meter_id):
-    conn = get_connection()
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute("""
-        SELECT reading_time, day_value, night_value
-        FROM meter_readings_history
-        WHERE meter_id = %s
-        ORDER BY reading_time DESC
-    """, (meter_id,))
-    result = cursor.fetchall()
-    conn.close()
-    return result
-
-
-def update_password(meter_id, old_password, new_password):
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    # Перевірка старого паролю
-    cursor.execute("SELECT password FROM meters WHERE meter_id = %s", (meter_id,))
-    record = cursor.fetchone()
-
-    if not record:
-        conn.close()
-        return "Користувача не знайдено."
-
-    if record[0] != old_password:
-        conn.close()
-        return "Старий пароль невірний."
-
-    # Оновлення пароля
-    cursor.execute("UPDATE meters SET password = %s WHERE meter_id = %s", (new_password, meter_id))
-    conn.commit()
-    conn.close()
-    return "Пароль успішно змінено."
-
-def clear_meter_history(meter_id):
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    # Знайти найновішу дату запису
-    cursor.execute("""
-        SELECT id FROM meter_readings_history 
-        WHERE meter_id = %s 
-        ORDER BY reading_time DESC 
-        LIMIT 1
-    """, (meter_id,))
-    last_record = cursor.fetchone()
-
-    if last_record:
-        last_id = last_record[0]
-
-        # Видалити всі інші записи крім найновішого
-        cursor.execute("""
-            DELETE FROM meter_readings_history 
-            WHERE meter_id = %s AND id != %s
-        """, (meter_id, last_id))
-        conn.commit()
-
-    conn.close()
-    
-def get_tariffs():
-    conn = get_connection()
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT setting_key, setting_value FROM settings WHERE setting_key IN ('day_tariff', 'night_tariff')")
-    results = cursor.fetchall()
-    conn.close()
-    return {row["setting_key"]: row["setting_value"] for row in results}
-
-def update_tariff(key, value):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("UPDATE settings SET setting_value = %s WHERE setting_key = %s", (value, key))
-    conn.commit()
-    conn.close()
-
-
-
-
+import time
+import random
+import threading
+from datetime import datetime
+from config import SETTINGS_CACHE_TTL
+from storage import get_backend, is_retryable, IntegrityError
+from query_stats import InstrumentedConnection, record_acquire
+
+# Кеш таблиці settings: значення, момент (time.monotonic), до якого воно дійсне,
+# і база, з якої його прочитано
+_settings_cache = {'value': None, 'expires': 0.0, 'key': None}
+_settings_lock = threading.Lock()
+
+
+def get_all_meters():
+    conn = get_connection()
+    try:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("SELECT * FROM meters")
+        return cursor.fetchall()
+    finally:
+        conn.close()
+
+# Лічильників на одній сторінці таблиці менеджера і колонки, за якими її можна сортувати
+METER_PAGE_SIZE = 100
+METER_SORT_COLUMNS = ('meter_id', 'day_value', 'night_value', 'last_update')
+
+
+def get_meters_page(limit=METER_PAGE_SIZE, after=None, prefix=None, order='meter_id', descending=False):
+    # Сторінка лічильників для таблиці: (рядки, курсор наступної сторінки або None).
+    # Курсор — meter_id останнього показаного рядка; значення колонки сортування для нього
+    # береться з самої БД (FLOAT, прочитаний у Python, не завжди дорівнює збереженому)
+    if order not in METER_SORT_COLUMNS:
+        raise ValueError(f"Невідома колонка сортування: {order}")
+    sign, direction = ('<', 'DESC') if descending else ('>', 'ASC')
+
+    joins, where, params = "", "1 = 1", ()
+    if after is not None:
+        if order == 'meter_id':
+            where += f" AND m.meter_id {sign} %s"
+        else:
+            joins = "JOIN meters c ON c.meter_id = %s"
+            where += f" AND (m.{order} {sign} c.{order} OR (m.{order} = c.{order} AND m.meter_id {sign} c.meter_id))"
+        params += (after,)
+    if prefix:
+        # Пошук за початком ID іде по первинному ключу; % і _ у префіксі — звичайні символи
+        escaped = prefix.replace('!', '!!').replace('%', '!%').replace('_', '!_')
+        where += " AND m.meter_id LIKE %s ESCAPE '!'"
+        params += (escaped + '%',)
+
+    order_by = f"m.meter_id {direction}" if order == 'meter_id' else f"m.{order} {direction}, m.meter_id {direction}"
+    conn = get_connection()
+    try:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(f"""
+            SELECT m.meter_id, m.day_value, m.night_value, m.last_update
+            FROM meters m {joins}
+            WHERE {where}
+            ORDER BY {order_by}
+            LIMIT %s
+        """, params + (limit + 1,))
+        rows = cursor.fetchall()
+    finally:
+        conn.close()
+    next_cursor = rows[limit - 1]['meter_id'] if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+def delete_meter(meter_id):
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM meters WHERE meter_id = %s", (meter_id,))
+        conn.commit()
+    finally:
+        conn.close()
+    return "Лічильник видалено."
+
+def add_meter(meter_id, password, day_value=0.0, night_value=0.0):
+    conn = get_connection()
+    cursor = conn.cursor()
+    now = datetime.now()
+    try:
+        cursor.execute("""
+            INSERT INTO meters (meter_id, password, day_value, night_value, last_update)
+            VALUES (%s, %s, %s, %s, %s)
+        """, (meter_id, password, day_value, night_value, now))
+        conn.commit()
+        return "Лічильник додано."
+    except IntegrityError:
+        return "Такий лічильник вже існує."
+    finally:
+        conn.close()
+
+
+def get_connection():
+    # З'єднання з поточного рушія (MySQL з пулом або вбудований SQLite, див. storage.py);
+    # conn.close() повертає його для повторного використання.
+    # Кожен запит через це з'єднання потрапляє в статистику query_stats
+    started = time.perf_counter()
+    conn = get_backend().connect()
+    record_acquire(time.perf_counter() - started)
+    return InstrumentedConnection(conn)
+
+
+def prepared_cursor(conn, sql, dictionary=False):
+    # Курсор для запиту sql, підготовленого на сервері (cursor(prepared=True)).
+    # Курсор кешується на з'єднанні: сервер розбирає запит один раз, а далі отримує лише параметри.
+    # Кожен такий курсор виконує тільки свій sql; результати SELECT треба вичитати до наступного виклику
+    cache = getattr(conn, 'statements', None)
+    if cache is None:
+        return conn.cursor(dictionary=dictionary)
+    cursor = cache.get((sql, dictionary))
+    if cursor is None:
+        cursor = cache[(sql, dictionary)] = conn.cursor(prepared=True, dictionary=dictionary)
+    return cursor
+
+
+def get_pool_stats():
+    return get_backend().stats()
+
+
+def get_settings(conn=None):
+    # Тарифи змінюються рідко, тому віддаємо їх з кешу; у БД йдемо лише після
+    # закінчення TTL або invalidate_settings_cache().
+    # Можна передати вже відкрите з'єднання, щоб не брати ще одне з пулу
+    key = get_backend().cache_key()
+    with _settings_lock:
+        if (_settings_cache['value'] is not None and _settings_cache['key'] == key
+                and time.monotonic() < _settings_cache['expires']):
+            return dict(_settings_cache['value'])
+
+    own_conn = conn is None
+    if own_conn:
+        conn = get_connection()
+    try:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("SELECT setting_key, setting_value FROM settings")
+        result = {row["setting_key"]: row["setting_value"] for row in cursor.fetchall()}
+    finally:
+        if own_conn:
+            conn.close()
+
+    with _settings_lock:
+        _settings_cache['value'] = result
+        _settings_cache['expires'] = time.monotonic() + SETTINGS_CACHE_TTL
+        _settings_cache['key'] = key
+    return dict(result)
+
+
+def invalidate_settings_cache():
+    with _settings_lock:
+        _settings_cache['value'] = None
+        _settings_cache['expires'] = 0.0
+
+
+def get_meter(meter_id):
+    conn = get_connection()
+    try:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("SELECT * FROM meters WHERE meter_id = %s", (meter_id,))
+        return cursor.fetchone()
+    finally:
+        conn.close()
+
+
+NEW_METER_MESSAGE = "Додано новий лічильник. Початкові дані збережено."
+ALREADY_PROCESSED_MESSAGE = "Цей показник уже враховано."
+
+# Рядків історії на одній сторінці
+HISTORY_PAGE_SIZE = 20
+
+# Скільки ключів підставляти в один IN (...) при пакетному завантаженні
+BULK_CHUNK_SIZE = 1000
+
+# Скільки разів повторювати транзакцію рахунку після взаємоблокування чи гонки
+WRITE_RETRIES = 5
+
+# Запити, що виконуються на кожен показник: на MySQL вони готуються на сервері один раз
+# на з'єднання (prepared_cursor), далі передаються лише параметри.
+# Пакетний запис (executemany) їх не готує: mysql.connector і так склеює пакет в один INSERT
+SELECT_METER_FOR_BILL = "SELECT meter_id, day_value, night_value FROM meters WHERE meter_id = %s"
+INSERT_HISTORY = """
+    INSERT INTO meter_readings_history (meter_id, reading_time, day_value, night_value)
+    VALUES (%s, %s, %s, %s)
+"""
+INSERT_BILL = """
+    INSERT INTO bills (meter_id, bill_time, day_kwh_used, night_kwh_used, total_cost)
+    VALUES (%s, %s, %s, %s, %s)
+"""
+UPDATE_METER_VALUES = "UPDATE meters SET day_value=%s, night_value=%s, last_update=%s WHERE meter_id=%s"
+
+
+def calculate_bill(last_day, last_night, new_day, new_night, settings):
+    # Спільна логіка рахунку: різниця показників, "накрутка" при зменшенні, вартість
+    day_tariff = float(settings["day_tariff"])
+    night_tariff = float(settings["night_tariff"])
+    day_fake = float(settings["day_fake_increment"])
+    night_fake = float(settings["night_fake_increment"])
+
+    day_diff = new_day - last_day
+    night_diff = new_night - last_night
+    fake_used = False
+
+    if day_diff < 0:
+        day_diff = day_fake
+        fake_used = True
+    if night_diff < 0:
+        night_diff = night_fake
+        fake_used = True
+
+    total_cost = day_diff * day_tariff + night_diff * night_tariff
+    return day_diff, night_diff, total_cost, fake_used
+
+
+def tariffs_at(conn, times):
+    # Ставки день/ніч на момент кожного показника — з того самого розкладу tariff_zones, що й для регістрів.
+    # tariffs імпортує цей модуль, тому імпорт тут, а не на початку файлу
+    from tariffs import get_tariff_table
+    return get_tariff_table(conn).settings_at(times)
+
+
+def format_bill(day_diff, night_diff, total_cost, fake_used):
+    return f"Вартість: {total_cost:.2f} грн\n(День: {day_diff} кВт, Ніч: {night_diff} кВт)\n{'Накручено!' if fake_used else ''}"
+
+
+# Підсумки споживання: період -> таблиця
+ROLLUP_TABLES = {'day': 'consumption_daily', 'month': 'consumption_monthly'}
+ROLLUP_COLUMNS = ('meter_id', 'period_start', 'day_kwh', 'night_kwh', 'cost', 'bills_count', 'fake_count')
+
+
+def period_start(moment, period):
+    # Перший день періоду, до якого належить момент часу
+    day = moment.date() if isinstance(moment, datetime) else moment
+    return day if period == 'day' else day.replace(day=1)
+
+
+def update_rollups(cursor, bills):
+    # bills: (meter_id, час, день кВт, ніч кВт, вартість, чи була накрутка).
+    # Спершу сумуємо в пам'яті, потім один upsert на таблицю, що додає до наявних сум
+    for period in ROLLUP_TABLES:
+        totals = {}
+        for meter_id, moment, day_kwh, night_kwh, cost, fake_used in bills:
+            row = totals.setdefault((meter_id, period_start(moment, period)), [0.0, 0.0, 0.0, 0, 0])
+            row[0] += day_kwh
+            row[1] += night_kwh
+            row[2] += cost
+            row[3] += 1
+            row[4] += 1 if fake_used else 0
+        add_to_rollups(cursor, period, [key + tuple(values) for key, values in totals.items()])
+
+
+def add_to_rollups(cursor, period, rows):
+    # rows: (meter_id, period_start, день кВт, ніч кВт, вартість, рахунків, накруток) —
+    # значення додаються до наявних (від'ємні — віднімаються)
+    if rows:
+        cursor.executemany(get_backend().upsert(
+            ROLLUP_TABLES[period], ROLLUP_COLUMNS, add=ROLLUP_COLUMNS[2:], conflict=ROLLUP_COLUMNS[:2]
+        ), rows)
+
+
+def mark_processed(cursor, message_ids, meter_ids, now):
+    # Запис ключів ідемпотентності в тій самій транзакції, що й рахунки:
+    # або враховано і показник, і ключ, або нічого
+    cursor.executemany(
+        "INSERT INTO processed_readings (message_id, meter_id, processed_at) VALUES (%s, %s, %s)",
+        [(message_id, meter_id, now) for message_id, meter_id in zip(message_ids, meter_ids)]
+    )
+
+
+def load_processed(cursor, message_ids):
+    processed = set()
+    for i in range(0, len(message_ids), BULK_CHUNK_SIZE):
+        chunk = message_ids[i:i + BULK_CHUNK_SIZE]
+        placeholders = ", ".join(["%s"] * len(chunk))
+        cursor.execute(f"SELECT message_id FROM processed_readings WHERE message_id IN ({placeholders})", chunk)
+        processed.update(row["message_id"] for row in cursor.fetchall())
+    return processed
+
+
+def in_write_transaction(work, *args):
+    # Виконує work(conn, *args) у транзакції на запис.
+    # Взаємоблокування, зайнята база чи два одночасні перші показники нового лічильника
+    # (IntegrityError) — тимчасові: транзакція відкочується і повторюється
+    for attempt in range(WRITE_RETRIES):
+        conn = get_connection()
+        try:
+            get_backend().begin_write(conn)
+            return work(conn, *args)
+        except Exception as e:
+            conn.rollback()
+            if attempt == WRITE_RETRIES - 1 or not (is_retryable(e) or isinstance(e, IntegrityError)):
+                raise
+        finally:
+            conn.close()
+        time.sleep(random.uniform(0, 0.01 * 2 ** attempt))
+
+
+def save_meter_data_and_bill(meter_id, new_day, new_night, message_id=None):
+    # message_id — ключ ідемпотентності: повторний виклик з тим самим ключем нічого не змінює
+    return in_write_transaction(_save_reading, meter_id, new_day, new_night, message_id)
+
+
+def _save_reading(conn, meter_id, new_day, new_night, message_id):
+    cursor = conn.cursor(dictionary=True)
+    now = datetime.now()
+    settings = tariffs_at(conn, [now])[0]
+
+    if message_id is not None:
+        try:
+            mark_processed(cursor, [message_id], [meter_id], now)
+        except IntegrityError:
+            conn.rollback()
+            return ALREADY_PROCESSED_MESSAGE
+
+    # Рядок лічильника блокується до commit: паралельний показник того самого лічильника
+    # чекатиме й рахуватиметься вже від нового значення
+    select = prepared_cursor(conn, SELECT_METER_FOR_BILL + get_backend().for_update, dictionary=True)
+    select.execute(SELECT_METER_FOR_BILL + get_backend().for_update, (meter_id,))
+    # fetchall, а не fetchone: курсор перевикористовується, результат треба вичитати до кінця
+    rows = select.fetchall()
+    existing = rows[0] if rows else None
+
+    if existing:
+        day_diff, night_diff, total_cost, fake_used = calculate_bill(
+            existing["day_value"], existing["night_value"], new_day, new_night, settings)
+
+        prepared_cursor(conn, INSERT_HISTORY).execute(INSERT_HISTORY, (meter_id, now, new_day, new_night))
+        prepared_cursor(conn, INSERT_BILL).execute(INSERT_BILL, (meter_id, now, day_diff, night_diff, total_cost))
+        prepared_cursor(conn, UPDATE_METER_VALUES).execute(UPDATE_METER_VALUES, (new_day, new_night, now, meter_id))
+
+        update_rollups(cursor, [(meter_id, now, day_diff, night_diff, total_cost, fake_used)])
+
+        conn.commit()
+
+        return format_bill(day_diff, night_diff, total_cost, fake_used)
+    else:
+        password = '000000' #def pass
+        cursor.execute("""
+            INSERT INTO meters (meter_id, password, last_update, day_value, night_value)
+            VALUES (%s, %s, %s, %s, %s)
+        """, (meter_id, password, now, new_day, new_night))
+
+        prepared_cursor(conn, INSERT_HISTORY).execute(INSERT_HISTORY, (meter_id, now, new_day, new_night))
+
+        conn.commit()
+
+        return NEW_METER_MESSAGE
+
+
+def _load_meter_state(cursor, meter_ids):
+    # Поточні показники всіх потрібних лічильників — по одному запиту на BULK_CHUNK_SIZE ключів
+    state = {}
+    for i in range(0, len(meter_ids), BULK_CHUNK_SIZE):
+        chunk = meter_ids[i:i + BULK_CHUNK_SIZE]
+        placeholders = ", ".join(["%s"] * len(chunk))
+        cursor.execute(f"""
+            SELECT meter_id, day_value, night_value FROM meters
+            WHERE meter_id IN ({placeholders})
+        """ + get_backend().for_update, chunk)
+        for row in cursor.fetchall():
+            state[row["meter_id"]] = (row["day_value"], row["night_value"])
+    return state
+
+
+def save_meter_readings_bulk(readings):
+    # readings: ітерабельне з кортежів (meter_id, day, night, timestamp[, message_id]),
+    # timestamp і message_id можуть бути None.
+    # Результат — список повідомлень у тому ж порядку, що й save_meter_data_and_bill
+    # повернула б для кожного показника, якби їх обробляли по одному.
+    readings = [(str(r[0]), r[1], r[2], r[3] or datetime.now(), r[4] if len(r) > 4 else None) for r in readings]
+    if not readings:
+        return []
+    return in_write_transaction(_save_readings, readings)
+
+
+def _save_readings(conn, readings):
+    cursor = conn.cursor(dictionary=True)
+    settings = iter(tariffs_at(conn, [r[3] for r in readings]))
+    # Ключі по порядку: паралельні пакети блокують лічильники в однаковій послідовності
+    state = _load_meter_state(cursor, sorted(set(r[0] for r in readings)))
+    processed = load_processed(cursor, list(dict.fromkeys(r[4] for r in readings if r[4] is not None)))
+
+    results = []
+    history_rows = []
+    bill_rows = []
+    rollup_rows = []
+    meter_rows = {}
+    new_ids, new_id_meters = [], []
+
+    for meter_id, new_day, new_night, ts, message_id in readings:
+        rates = next(settings)
+        if message_id is not None:
+            # Уже враховані (в т.ч. двічі в одному пакеті) повідомлення пропускаємо
+            if message_id in processed:
+                results.append(ALREADY_PROCESSED_MESSAGE)
+                continue
+            processed.add(message_id)
+            new_ids.append(message_id)
+            new_id_meters.append(meter_id)
+
+        if meter_id in state:
+            last_day, last_night = state[meter_id]
+            day_diff, night_diff, total_cost, fake_used = calculate_bill(
+                last_day, last_night, new_day, new_night, rates)
+            bill_rows.append((meter_id, ts, day_diff, night_diff, total_cost))
+            rollup_rows.append((meter_id, ts, day_diff, night_diff, total_cost, fake_used))
+            results.append(format_bill(day_diff, night_diff, total_cost, fake_used))
+        else:
+            results.append(NEW_METER_MESSAGE)
+
+        # Наступний показник цього ж лічильника в пакеті рахується від щойно збереженого;
+        # з колонки FLOAT він читався б як float, тож і тут тримаємо float
+        state[meter_id] = (float(new_day), float(new_night))
+        history_rows.append((meter_id, ts, new_day, new_night))
+        meter_rows[meter_id] = (meter_id, '000000', ts, new_day, new_night)
+
+    # Нові лічильники створюються з паролем за замовчуванням, існуючі лише оновлюються.
+    # Лічильники пишемо першими, бо на них посилаються історія та рахунки.
+    # Якщо весь пакет уже враховано, писати нічого
+    if history_rows:
+        cursor.executemany(get_backend().upsert(
+            'meters', ('meter_id', 'password', 'last_update', 'day_value', 'night_value'),
+            update=('last_update', 'day_value', 'night_value')
+        ), list(meter_rows.values()))
+
+        cursor.executemany(INSERT_HISTORY, history_rows)
+
+    if bill_rows:
+        cursor.executemany(INSERT_BILL, bill_rows)
+        update_rollups(cursor, rollup_rows)
+
+    if new_ids:
+        mark_processed(cursor, new_ids, new_id_meters, datetime.now())
+
+    conn.commit()
+    return results
+
+
+def save_anomalies(anomalies):
+    # anomalies: (meter_id, час показника, причина, оцінка) від anomaly.AnomalyDetector
+    if not anomalies:
+        return
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.executemany("""
+            INSERT INTO reading_anomalies (meter_id, reading_time, reason, score)
+            VALUES (%s, %s, %s, %s)
+        """, anomalies)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def get_anomalies(meter_id=None, limit=HISTORY_PAGE_SIZE):
+    # Останні підозрілі показники — усі або одного лічильника
+    conn = get_connection()
+    try:
+        cursor = conn.cursor(dictionary=True)
+        where, params = ("WHERE meter_id = %s", (meter_id,)) if meter_id is not None else ("", ())
+        cursor.execute(f"""
+            SELECT id, meter_id, reading_time, reason, score FROM reading_anomalies
+            {where}
+            ORDER BY reading_time DESC, id DESC
+            LIMIT %s
+        """, params + (limit,))
+        return cursor.fetchall()
+    finally:
+        conn.close()
+
+
+def get_all_meter_data():
+    conn = get_connection()
+    try:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("SELECT * FROM meter_readings_history ORDER BY reading_time DESC")
+        return cursor.fetchall()
+    finally:
+        conn.close()
+
+
+def _history_page(cursor, where, params, limit, before):
+    # Пагінація "за ключем": курсор — (reading_time, id) останнього показаного рядка.
+    # На відміну від OFFSET, вартість сторінки не залежить від того, як далеко ми гортаємо
+    if before is not None:
+        where += " AND (reading_time < %s OR (reading_time = %s AND id < %s))"
+        params += (before[0], before[0], before[1])
+    cursor.execute(f"""
+        SELECT id, meter_id, reading_time, day_value, night_value
+        FROM meter_readings_history
+        WHERE {where}
+        ORDER BY reading_time DESC, id DESC
+        LIMIT %s
+    """, params + (limit + 1,))
+    rows = cursor.fetchall()
+    # Зайвий рядок лише показує, що далі ще щось є
+    next_cursor = (rows[limit - 1]['reading_time'], rows[limit - 1]['id']) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def get_all_meter_data_page(limit=HISTORY_PAGE_SIZE, before=None):
+    # Сторінка історії всіх лічильників: (рядки, курсор наступної сторінки або None)
+    conn = get_connection()
+    try:
+        return _history_page(conn.cursor(dictionary=True), "1 = 1", (), limit, before)
+    finally:
+        conn.close()
+
+
+# Таблиці, які можна вивантажувати: назва -> (таблиця, колонка часу, колонки)
+EXPORT_TABLES = {
+    'history': ('meter_readings_history', 'reading_time',
+                ('id', 'meter_id', 'reading_time', 'day_value', 'night_value')),
+    'bills': ('bills', 'bill_time',
+              ('id', 'meter_id', 'bill_time', 'day_kwh_used', 'night_kwh_used', 'total_cost')),
+}
+
+
+def iter_export_rows(name, meter_ids=None, start=None, end=None, chunk_size=5000, conn=None, lock=False):
+    # Потокове читання для експорту: віддає рядки пачками по chunk_size.
+    # Курсор небуферизований, тож у пам'яті завжди лише одна пачка, а не вся таблиця.
+    # Можна передати з'єднання відкритої транзакції; lock=True блокує прочитані рядки до її commit
+    table, time_column, columns = EXPORT_TABLES[name]
+    where, params = ["1 = 1"], []
+    if meter_ids:
+        where.append(f"meter_id IN ({', '.join(['%s'] * len(meter_ids))})")
+        params.extend(meter_ids)
+    if start is not None:
+        where.append(f"{time_column} >= %s")
+        params.append(start)
+    if end is not None:
+        where.append(f"{time_column} < %s")
+        params.append(end)
+
+    own_conn = conn is None
+    if own_conn:
+        conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT {', '.join(columns)} FROM {table}
+            WHERE {' AND '.join(where)}
+            ORDER BY {time_column}, id
+        """ + (get_backend().for_update if lock else ""), tuple(params))
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        if own_conn:
+            conn.close()
+
+
+def get_consumption(meter_id, period='month', limit=12):
+    # Останні limit періодів споживання лічильника (від новіших до старіших) —
+    # читається limit рядків підсумків, а не всі рахунки
+    conn = get_connection()
+    try:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(f"""
+            SELECT period_start, day_kwh, night_kwh, cost, bills_count, fake_count
+            FROM {ROLLUP_TABLES[period]}
+            WHERE meter_id = %s
+            ORDER BY period_start DESC
+            LIMIT %s
+        """, (meter_id, limit))
+        return cursor.fetchall()
+    finally:
+        conn.close()
+
+
+def get_consumption_summary(period='month', since=None, until=None):
+    # Споживання всіх лічильників по періодах у межах [since, until)
+    where, params = ["1 = 1"], []
+    if since is not None:
+        where.append("period_start >= %s")
+        params.append(period_start(since, period))
+    if until is not None:
+        where.append("period_start < %s")
+        params.append(period_start(until, 'day'))
+    conn = get_connection()
+    try:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(f"""
+            SELECT {', '.join(ROLLUP_COLUMNS)}
+            FROM {ROLLUP_TABLES[period]}
+            WHERE {' AND '.join(where)}
+            ORDER BY meter_id, period_start
+        """, tuple(params))
+        return cursor.fetchall()
+    finally:
+        conn.close()
+
+
+def get_meter_history(meter_id):
+    conn = get_connection()
+    try:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("""
+            SELECT reading_time, day_value, night_value
+            FROM meter_readings_history
+            WHERE meter_id = %s
+            ORDER BY reading_time DESC
+        """, (meter_id,))
+        return cursor.fetchall()
+    finally:
+        conn.close()
+
+
+def get_meter_history_page(meter_id, limit=HISTORY_PAGE_SIZE, before=None):
+    # Сторінка історії одного лічильника; використовує індекс (meter_id, reading_time, id)
+    conn = get_connection()
+    try:
+        return _history_page(conn.cursor(dictionary=True), "meter_id = %s", (meter_id,), limit, before)
+    finally:
+        conn.close()
+
+
+def update_password(meter_id, old_password, new_password):
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+
+        # Перевірка старого паролю
+        cursor.execute("SELECT password FROM meters WHERE meter_id = %s", (meter_id,))
+        record = cursor.fetchone()
+
+        if not record:
+            return "Користувача не знайдено."
+
+        if record[0] != old_password:
+            return "Старий пароль невірний."
+
+        # Оновлення пароля
+        cursor.execute("UPDATE meters SET password = %s WHERE meter_id = %s", (new_password, meter_id))
+        conn.commit()
+        return "Пароль успішно змінено."
+    finally:
+        conn.close()
+
+def clear_meter_history(meter_id):
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+
+        # Знайти найновішу дату запису
+        cursor.execute("""
+            SELECT id FROM meter_readings_history 
+            WHERE meter_id = %s 
+            ORDER BY reading_time DESC 
+            LIMIT 1
+        """, (meter_id,))
+        last_record = cursor.fetchone()
+
+        if last_record:
+            last_id = last_record[0]
+
+            # Видалити всі інші записи крім найновішого
+            cursor.execute("""
+                DELETE FROM meter_readings_history 
+                WHERE meter_id = %s AND id != %s
+            """, (meter_id, last_id))
+            conn.commit()
+    finally:
+        conn.close()
+    
+def update_tariff(key, value):
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("UPDATE settings SET setting_value = %s WHERE setting_key = %s", (value, key))
+        conn.commit()
+    finally:
+        conn.close()
+    invalidate_settings_cache()
@@ -0,0 +1,97 @@
+import csv
+import argparse
+from datetime import datetime
+from db import EXPORT_TABLES, iter_export_rows
+from storage import set_backend, SQLiteBackend
+
+# pyarrow потрібен лише для Parquet/Arrow; CSV працює без нього
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# Типи колонок для Arrow-схеми
+ARROW_TYPES = {
+    'id': 'int64',
+    'meter_id': 'string',
+    'reading_time': 'timestamp',
+    'bill_time': 'timestamp',
+}
+
+
+def export_csv(name, path, chunks):
+    columns = EXPORT_TABLES[name][2]
+    count = 0
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for rows in chunks:
+            writer.writerows(rows)
+            count += len(rows)
+    return count
+
+
+def _arrow_schema(columns):
+    fields = []
+    for column in columns:
+        kind = ARROW_TYPES.get(column, 'float64')
+        if kind == 'timestamp':
+            fields.append(pa.field(column, pa.timestamp('us')))
+        elif kind == 'string':
+            fields.append(pa.field(column, pa.string()))
+        else:
+            fields.append(pa.field(column, getattr(pa, kind)()))
+    return pa.schema(fields)
+
+
+def export_arrow(name, path, chunks, file_format):
+    if pa is None:
+        raise RuntimeError("Для Parquet/Arrow потрібен пакет pyarrow")
+    columns = EXPORT_TABLES[name][2]
+    schema = _arrow_schema(columns)
+    if file_format == 'parquet':
+        writer = pq.ParquetWriter(path, schema)
+    else:
+        writer = pa.ipc.new_file(path, schema)
+
+    count = 0
+    try:
+        for rows in chunks:
+            # Кожна пачка стає окремою групою рядків у файлі й одразу скидається на диск
+            arrays = [pa.array([row[i] for row in rows], type=schema.field(i).type) for i in range(len(columns))]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            count += len(rows)
+    finally:
+        writer.close()
+    return count
+
+
+def export(name, path, file_format='csv', meter_ids=None, start=None, end=None, chunk_size=5000):
+    chunks = iter_export_rows(name, meter_ids, start, end, chunk_size)
+    if file_format == 'csv':
+        return export_csv(name, path, chunks)
+    return export_arrow(name, path, chunks, file_format)
+
+
+def parse_time(value):
+    return datetime.fromisoformat(value)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Потокове вивантаження історії показників і рахунків")
+    parser.add_argument('table', choices=sorted(EXPORT_TABLES), help="що вивантажувати")
+    parser.add_argument('output', help="шлях до файлу")
+    parser.add_argument('--format', choices=['csv', 'parquet', 'arrow'], default='csv')
+    parser.add_argument('--meter', action='append', dest='meters', help="ID лічильника (можна кілька разів)")
+    parser.add_argument('--from', dest='start', type=parse_time, help="з дати, напр. 2025-01-01")
+    parser.add_argument('--to', dest='end', type=parse_time, help="до дати (не включно)")
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    parser.add_argument('--sqlite', metavar='PATH', help="читати з вбудованого SQLite замість MySQL")
+    args = parser.parse_args()
+
+    if args.sqlite:
+        set_backend(SQLiteBackend(args.sqlite))
+
+    exported = export(args.table, args.output, args.format, args.meters, args.start, args.end, args.chunk_size)
+    print(f"Вивантажено {exported} рядків у {args.output}")
@@ -0,0 +1,216 @@
+import sys
+import json
+import math
+import asyncio
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from process_queue import process_batch, shard_for
+from anomaly import AnomalyDetector
+from query_stats import start_metrics_server
+from config import METRICS_PORT
+
+# Адреса сервера прийому показників
+HOST = '127.0.0.1'
+PORT = 8765
+
+# Кількість паралельних обробників (не більше pool_size з DB_CONFIG),
+# загальний розмір черги і максимальний розмір пакета для БД
+WORKERS = 4
+QUEUE_SIZE = 10000
+BATCH_SIZE = 200
+
+# Найдовший рядок JSON, який приймаємо, і найбільше тіло HTTP POST
+MAX_LINE = 64 * 1024
+MAX_BODY_BYTES = 8 * 1024 * 1024
+
+
+def _number(value, name):
+    # float() приймає і "NaN"/"inf" — такі показники зіпсували б рахунки й підсумки
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} має бути числом")
+    if not math.isfinite(number):
+        raise ValueError(f"{name} має бути скінченним числом")
+    return number
+
+
+def parse_reading(line):
+    # Рядок JSON {'meter_id', 'day_value', 'night_value'[, 'message_id']} -> повідомлення для обробника.
+    # Лічильник з N регістрами замість day_value/night_value надсилає {'registers': {назва: значення}}.
+    # З message_id клієнт може безпечно повторити відправку: вдруге показник не врахується.
+    # 'timestamp' — момент надходження: за ним показник рахується і перевіряється на аномалії
+    data = json.loads(line)
+    if not isinstance(data, dict):
+        raise ValueError("очікується JSON-об'єкт")
+    try:
+        meter_id = str(data['meter_id']).strip()
+        # Як і ReadingLog.append: meter_id у БД — VARCHAR(20)
+        if not meter_id or len(meter_id) > 20:
+            raise ValueError("ID лічильника має містити від 1 до 20 символів")
+        message = {'meter_id': meter_id, 'timestamp': datetime.now()}
+        if 'registers' in data:
+            registers = data['registers']
+            if not isinstance(registers, dict) or not registers:
+                raise ValueError("registers має бути непорожнім об'єктом")
+            if any(len(str(name)) > 20 for name in registers):
+                raise ValueError("назва регістра довша за 20 символів")
+            message['registers'] = {str(name): _number(value, str(name)) for name, value in registers.items()}
+        else:
+            message['day_value'] = _number(data['day_value'], 'day_value')
+            message['night_value'] = _number(data['night_value'], 'night_value')
+    except KeyError as e:
+        raise ValueError(f"відсутнє поле {e}")
+    if data.get('message_id') is not None:
+        message['message_id'] = str(data['message_id'])
+        if len(message['message_id']) > 36:
+            raise ValueError("message_id довший за 36 символів")
+    return message
+
+
+# Асинхронний сервер прийому показників.
+# Приймає JSON по одному показнику в рядку або напряму по TCP (відповідь OK/ERROR
+# на кожен рядок), або тілом HTTP POST (відповідь 202 з кількістю прийнятих).
+# Черги обмежені: коли БД не встигає, сервер перестає читати з сокетів
+# і клієнти пригальмовуються самим TCP.
+class IngestServer:
+    def __init__(self, host=HOST, port=PORT, workers=WORKERS, queue_size=QUEUE_SIZE, batch_size=BATCH_SIZE):
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.batch_size = batch_size
+        # Окрема черга на кожен обробник — показники одного лічильника йдуть по порядку
+        self.queues = [asyncio.Queue(maxsize=max(1, queue_size // workers)) for _ in range(workers)]
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.server = None
+        self.consumers = []
+        self.stats = {'accepted': 0, 'rejected': 0, 'processed': 0, 'batches': 0}
+
+    async def start(self):
+        # Свій детектор підозрілих показників на кожну чергу: лічильник завжди в одній черзі
+        self.consumers = [asyncio.create_task(self.consume(q, AnomalyDetector())) for q in self.queues]
+        self.server = await asyncio.start_server(self.handle_client, self.host, self.port, limit=MAX_LINE)
+        print(f"Сервер показників слухає {self.host}:{self.port}")
+
+    async def stop(self):
+        # Перестаємо приймати нові з'єднання, дочищаємо черги, зупиняємо обробників
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        for q in self.queues:
+            await q.join()
+        for task in self.consumers:
+            task.cancel()
+        await asyncio.gather(*self.consumers, return_exceptions=True)
+        self.executor.shutdown(wait=True)
+
+    async def submit(self, message):
+        # Якщо черга повна — чекаємо тут; це і є зворотний тиск на клієнта
+        await self.queues[shard_for(message['meter_id'], self.workers)].put(message)
+        self.stats['accepted'] += 1
+
+    async def consume(self, queue, detector):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < self.batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+            try:
+                # Блокуючий виклик БД виконується в окремому потоці, цикл подій вільний
+                await loop.run_in_executor(self.executor, process_batch, batch, False, detector)
+                self.stats['processed'] += len(batch)
+                self.stats['batches'] += 1
+            except Exception as e:
+                print(f"Помилка обробки пакета: {e}")
+            finally:
+                for _ in batch:
+                    queue.task_done()
+
+    async def handle_client(self, reader, writer):
+        try:
+            first = await reader.readline()
+            if first.startswith(b"POST "):
+                await self.handle_http(reader, writer)
+            else:
+                await self.handle_lines(first, reader, writer)
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle_lines(self, line, reader, writer):
+        # Режим "сирого" TCP: один JSON у рядку, відповідь на кожен рядок
+        while line:
+            if line.strip():
+                try:
+                    await self.submit(parse_reading(line))
+                    writer.write(b"OK\n")
+                except ValueError as e:
+                    self.stats['rejected'] += 1
+                    writer.write(f"ERROR {e}\n".encode())
+                await writer.drain()
+            line = await reader.readline()
+
+    async def handle_http(self, reader, writer):
+        # Мінімальний HTTP: POST з тілом у форматі JSON по рядках
+        length = None
+        while True:
+            header = await reader.readline()
+            if header in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = header.decode("latin-1").partition(":")
+            if name.strip().lower() == "content-length":
+                length = value.strip()
+
+        # Тіло читається цілком у пам'ять, тож його розмір має бути відомий і обмежений
+        if length is None or not length.isdigit():
+            await self.respond(writer, "400 Bad Request", {'error': "потрібен коректний Content-Length"})
+            return
+        length = int(length)
+        if length > MAX_BODY_BYTES:
+            await self.respond(writer, "413 Payload Too Large",
+                               {'error': f"тіло більше за {MAX_BODY_BYTES} байтів"})
+            return
+
+        body = await reader.readexactly(length) if length else b""
+        accepted, errors = 0, []
+        for number, line in enumerate(body.splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                await self.submit(parse_reading(line))
+                accepted += 1
+            except ValueError as e:
+                self.stats['rejected'] += 1
+                errors.append({'line': number, 'error': str(e)})
+
+        await self.respond(writer, "202 Accepted", {'accepted': accepted, 'errors': errors})
+
+    async def respond(self, writer, status, data):
+        payload = json.dumps(data, ensure_ascii=False).encode()
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n".encode()
+            + f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode()
+            + payload
+        )
+        await writer.drain()
+
+
+async def main(port=PORT):
+    server = IngestServer(port=port)
+    await server.start()
+    if METRICS_PORT:
+        # Статистика запитів до БД: http://127.0.0.1:METRICS_PORT/metrics
+        start_metrics_server(METRICS_PORT)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+        print(f"Сервер зупинено: {server.stats}")
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else PORT))
+    except KeyboardInterrupt:
+        pass
@@ -1,58 +1,274 @@
 import time
+import uuid
 import random
+import argparse
 import threading
-from queue import Queue
-from db import save_meter_data_and_bill, get_meter, add_meter
+from datetime import datetime
+from queue import Queue, Empty
+from db import save_meter_readings_bulk, get_meter, add_meter, save_anomalies
+from storage import is_data_error
+from reading_log import ReadingLog, RETRY_DELAY
+from tariffs import save_register_readings
+from anomaly import AnomalyDetector
+from query_stats import start_reporter
+
+# Кількість потоків-обробників і максимальний розмір пакета, що йде в БД за раз
+WORKERS = 4
+BATCH_SIZE = 200
+
+# Сигнал завершення: після нього обробники дочищають свої черги і виходять
+STOP = None
 
 # Створюємо чергу
 message_queue = Queue()
 
-# Функція-генератор тестових даних
-def generate_test_data():
-    while True:
-        meter_id = str(random.randint(1, 5))  # Рандомний ID від 1 до 10
-        meter = get_meter(meter_id)
-        
-        if meter:
-            # Якщо лічильник існує, генеруємо нові показники більші за попередні
-            prev_day = meter['day_value']
-            prev_night = meter['night_value']
-            day_value = prev_day + random.randint(-20, 50)
-            night_value = prev_night + random.randint(-20, 50)
-        else:
-            # Якщо лічильник новий, додаємо його з початковими показниками і паролем "000000"
-            day_value = random.randint(0, 50)
-            night_value = random.randint(0, 50)
-            add_meter(meter_id, "000000", day_value, night_value)
-        
+
+def next_reading(prev_day, prev_night, backward_fraction=0.0):
+    # Наступні показники: зазвичай більші за попередні, але з імовірністю
+    # backward_fraction — менші, щоб перевірити гілку "накрутки"
+    if random.random() < backward_fraction:
+        return prev_day - random.randint(1, 20), prev_night - random.randint(1, 20)
+    return prev_day + random.randint(0, 50), prev_night + random.randint(0, 50)
+
+
+# Функція-генератор тестових даних (генератор навантаження)
+# meters — кількість лічильників, rate — показників за секунду,
+# backward_fraction — частка "зменшених" показників, duration — тривалість у секундах (None — безкінечно),
+# send — куди віддавати повідомлення (за замовчуванням — у message_queue)
+def generate_test_data(meters=5, rate=0.2, backward_fraction=0.3, duration=None, verbose=True, send=None):
+    send = send or message_queue.put
+    last = {}  # meter_id -> (day, night): стан тримаємо в пам'яті, а не читаємо з БД щоразу
+    interval = 1.0 / rate
+    start = time.monotonic()
+    next_send = start
+    sent = 0
+
+    while duration is None or time.monotonic() - start < duration:
+        meter_id = str(random.randint(1, meters))
+
+        if meter_id not in last:
+            meter = get_meter(meter_id)
+            if meter:
+                last[meter_id] = (meter['day_value'], meter['night_value'])
+            else:
+                # Якщо лічильник новий, додаємо його з початковими показниками і паролем "000000"
+                day_value = random.randint(0, 50)
+                night_value = random.randint(0, 50)
+                add_meter(meter_id, "000000", day_value, night_value)
+                last[meter_id] = (day_value, night_value)
+
+        day_value, night_value = next_reading(*last[meter_id], backward_fraction)
+        last[meter_id] = (day_value, night_value)
+
         message = {
+            'message_id': uuid.uuid4().hex,
             'meter_id': meter_id,
             'day_value': day_value,
-            'night_value': night_value
+            'night_value': night_value,
+            'timestamp': datetime.now()
         }
-        message_queue.put(message)
-        print(f"Sent: {message}")
-        time.sleep(5)  # Відправляємо кожні 5 секунд
+        send(message)
+        sent += 1
+        if verbose:
+            print(f"Sent: {message}")
+
+        # Тримаємо заданий темп незалежно від того, скільки зайняла ітерація
+        next_send += interval
+        delay = next_send - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    return sent
+
+
+def _save_plain(batch):
+    # Пакет повідомлень -> один виклик save_meter_readings_bulk
+    # message_id (якщо є) — ключ ідемпотентності: повторна доставка не створить другий рахунок
+    readings = [(m['meter_id'], m['day_value'], m['night_value'], m.get('timestamp'), m.get('message_id'))
+                for m in batch]
+    try:
+        return save_meter_readings_bulk(readings)
+    except Exception as e:
+        # Недоступна БД — не помилка показника: пакет повторить _worker, а не обробка по одному
+        if not is_data_error(e):
+            raise
+        # Пакет відкотився цілком через дані — обробляємо по одному, щоб знайти "поганий" показник
+        print(f"Помилка пакета ({len(batch)} шт.): {e}. Обробка по одному.")
+        results = []
+        for reading in readings:
+            try:
+                results.extend(save_meter_readings_bulk([reading]))
+            except Exception as row_error:
+                if not is_data_error(row_error):
+                    raise
+                results.append(f"Помилка: {row_error}")
+        return results
+
+
+def _save_registers(batch):
+    # Лічильники з N регістрами ({'registers': {назва: значення}}) рахуються за тарифними зонами
+    readings = [(m['meter_id'], m['registers'], m.get('timestamp'), m.get('message_id')) for m in batch]
+    try:
+        return save_register_readings(readings)
+    except Exception as e:
+        if not is_data_error(e):
+            raise
+        print(f"Помилка пакета ({len(batch)} шт.): {e}. Обробка по одному.")
+        results = []
+        for reading in readings:
+            try:
+                results.extend(save_register_readings([reading]))
+            except Exception as row_error:
+                if not is_data_error(row_error):
+                    raise
+                results.append(f"Помилка: {row_error}")
+        return results
+
+
+def process_batch(batch, verbose=True, detector=None):
+    # Звичайні показники (день/ніч) і показники з регістрами йдуть окремими пакетами,
+    # результати повертаються в порядку повідомлень.
+    # detector (AnomalyDetector) перевіряє показники після рахунку (пакет, що не зберігся через
+    # недоступну БД, прийде ще раз); підозрілі рахуються як зазвичай, але записуються
+    # в reading_anomalies для перевірки
+    plain = [i for i, m in enumerate(batch) if 'registers' not in m]
+    registers = [i for i, m in enumerate(batch) if 'registers' in m]
+    results = [None] * len(batch)
+    for indexes, save in ((plain, _save_plain), (registers, _save_registers)):
+        if indexes:
+            for i, result in zip(indexes, save([batch[i] for i in indexes])):
+                results[i] = result
+
+    anomalies = detector.check_batch(batch) if detector is not None else []
+    if anomalies:
+        try:
+            save_anomalies(anomalies)
+        except Exception as e:
+            print(f"Не вдалося зберегти підозрілі показники ({len(anomalies)} шт.): {e}")
+
+    if verbose:
+        for data, result in zip(batch, results):
+            print(f"Processed: {data} -> {result}")
+        for meter_id, _, reason, score in anomalies:
+            print(f"Підозрілий показник: {meter_id} ({reason}, {score:.2f})")
+    return results
+
+
+def _worker(inbox, batch_size, verbose=True, detector=None):
+    while True:
+        # Блокуюче очікування: жодного холостого опитування черги
+        first = inbox.get()
+        if first is STOP:
+            return
+
+        # Забираємо все, що вже накопичилось, але не більше batch_size
+        batch = [first]
+        stop = False
+        while len(batch) < batch_size:
+            try:
+                data = inbox.get_nowait()
+            except Empty:
+                break
+            if data is STOP:
+                stop = True
+                break
+            batch.append(data)
+
+        # Поки БД недоступна, пакет повторюється: показники не губляться, а message_id
+        # (генератор ставить його кожному повідомленню) не дасть порахувати їх двічі
+        while True:
+            try:
+                process_batch(batch, verbose, detector)
+                break
+            except Exception as e:
+                print(f"Пакет не збережено ({len(batch)} шт.): {e}. Повтор через {RETRY_DELAY} с.")
+                time.sleep(RETRY_DELAY)
+        if stop:
+            return
+
+
+def shard_for(meter_id, workers):
+    # Один лічильник завжди потрапляє до одного обробника — так зберігається порядок його показників
+    return hash(str(meter_id)) % workers
+
 
 # Функція-обробник черги
-def process_queue():
+# detect=True — перед рахунком шукати підозрілі показники (свій детектор у кожного обробника:
+# лічильник завжди потрапляє до того самого, тож блокування не потрібні).
+# За замовчуванням вимкнено: генератор додає до 50 кВт·год на регістр за показник кожні кілька
+# секунд, тож для ANOMALY_MAX_KW майже кожен його показник — "стрибок"
+def process_queue(workers=WORKERS, batch_size=BATCH_SIZE, verbose=True, detect=False):
+    inboxes = [Queue() for _ in range(workers)]
+    threads = [threading.Thread(target=_worker,
+                                args=(inbox, batch_size, verbose, AnomalyDetector() if detect else None))
+               for inbox in inboxes]
+    for thread in threads:
+        thread.start()
+
+    # Розподіляємо повідомлення між обробниками за meter_id, поки не прийде STOP
     while True:
-        if not message_queue.empty():
-            data = message_queue.get()
-            meter_id = data['meter_id']
-            day_value = data['day_value']
-            night_value = data['night_value']
-            result = save_meter_data_and_bill(meter_id, day_value, night_value)
-            print(f"Processed: {data} -> {result}")
-        time.sleep(1)  # Перевіряємо чергу кожну секунду
+        data = message_queue.get()
+        if data is STOP:
+            break
+        inboxes[shard_for(data['meter_id'], workers)].put(data)
+
+    for inbox in inboxes:
+        inbox.put(STOP)
+    for thread in threads:
+        thread.join()
+
+
+def stop_processing():
+    # Коректне завершення: усе, що вже в черзі, буде оброблено
+    message_queue.put(STOP)
+
 
 # Запускаємо генератор і обробник у окремих потоках
 if __name__ == "__main__":
-    generator_thread = threading.Thread(target=generate_test_data)
-    processor_thread = threading.Thread(target=process_queue)
+    parser = argparse.ArgumentParser(description="Генератор навантаження та обробник черги показників")
+    parser.add_argument('--meters', type=int, default=5, help="кількість лічильників")
+    parser.add_argument('--rate', type=float, default=0.2, help="показників за секунду")
+    parser.add_argument('--backward', type=float, default=0.3, help="частка зменшених показників")
+    parser.add_argument('--duration', type=float, default=None, help="тривалість генерації, с")
+    parser.add_argument('--quiet', action='store_true', help="не друкувати кожне повідомлення")
+    parser.add_argument('--wal', metavar='PATH', help="спершу писати показники в локальний журнал, а в БД — з нього")
+    parser.add_argument('--stats', type=float, metavar='SEC', help="друкувати найдорожчі запити до БД кожні SEC секунд")
+    parser.add_argument('--detect', action='store_true',
+                        help="шукати підозрілі показники (з випадковими даними генератора майже всі — \"стрибки\")")
+    args = parser.parse_args()
+
+    if args.stats:
+        start_reporter(args.stats)
+
+    if args.wal:
+        # Генератор пише лише в журнал на диску і не залежить від швидкості БД;
+        # фоновий потік переносить журнал у БД і повторює спроби, якщо вона недоступна
+        log = ReadingLog(args.wal, AnomalyDetector() if args.detect else None)
+        log.start_drainer(interval=0.5, verbose=not args.quiet)
+        try:
+            generate_test_data(args.meters, args.rate, args.backward, args.duration, not args.quiet,
+                               send=lambda m: log.append(m['meter_id'], m['day_value'], m['night_value'],
+                                                          m['timestamp'], m['message_id']))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            log.close()
+    else:
+        def generate():
+            generate_test_data(args.meters, args.rate, args.backward, args.duration, not args.quiet)
+            # Генерацію завершено — обробник дочищає чергу і зупиняється
+            stop_processing()
+
+        generator_thread = threading.Thread(target=generate, daemon=True)
+        processor_thread = threading.Thread(target=process_queue,
+                                            kwargs={'verbose': not args.quiet, 'detect': args.detect})
 
-    generator_thread.start()
-    processor_thread.start()
+        generator_thread.start()
+        processor_thread.start()
 
-    generator_thread.join()
-    processor_thread.join()
\ No newline at end of file
+        try:
+            while processor_thread.is_alive():
+                processor_thread.join(timeout=1)
+        except KeyboardInterrupt:
+            stop_processing()
+            processor_thread.join()
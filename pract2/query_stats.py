@@ -0,0 +1,252 @@
+import re
+import time
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from config import SLOW_QUERY_MS, SLOW_QUERY_LOG
+
+# Межі кошиків гістограм тривалості, с (як у Prometheus: кількість значень <= межі)
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Таблиця після FROM/INTO/UPDATE — друга частина мітки запиту
+_TABLE_RE = re.compile(r"\b(?:FROM|INTO|UPDATE)\s+(\w+)", re.IGNORECASE)
+
+_lock = threading.Lock()
+_slow_lock = threading.Lock()
+# мітка запиту -> {'count', 'errors', 'rows', 'sum', 'max', 'buckets'}
+_queries = {}
+# Час отримання з'єднання з пулу — окрема гістограма
+_acquire = None
+# Кеш міток: текст SQL -> мітка (запити в db.py — фіксовані рядки)
+_labels = {}
+
+
+def _new_histogram():
+    return {'count': 0, 'errors': 0, 'rows': 0, 'sum': 0.0, 'max': 0.0, 'buckets': [0] * len(BUCKETS)}
+
+
+def _observe(histogram, seconds):
+    histogram['count'] += 1
+    histogram['sum'] += seconds
+    histogram['max'] = max(histogram['max'], seconds)
+    for i, bound in enumerate(BUCKETS):
+        if seconds <= bound:
+            histogram['buckets'][i] += 1
+            break
+
+
+def query_label(sql):
+    # "SELECT meters", "INSERT bills", "UPDATE settings"... — без параметрів і пробілів,
+    # щоб однакові запити з різними значеннями потрапляли в один рядок статистики
+    label = _labels.get(sql)
+    if label is None:
+        words = sql.split(None, 1)
+        verb = words[0].upper() if words else '?'
+        match = _TABLE_RE.search(sql)
+        label = f"{verb} {match.group(1)}" if match else verb
+        if len(_labels) < 1000:
+            _labels[sql] = label
+    return label
+
+
+def record_query(label, seconds, rows=0, error=False, sql=None):
+    with _lock:
+        histogram = _queries.get(label)
+        if histogram is None:
+            histogram = _queries[label] = _new_histogram()
+        _observe(histogram, seconds)
+        histogram['rows'] += max(rows, 0)
+        if error:
+            histogram['errors'] += 1
+    if SLOW_QUERY_LOG and seconds * 1000 >= SLOW_QUERY_MS:
+        _log_slow(label, seconds, rows, sql)
+
+
+def record_rows(label, rows):
+    # Для SELECT кількість рядків відома лише після fetch
+    with _lock:
+        if label in _queries:
+            _queries[label]['rows'] += rows
+
+
+def record_acquire(seconds):
+    global _acquire
+    with _lock:
+        if _acquire is None:
+            _acquire = _new_histogram()
+        _observe(_acquire, seconds)
+
+
+def _log_slow(label, seconds, rows, sql):
+    # Параметри не пишемо — серед них бувають паролі
+    text = " ".join((sql or "").split())[:500]
+    line = f"{datetime.now().isoformat(' ', 'seconds')}\t{seconds * 1000:.1f} ms\t{label}\trows={rows}\t{text}\n"
+    with _slow_lock:
+        with open(SLOW_QUERY_LOG, 'a', encoding='utf-8') as f:
+            f.write(line)
+
+
+def snapshot():
+    # Копія статистики: {'queries': {мітка: {...}}, 'acquire': {...} або None}
+    with _lock:
+        return {
+            'queries': {label: dict(h, buckets=list(h['buckets'])) for label, h in _queries.items()},
+            'acquire': None if _acquire is None else dict(_acquire, buckets=list(_acquire['buckets'])),
+        }
+
+
+def reset():
+    global _acquire
+    with _lock:
+        _queries.clear()
+        _acquire = None
+
+
+def total_queries(stats=None):
+    stats = stats or snapshot()
+    return sum(h['count'] for h in stats['queries'].values())
+
+
+def _prometheus_histogram(lines, name, histogram, labels=""):
+    cumulative = 0
+    for bound, count in zip(BUCKETS, histogram['buckets']):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{labels}le="{bound}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{{labels}le="+Inf"}} {histogram["count"]}')
+    plain = f"{{{labels.rstrip(',')}}}" if labels else ""
+    lines.append(f"{name}_sum{plain} {histogram['sum']}")
+    lines.append(f"{name}_count{plain} {histogram['count']}")
+
+
+def prometheus_text():
+    # Статистика у текстовому форматі Prometheus
+    stats = snapshot()
+    lines = ["# TYPE db_query_duration_seconds histogram"]
+    for label, histogram in sorted(stats['queries'].items()):
+        _prometheus_histogram(lines, "db_query_duration_seconds", histogram, f'query="{label}",')
+    lines.append("# TYPE db_query_rows_total counter")
+    for label, histogram in sorted(stats['queries'].items()):
+        lines.append(f'db_query_rows_total{{query="{label}"}} {histogram["rows"]}')
+    lines.append("# TYPE db_query_errors_total counter")
+    for label, histogram in sorted(stats['queries'].items()):
+        lines.append(f'db_query_errors_total{{query="{label}"}} {histogram["errors"]}')
+    if stats['acquire'] is not None:
+        lines.append("# TYPE db_connection_acquire_seconds histogram")
+        _prometheus_histogram(lines, "db_connection_acquire_seconds", stats['acquire'])
+    return "\n".join(lines) + "\n"
+
+
+def format_report(limit=10):
+    # Найдорожчі запити за сумарним часом — для періодичного виводу в лог
+    stats = snapshot()
+    top = sorted(stats['queries'].items(), key=lambda item: item[1]['sum'], reverse=True)[:limit]
+    lines = [f"{'Запит':<40} {'К-сть':>8} {'Сума, мс':>10} {'Сер., мс':>9} {'Макс, мс':>9} {'Рядків':>8}"]
+    for label, h in top:
+        lines.append(f"{label:<40} {h['count']:>8} {h['sum'] * 1000:>10.1f} "
+                     f"{h['sum'] / h['count'] * 1000:>9.2f} {h['max'] * 1000:>9.2f} {h['rows']:>8}")
+    acquire = stats['acquire']
+    if acquire is not None and acquire['count']:
+        lines.append(f"Отримання з'єднання: {acquire['count']} раз, сер. {acquire['sum'] / acquire['count'] * 1000:.2f} мс, "
+                     f"макс. {acquire['max'] * 1000:.2f} мс")
+    return "\n".join(lines)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = prometheus_text().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port, host='127.0.0.1'):
+    # GET http://host:port/metrics — статистика для Prometheus; сервер працює у фоновому потоці
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start_reporter(interval=60.0):
+    # Альтернатива без Prometheus: раз на interval секунд друкує найдорожчі запити
+    def report():
+        while True:
+            time.sleep(interval)
+            print(format_report())
+
+    threading.Thread(target=report, daemon=True).start()
+
+
+class InstrumentedCursor:
+    # Курсор, що міряє кожен execute/executemany; решта викликів іде до справжнього курсора
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._label = None
+
+    def _run(self, method, sql, params):
+        self._label = query_label(sql)
+        started = time.perf_counter()
+        try:
+            result = method(sql, params)
+        except Exception:
+            record_query(self._label, time.perf_counter() - started, error=True, sql=sql)
+            raise
+        # Для SELECT rowcount до fetch ще невідомий — рядки рахуються у fetch*()
+        rows = 0 if self._label.startswith('SELECT') else self._cursor.rowcount
+        record_query(self._label, time.perf_counter() - started, rows, sql=sql)
+        return result
+
+    def execute(self, sql, params=()):
+        return self._run(self._cursor.execute, sql, params)
+
+    def executemany(self, sql, rows):
+        return self._run(self._cursor.executemany, sql, rows)
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            record_rows(self._label, 1)
+        return row
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        record_rows(self._label, len(rows))
+        return rows
+
+    def fetchmany(self, size=1):
+        rows = self._cursor.fetchmany(size)
+        record_rows(self._label, len(rows))
+        return rows
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class InstrumentedConnection:
+    # З'єднання, чиї курсори інструментовані; commit теж міряється — це fsync на сервері
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def cursor(self, *args, **kwargs):
+        return InstrumentedCursor(self._conn.cursor(*args, **kwargs))
+
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            self._conn.commit()
+        except Exception:
+            record_query("COMMIT", time.perf_counter() - started, error=True)
+            raise
+        record_query("COMMIT", time.perf_counter() - started)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
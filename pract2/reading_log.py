@@ -0,0 +1,309 @@
+import os
+import json
+import math
+import uuid
+import threading
+from datetime import datetime
+from db import save_meter_readings_bulk, save_anomalies
+from storage import is_data_error
+
+# Скільки записів журналу переносити в БД одним пакетом
+DRAIN_BATCH = 500
+# Пауза перед повторною спробою, якщо БД недоступна, с
+RETRY_DELAY = 5.0
+# Скільки останніх результатів пам'ятати для save()
+RESULTS_KEPT = 10000
+
+LOGGED_MESSAGE = "Показники збережено локально. Рахунок буде сформовано, щойно з'явиться зв'язок з БД."
+REJECTED_MESSAGE = "Показник відхилено"
+
+
+# Локальний журнал показників (write-ahead log).
+# Показник спершу дописується в кінець файлу і скидається на диск (fsync), і лише потім
+# переноситься в БД. Поки БД повільна чи недоступна, запис у журнал не чекає на неї.
+# Кожен запис має message_id — ключ ідемпотентності: якщо процес упаде між записом у БД
+# і збереженням позиції, повторний перенос не створить другий рахунок.
+# Записи, які БД відкидає через самі дані, переносяться у файл path + '.failed',
+# щоб не затримувати показники після них.
+# detector (AnomalyDetector) перевіряє показники під час переносу, як process_batch().
+# Один файл журналу — для одного процесу.
+class ReadingLog:
+    def __init__(self, path, detector=None):
+        self.path = path
+        self.detector = detector
+        # Позиція (байт), до якої журнал уже перенесено в БД
+        self.offset_path = path + '.offset'
+        # Записи, які не вдалося зберегти через помилку в даних (JSON по рядку, з текстом помилки;
+        # пошкоджений рядок журналу — дослівно в полі raw)
+        self.failed_path = path + '.failed'
+        self.write_lock = threading.Lock()
+        self.drain_lock = threading.Lock()
+        self.sync_cond = threading.Condition()
+        self.written = 0
+        self.synced = 0
+        self.syncing = False
+        self.results = {}
+        self.wake = threading.Event()
+        self.stopping = False
+        self.drainer = None
+        self._repair()
+        self.file = open(path, 'ab')
+
+    def _repair(self):
+        # Недописаний останній рядок (збій посеред запису) відкидаємо:
+        # append() для нього не повернувся, тож ніхто не вважає його збереженим
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb+') as f:
+            end = f.seek(0, os.SEEK_END)
+            position = end
+            while position > 0:
+                step = min(4096, position)
+                f.seek(position - step)
+                chunk = f.read(step)
+                newline = chunk.rfind(b'\n')
+                if newline != -1:
+                    position = position - step + newline + 1
+                    break
+                position -= step
+            if position != end:
+                f.truncate(position)
+                os.fsync(f.fileno())
+
+    def append(self, meter_id, day_value, night_value, timestamp=None, message_id=None):
+        # Повертає message_id, коли запис уже на диску
+        meter_id = str(meter_id).strip()
+        if not meter_id or len(meter_id) > 20:
+            raise ValueError("ID лічильника має містити від 1 до 20 символів")
+        day_value, night_value = float(day_value), float(night_value)
+        if not (math.isfinite(day_value) and math.isfinite(night_value)):
+            raise ValueError("Показники мають бути скінченними числами")
+
+        message_id = message_id or uuid.uuid4().hex
+        record = {
+            'id': message_id,
+            'meter_id': meter_id,
+            'day_value': day_value,
+            'night_value': night_value,
+            'timestamp': (timestamp or datetime.now()).isoformat(),
+        }
+        line = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+
+        with self.write_lock:
+            self.file.write(line)
+            self.file.flush()
+            self.written += 1
+            sequence = self.written
+        self._sync(sequence)
+        self.wake.set()
+        return message_id
+
+    def _sync(self, sequence):
+        # Групове fsync: потік, що дійшов першим, скидає на диск усе записане на цей момент,
+        # решта лише чекає на нього. Під навантаженням один fsync покриває багато записів
+        with self.sync_cond:
+            while self.synced < sequence:
+                if self.syncing:
+                    self.sync_cond.wait()
+                    continue
+                self.syncing = True
+                target = self.written
+                synced = False
+                self.sync_cond.release()
+                try:
+                    os.fsync(self.file.fileno())
+                    synced = True
+                finally:
+                    self.sync_cond.acquire()
+                    self.syncing = False
+                    if synced:
+                        self.synced = max(self.synced, target)
+                    self.sync_cond.notify_all()
+
+    def _read_offset(self):
+        try:
+            with open(self.offset_path) as f:
+                offset = int(f.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+        # Позиція за межами файлу можлива лише після збою під час стиснення —
+        # тоді переносимо все спочатку, повтори відсіють ключі ідемпотентності
+        return offset if offset <= os.path.getsize(self.path) else 0
+
+    def _write_offset(self, offset):
+        temp_path = self.offset_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            f.write(str(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.offset_path)
+
+    def _read_records(self, offset, limit):
+        records = []
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            while len(records) < limit:
+                line = f.readline()
+                # Рядок без \n ще дописується — його заберемо наступного разу
+                if not line.endswith(b'\n'):
+                    break
+                offset += len(line)
+                if not line.strip():
+                    continue
+                # Пошкоджений рядок (не JSON-об'єкт) не повинен зупиняти перенос решти —
+                # він іде у failed_path як є, а позиція зсувається за нього
+                try:
+                    record = json.loads(line)
+                    if not isinstance(record, dict):
+                        raise ValueError("запис журналу має бути JSON-об'єктом")
+                except ValueError as e:
+                    self._write_failed_line(line, e)
+                    continue
+                records.append(record)
+        return records, offset
+
+    def pending(self):
+        # Скільки байтів журналу ще не перенесено в БД
+        return os.path.getsize(self.path) - self._read_offset()
+
+    def drain(self, batch_size=DRAIN_BATCH):
+        # Переносить у БД усе, що є в журналі. Повертає {message_id: повідомлення про рахунок}.
+        # Якщо БД недоступна — виняток, а показники лишаються в журналі
+        with self.drain_lock:
+            applied = {}
+            offset = self._read_offset()
+            while True:
+                records, end = self._read_records(offset, batch_size)
+                # Пакет може складатися лише з пошкоджених рядків — тоді записів немає, але позиція зсувається
+                if end == offset:
+                    break
+                results = self._apply(records)
+                anomalies = self._check(records)
+                if anomalies:
+                    try:
+                        save_anomalies(anomalies)
+                    except Exception as e:
+                        print(f"Не вдалося зберегти підозрілі показники ({len(anomalies)} шт.): {e}")
+                # Позицію зсуваємо лише після commit у БД
+                self._write_offset(end)
+                offset = end
+                for record, result in zip(records, results):
+                    applied[record.get('id')] = result
+
+            self._compact(offset)
+            self.results.update(applied)
+            while len(self.results) > RESULTS_KEPT:
+                del self.results[next(iter(self.results))]
+            return applied
+
+    def _check(self, records):
+        # Лише після commit пакета: якщо БД недоступна, пакет прийде ще раз,
+        # і детектор не повинен бачити ті самі показники двічі
+        if self.detector is None:
+            return []
+        messages = []
+        for record in records:
+            try:
+                meter_id, day_value, night_value, moment, _ = self._reading(record)
+                messages.append({'meter_id': meter_id, 'day_value': float(day_value),
+                                 'night_value': float(night_value), 'timestamp': moment})
+            except (KeyError, TypeError, ValueError):
+                # Некоректний запис перевірить і відхилить _apply()
+                continue
+        return self.detector.check_batch(messages)
+
+    def _apply(self, records):
+        # Пакет одним bulk-запитом; якщо його відкинуто через дані — кожен запис окремо,
+        # а записи, що й поодинці не проходять, — у failed_path.
+        # Помилки доступу до БД передаються далі: тоді весь пакет лишається в журналі
+        try:
+            return save_meter_readings_bulk([self._reading(r) for r in records])
+        except Exception as e:
+            if not is_data_error(e):
+                raise
+        results = []
+        for record in records:
+            try:
+                results.extend(save_meter_readings_bulk([self._reading(record)]))
+            except Exception as e:
+                if not is_data_error(e):
+                    raise
+                self._write_failed(record, e)
+                results.append(f"{REJECTED_MESSAGE}: {e}")
+        return results
+
+    @staticmethod
+    def _reading(record):
+        return (record['meter_id'], record['day_value'], record['night_value'],
+                datetime.fromisoformat(record['timestamp']), record['id'])
+
+    def _write_failed(self, record, error):
+        # Повтор після збою може дописати той самий запис ще раз — розбирати failed_path варто за id
+        print(f"Показник {record.get('id')} відхилено і перенесено в {self.failed_path}: {error}")
+        self._append_failed(dict(record, error=str(error)))
+
+    def _write_failed_line(self, line, error):
+        # Рядок, який не розбирається як запис, зберігаємо дослівно в полі raw
+        print(f"Пошкоджений рядок журналу перенесено в {self.failed_path}: {error}")
+        self._append_failed({'raw': line.decode('utf-8', errors='replace').rstrip('\r\n'), 'error': str(error)})
+
+    def _append_failed(self, entry):
+        line = json.dumps(entry, ensure_ascii=False) + '\n'
+        with open(self.failed_path, 'a', encoding='utf-8') as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _compact(self, offset):
+        # Увесь журнал перенесено — обрізаємо файл, щоб він не ріс безкінечно.
+        # Спершу позиція 0, потім обрізання: збій між ними дасть лише безпечний повтор
+        with self.write_lock:
+            if offset == 0 or offset != os.fstat(self.file.fileno()).st_size:
+                return
+            self._write_offset(0)
+            self.file.truncate(0)
+            os.fsync(self.file.fileno())
+
+    def save(self, meter_id, day_value, night_value):
+        # Для вікон: показник спершу в журнал, потім одразу спроба перенести його в БД.
+        # Повертає повідомлення про рахунок або LOGGED_MESSAGE, якщо БД зараз недоступна
+        message_id = self.append(meter_id, day_value, night_value)
+        try:
+            self.drain()
+        except Exception as e:
+            print(f"Показник {message_id} лишився в журналі: {e}")
+        return self.results.get(message_id, LOGGED_MESSAGE)
+
+    def start_drainer(self, interval=1.0, verbose=False):
+        # Фоновий потік переносить журнал у БД; нові записи будять його одразу
+        self.stopping = False
+        self.drainer = threading.Thread(target=self._run_drainer, args=(interval, verbose), daemon=True)
+        self.drainer.start()
+
+    def _run_drainer(self, interval, verbose):
+        while True:
+            self.wake.clear()
+            try:
+                applied = self.drain()
+                if verbose and applied:
+                    print(f"Перенесено з журналу: {len(applied)}")
+                delay = interval
+            except Exception as e:
+                print(f"БД недоступна, показники лишаються в журналі: {e}")
+                delay = RETRY_DELAY
+            if self.stopping:
+                return
+            self.wake.wait(delay)
+
+    def stop_drainer(self):
+        # Остання спроба перенести журнал і зупинка потоку
+        if self.drainer is not None:
+            self.stopping = True
+            self.wake.set()
+            self.drainer.join()
+            self.drainer = None
+
+    def close(self):
+        self.stop_drainer()
+        with self.write_lock:
+            self.file.close()
@@ -0,0 +1,217 @@
+import argparse
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from db import (get_connection, in_write_transaction, iter_export_rows, add_to_rollups, period_start,
+                ROLLUP_TABLES, EXPORT_TABLES, BULK_CHUNK_SIZE)
+from tariffs import get_tariff_table
+from storage import get_backend, set_backend, SQLiteBackend
+
+# Колонки історії та рахунків у тому порядку, в якому їх віддає iter_export_rows
+HISTORY_COLUMNS = list(EXPORT_TABLES['history'][2])
+BILL_COLUMNS = list(EXPORT_TABLES['bills'][2])
+
+
+def _load_baseline(conn, start, meter_ids=None):
+    # Останній показник кожного лічильника перед початком періоду —
+    # від нього рахується перший рахунок у періоді
+    where, params = "reading_time < %s", [start]
+    if meter_ids:
+        where += f" AND meter_id IN ({', '.join(['%s'] * len(meter_ids))})"
+        params.extend(meter_ids)
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT h.id, h.meter_id, h.reading_time, h.day_value, h.night_value
+        FROM meter_readings_history h
+        JOIN (
+            SELECT meter_id, MAX(reading_time) AS last_time
+            FROM meter_readings_history
+            WHERE {where}
+            GROUP BY meter_id
+        ) last ON last.meter_id = h.meter_id AND last.last_time = h.reading_time
+    """, tuple(params))
+    return cursor.fetchall()
+
+
+def _frame(rows, columns, time_column):
+    frame = pd.DataFrame(rows, columns=columns)
+    frame[time_column] = pd.to_datetime(frame[time_column])
+    return frame
+
+
+def compute_bills(readings, old_bills, table, overrides=None):
+    # Векторний розрахунок рахунків за тими ж правилами, що calculate_bill():
+    # різниця з попереднім показником, від'ємна різниця -> накрутка, вартість за тарифами.
+    # Ставки — з розкладу tariff_zones (TariffTable) на момент кожного показника;
+    # overrides ({ключ settings: значення}) замінює ставку на весь період.
+    # readings — історія (разом з базовими показниками, колонка is_baseline)
+    readings = readings.sort_values(['meter_id', 'reading_time', 'id'], kind='stable')
+    rates = table.day_night_rates(readings['reading_time'].to_numpy())
+    for key, value in (overrides or {}).items():
+        rates[key] = np.full(len(readings), float(value))
+    if np.isnan(rates['day_tariff']).any() or np.isnan(rates['night_tariff']).any():
+        raise ValueError("Немає тарифу день/ніч на час одного з показників")
+
+    previous = readings.groupby('meter_id', sort=False)[['day_value', 'night_value']].shift(1)
+
+    day_diff = (readings['day_value'] - previous['day_value']).to_numpy(dtype=np.float64)
+    night_diff = (readings['night_value'] - previous['night_value']).to_numpy(dtype=np.float64)
+    day_faked = day_diff < 0
+    night_faked = night_diff < 0
+    day_diff = np.where(day_faked, rates['day_fake_increment'], day_diff)
+    night_diff = np.where(night_faked, rates['night_fake_increment'], night_diff)
+
+    bills = pd.DataFrame({
+        'meter_id': readings['meter_id'].to_numpy(),
+        'bill_time': readings['reading_time'].to_numpy(),
+        'day_kwh_used': day_diff,
+        'night_kwh_used': night_diff,
+        'fake_used': day_faked | night_faked,
+        'has_previous': previous['day_value'].notna().to_numpy(),
+        'day_tariff': rates['day_tariff'],
+        'night_tariff': rates['night_tariff'],
+    })[~readings['is_baseline'].to_numpy()]
+
+    # Рахунок прив'язаний до показника часом (bill_time == reading_time), але час — з точністю
+    # до секунди, і пакетне збереження пише кілька показників лічильника в одну секунду.
+    # Тому в межах секунди n-й з кінця показник відповідає n-му з кінця рахунку (за id):
+    # рахунки пишуться в порядку показників, а показник без рахунку (перший у лічильника)
+    # може бути лише найранішим
+    old_bills = old_bills.sort_values(['meter_id', 'bill_time', 'id'], kind='stable')
+    old_bills = old_bills.assign(seq=old_bills.groupby(['meter_id', 'bill_time']).cumcount(ascending=False))
+    bills['seq'] = bills.groupby(['meter_id', 'bill_time'], sort=False).cumcount(ascending=False)
+    count = len(bills)
+    bills = bills.merge(
+        old_bills.rename(columns={'day_kwh_used': 'old_day', 'night_kwh_used': 'old_night', 'total_cost': 'old_cost'}),
+        on=['meter_id', 'bill_time', 'seq'], how='left'
+    ).drop(columns='seq')
+    if len(bills) != count:
+        raise ValueError("Рахунок зіставлено з кількома показниками")
+
+    # Перший показник без попереднього в історії (історію могли очистити):
+    # кВт беремо з наявного рахунку, перераховуємо лише вартість
+    fallback = ~bills['has_previous'] & bills['id'].notna()
+    bills.loc[fallback, 'day_kwh_used'] = bills.loc[fallback, 'old_day']
+    bills.loc[fallback, 'night_kwh_used'] = bills.loc[fallback, 'old_night']
+    bills.loc[fallback, 'fake_used'] = False
+    # Показник, з якого лічильник почався, рахунку не має
+    bills = bills[bills['has_previous'] | fallback].copy()
+
+    bills['total_cost'] = bills['day_kwh_used'] * bills['day_tariff'] + bills['night_kwh_used'] * bills['night_tariff']
+    return bills.drop(columns=['day_tariff', 'night_tariff'])
+
+
+def _rollup_deltas(bills, period):
+    # Різниця "нові мінус старі" по (лічильник, період) для таблиць підсумків
+    starts = bills['bill_time'].map(lambda moment: period_start(moment, period))
+    old_exists = bills['id'].notna()
+    frame = pd.DataFrame({
+        'meter_id': bills['meter_id'],
+        'period_start': starts,
+        'day_kwh': bills['day_kwh_used'] - bills['old_day'].fillna(0.0),
+        'night_kwh': bills['night_kwh_used'] - bills['old_night'].fillna(0.0),
+        'cost': bills['total_cost'] - bills['old_cost'].fillna(0.0),
+        # Накрутка залежить лише від показників, тож для старого рахунку вона та сама
+        'bills_count': (~old_exists).astype(int),
+        'fake_count': (bills['fake_used'] & ~old_exists).astype(int),
+    })
+    grouped = frame.groupby(['meter_id', 'period_start'], sort=False).sum().reset_index()
+    return [
+        (row.meter_id, row.period_start, float(row.day_kwh), float(row.night_kwh), float(row.cost),
+         int(row.bills_count), int(row.fake_count))
+        for row in grouped.itertuples(index=False)
+    ]
+
+
+def rebill(start, end, meter_ids=None, overrides=None, dry_run=True):
+    # Перерахунок усіх рахунків періоду [start, end) за ставками розкладу тарифів на момент
+    # кожного показника (або за переданими overrides). dry_run=True лише повертає звіт, нічого не змінюючи.
+    # Читання і запис — в одній транзакції на запис: між ними рахунки періоду ніхто не змінить
+    if dry_run:
+        conn = get_connection()
+        try:
+            return _rebill(conn, start, end, meter_ids, overrides, dry_run)
+        finally:
+            conn.close()
+    return in_write_transaction(_rebill, start, end, meter_ids, overrides, dry_run)
+
+
+def _rebill(conn, start, end, meter_ids, overrides, dry_run):
+    table = get_tariff_table(conn)
+    history = _frame([row for chunk in iter_export_rows('history', meter_ids, start, end, conn=conn)
+                      for row in chunk], HISTORY_COLUMNS, 'reading_time')
+    history['is_baseline'] = False
+    baseline = _frame(_load_baseline(conn, start, meter_ids), HISTORY_COLUMNS, 'reading_time')
+    baseline['is_baseline'] = True
+    readings = pd.concat([baseline, history], ignore_index=True) if len(baseline) else history
+
+    old_bills = _frame([row for chunk in iter_export_rows('bills', meter_ids, start, end, conn=conn, lock=not dry_run)
+                        for row in chunk], BILL_COLUMNS, 'bill_time')
+    bills = compute_bills(readings, old_bills, table, overrides)
+
+    changed = ~np.isclose(bills['total_cost'], bills['old_cost'].fillna(np.inf))
+    report = {
+        'meters': int(bills['meter_id'].nunique()),
+        'bills_old': len(old_bills),
+        'bills_new': len(bills),
+        'bills_changed': int(changed.sum()),
+        'cost_old': float(old_bills['total_cost'].sum()),
+        'cost_new': float(bills['total_cost'].sum()),
+        'day_kwh': float(bills['day_kwh_used'].sum()),
+        'night_kwh': float(bills['night_kwh_used'].sum()),
+        'dry_run': dry_run,
+    }
+    report['cost_delta'] = report['cost_new'] - report['cost_old']
+
+    if not dry_run and len(bills):
+        _write(conn, bills)
+        conn.commit()
+    return report
+
+
+def _write(conn, bills):
+    # Один upsert за id: наявні рахунки оновлюються на місці, відсутні — додаються
+    rows = [
+        (None if pd.isna(row.id) else int(row.id), row.meter_id, row.bill_time.to_pydatetime(),
+         float(row.day_kwh_used), float(row.night_kwh_used), float(row.total_cost))
+        for row in bills.itertuples(index=False)
+    ]
+    statement = get_backend().upsert(
+        'bills', BILL_COLUMNS, update=('day_kwh_used', 'night_kwh_used', 'total_cost'), conflict=('id',)
+    )
+    cursor = conn.cursor()
+    for i in range(0, len(rows), BULK_CHUNK_SIZE):
+        cursor.executemany(statement, rows[i:i + BULK_CHUNK_SIZE])
+    for period in ROLLUP_TABLES:
+        add_to_rollups(cursor, period, _rollup_deltas(bills, period))
+
+
+def print_report(report):
+    print("Пробний запуск (нічого не змінено)" if report['dry_run'] else "Рахунки перераховано")
+    print(f"Лічильників: {report['meters']}, рахунків було/стало: {report['bills_old']}/{report['bills_new']}, "
+          f"змінилось: {report['bills_changed']}")
+    print(f"Спожито: день {report['day_kwh']:.2f} кВт, ніч {report['night_kwh']:.2f} кВт")
+    print(f"Сума: {report['cost_old']:.2f} -> {report['cost_new']:.2f} грн (різниця {report['cost_delta']:+.2f})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Перерахунок рахунків за період після зміни тарифів")
+    parser.add_argument('--from', dest='start', type=datetime.fromisoformat, required=True)
+    parser.add_argument('--to', dest='end', type=datetime.fromisoformat, required=True)
+    parser.add_argument('--meter', action='append', dest='meters', help="ID лічильника (можна кілька разів)")
+    parser.add_argument('--day-tariff', type=float, help="тариф день замість поточного")
+    parser.add_argument('--night-tariff', type=float, help="тариф ніч замість поточного")
+    parser.add_argument('--apply', action='store_true', help="записати результат (без нього — лише звіт)")
+    parser.add_argument('--sqlite', metavar='PATH', help="працювати з вбудованим SQLite замість MySQL")
+    args = parser.parse_args()
+
+    if args.sqlite:
+        set_backend(SQLiteBackend(args.sqlite))
+
+    overrides = {}
+    if args.day_tariff is not None:
+        overrides['day_tariff'] = args.day_tariff
+    if args.night_tariff is not None:
+        overrides['night_tariff'] = args.night_tariff
+
+    print_report(rebill(args.start, args.end, args.meters, overrides, dry_run=not args.apply))
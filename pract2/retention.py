@@ -0,0 +1,181 @@
+import time
+import argparse
+from datetime import datetime, timedelta
+from db import get_connection, BULK_CHUNK_SIZE
+from storage import get_backend, set_backend, SQLiteBackend
+from config import (HISTORY_RETENTION_DAYS, BILL_RETENTION_DAYS, PROCESSED_RETENTION_DAYS,
+                    REGISTER_RETENTION_DAYS, ANOMALY_RETENTION_DAYS)
+
+SNAPSHOT_COLUMNS = ('meter_id', 'snapshot_date', 'day_value', 'night_value', 'readings_count')
+
+# Пауза між пачками, с: кожна пачка — коротка окрема транзакція,
+# а між ними встигають пройти звичайні запити застосунку
+PAUSE = 0.01
+
+# Що ще чистимо, крім історії: назва -> (таблиця, ключ, колонка часу)
+PURGE_TABLES = {
+    'bills': ('bills', 'id', 'bill_time'),
+    'processed': ('processed_readings', 'message_id', 'processed_at'),
+    # Поточні значення регістрів — у meter_registers, історія потрібна лише для звітів
+    'registers': ('register_readings', 'id', 'reading_time'),
+    'anomalies': ('reading_anomalies', 'id', 'reading_time'),
+}
+
+
+def cutoff(days):
+    return datetime.now() - timedelta(days=days)
+
+
+def _delete_keys(cursor, table, key, keys):
+    placeholders = ", ".join(["%s"] * len(keys))
+    cursor.execute(f"DELETE FROM {table} WHERE {key} IN ({placeholders})", keys)
+
+
+def compact_history(before, chunk_size=BULK_CHUNK_SIZE, pause=PAUSE):
+    # Показники, старші за before, стискаються до одного знімка на лічильник і день
+    # (останній показник дня + кількість показників), а самі рядки видаляються.
+    # Пачка = одна транзакція: знімки і видалення або проходять разом, або ні,
+    # тож перерваний запуск можна просто повторити. Повертає кількість стиснутих показників
+    compacted = 0
+    statement = get_backend().upsert(
+        'meter_readings_daily', SNAPSHOT_COLUMNS,
+        update=('day_value', 'night_value'), add=('readings_count',), conflict=SNAPSHOT_COLUMNS[:2]
+    )
+    while True:
+        conn = get_connection()
+        try:
+            cursor = conn.cursor(dictionary=True)
+            # Найстаріші рядки — по індексу idx_history_time, без сортування всієї таблиці
+            cursor.execute("""
+                SELECT id, meter_id, reading_time, day_value, night_value
+                FROM meter_readings_history
+                WHERE reading_time < %s
+                ORDER BY reading_time, id
+                LIMIT %s
+            """, (before, chunk_size))
+            rows = cursor.fetchall()
+            if not rows:
+                return compacted
+
+            snapshots = {}
+            for row in rows:
+                key = (row['meter_id'], row['reading_time'].date())
+                count = snapshots[key][2] + 1 if key in snapshots else 1
+                snapshots[key] = (row['day_value'], row['night_value'], count)
+            # День, що почався в попередній пачці, отримає новіший показник і додасть кількість
+            cursor.executemany(statement, [key + values for key, values in snapshots.items()])
+            _delete_keys(cursor, 'meter_readings_history', 'id', [row['id'] for row in rows])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+        compacted += len(rows)
+        if pause:
+            time.sleep(pause)
+
+
+def purge(name, before, chunk_size=BULK_CHUNK_SIZE, pause=PAUSE):
+    # Видалення рядків, старших за before, пачками по chunk_size ключів
+    table, key, time_column = PURGE_TABLES[name]
+    deleted = 0
+    while True:
+        conn = get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT {key} FROM {table}
+                WHERE {time_column} < %s
+                ORDER BY {time_column}
+                LIMIT %s
+            """, (before, chunk_size))
+            keys = [row[0] for row in cursor.fetchall()]
+            if not keys:
+                return deleted
+            _delete_keys(cursor, table, key, keys)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+        deleted += len(keys)
+        if pause:
+            time.sleep(pause)
+
+
+def count_older(table, time_column, before):
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT COUNT(*) FROM {table} WHERE {time_column} < %s", (before,))
+        return cursor.fetchone()[0]
+    finally:
+        conn.close()
+
+
+def run_retention(history_days=HISTORY_RETENTION_DAYS, bill_days=BILL_RETENTION_DAYS,
+                  processed_days=PROCESSED_RETENTION_DAYS, chunk_size=BULK_CHUNK_SIZE, dry_run=False,
+                  register_days=REGISTER_RETENTION_DAYS, anomaly_days=ANOMALY_RETENTION_DAYS):
+    # Усі правила зберігання за один запуск; None у кількості днів — таблицю не чіпати.
+    # dry_run=True лише рахує, скільки рядків буде стиснуто/видалено
+    jobs = [
+        ('history', history_days, ('meter_readings_history', 'reading_time'),
+         lambda before: compact_history(before, chunk_size)),
+        ('bills', bill_days, ('bills', 'bill_time'),
+         lambda before: purge('bills', before, chunk_size)),
+        ('processed', processed_days, ('processed_readings', 'processed_at'),
+         lambda before: purge('processed', before, chunk_size)),
+        ('registers', register_days, ('register_readings', 'reading_time'),
+         lambda before: purge('registers', before, chunk_size)),
+        ('anomalies', anomaly_days, ('reading_anomalies', 'reading_time'),
+         lambda before: purge('anomalies', before, chunk_size)),
+    ]
+    report = {'dry_run': dry_run}
+    for name, days, (table, time_column), job in jobs:
+        if days is None:
+            continue
+        before = cutoff(days)
+        report[name] = count_older(table, time_column, before) if dry_run else job(before)
+    return report
+
+
+def print_report(report):
+    print("Пробний запуск (нічого не змінено)" if report['dry_run'] else "Зберігання застосовано")
+    if 'history' in report:
+        print(f"Показників стиснуто до денних знімків: {report['history']}")
+    if 'bills' in report:
+        print(f"Старих рахунків видалено: {report['bills']}")
+    if 'processed' in report:
+        print(f"Старих ключів ідемпотентності видалено: {report['processed']}")
+    if 'registers' in report:
+        print(f"Старих показників регістрів видалено: {report['registers']}")
+    if 'anomalies' in report:
+        print(f"Старих записів про підозрілі показники видалено: {report['anomalies']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Стиснення старої історії показників і очищення старих рахунків")
+    parser.add_argument('--history-days', type=int, default=HISTORY_RETENTION_DAYS,
+                        help="скільки днів тримати всі показники")
+    parser.add_argument('--bill-days', type=int, default=BILL_RETENTION_DAYS,
+                        help="скільки днів тримати рахунки (за замовчуванням — без обмеження)")
+    parser.add_argument('--processed-days', type=int, default=PROCESSED_RETENTION_DAYS,
+                        help="скільки днів тримати ключі ідемпотентності")
+    parser.add_argument('--register-days', type=int, default=REGISTER_RETENTION_DAYS,
+                        help="скільки днів тримати показники регістрів")
+    parser.add_argument('--anomaly-days', type=int, default=ANOMALY_RETENTION_DAYS,
+                        help="скільки днів тримати записи про підозрілі показники")
+    parser.add_argument('--chunk-size', type=int, default=BULK_CHUNK_SIZE)
+    parser.add_argument('--dry-run', action='store_true', help="лише порахувати")
+    parser.add_argument('--sqlite', metavar='PATH', help="працювати з вбудованим SQLite замість MySQL")
+    args = parser.parse_args()
+
+    if args.sqlite:
+        set_backend(SQLiteBackend(args.sqlite))
+
+    print_report(run_retention(args.history_days, args.bill_days, args.processed_days,
+                               args.chunk_size, args.dry_run, args.register_days, args.anomaly_days))
@@ -0,0 +1,625 @@
+import os
+import time
+import sqlite3
+import weakref
+import threading
+from datetime import date, datetime
+from config import DB_CONFIG, DB_BACKEND, SQLITE_PATH
+
+# mysql-connector потрібен лише для MySQL; вбудований SQLite працює без нього
+try:
+    import mysql.connector
+    from mysql.connector import pooling, errors
+except ImportError:
+    mysql = None
+
+# Помилки порушення унікальності/ключів для обох рушіїв (для except у db.py)
+IntegrityError = (sqlite3.IntegrityError,) + ((mysql.connector.IntegrityError,) if mysql else ())
+
+# Коди помилок MySQL, після яких транзакцію варто просто повторити:
+# 1205 — не дочекались блокування, 1213 — взаємоблокування (deadlock)
+MYSQL_RETRYABLE_ERRORS = (1205, 1213)
+
+
+def is_retryable(error):
+    # Тимчасова помилка конкурентного доступу (а не помилка в даних чи запиті)
+    if isinstance(error, sqlite3.OperationalError):
+        return 'locked' in str(error) or 'busy' in str(error)
+    return mysql is not None and isinstance(error, mysql.connector.Error) and error.errno in MYSQL_RETRYABLE_ERRORS
+
+
+def is_data_error(error):
+    # Помилка в самому показнику (недопустиме значення, порушення ключа чи обмеження):
+    # повтор того самого запису не допоможе, на відміну від недоступної БД
+    if isinstance(error, (ValueError, TypeError, KeyError, sqlite3.DataError) + IntegrityError):
+        return True
+    return mysql is not None and isinstance(error, mysql.connector.DataError)
+
+
+# Параметри пулу, які не передаються в mysql.connector.connect
+POOL_OPTIONS = ('pool_size', 'pool_timeout', 'prepared_statements')
+
+# MySQL: бази даних з такою назвою ще немає
+MYSQL_UNKNOWN_DATABASE = 1049
+
+# Підсумки споживання за день/місяць (однаковий DDL для MySQL і SQLite)
+ROLLUP_SCHEMA = [
+    f"""
+    CREATE TABLE IF NOT EXISTS {table} (
+        meter_id VARCHAR(20) NOT NULL,
+        period_start DATE NOT NULL,
+        day_kwh FLOAT NOT NULL DEFAULT 0,
+        night_kwh FLOAT NOT NULL DEFAULT 0,
+        cost FLOAT NOT NULL DEFAULT 0,
+        bills_count INT NOT NULL DEFAULT 0,
+        fake_count INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (meter_id, period_start),
+        FOREIGN KEY (meter_id) REFERENCES meters(meter_id) ON DELETE CASCADE
+    )
+    """
+    for table in ('consumption_daily', 'consumption_monthly')
+]
+
+# Ідентифікатори вже врахованих повідомлень з показниками (ключі ідемпотентності)
+PROCESSED_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS processed_readings (
+        message_id VARCHAR(36) PRIMARY KEY,
+        meter_id VARCHAR(20) NOT NULL,
+        processed_at DATETIME NOT NULL
+    )
+    """
+]
+
+# Денні знімки показників: сюди retention.py стискає стару історію (останній показник дня)
+SNAPSHOT_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS meter_readings_daily (
+        meter_id VARCHAR(20) NOT NULL,
+        snapshot_date DATE NOT NULL,
+        day_value FLOAT,
+        night_value FLOAT,
+        readings_count INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (meter_id, snapshot_date),
+        FOREIGN KEY (meter_id) REFERENCES meters(meter_id) ON DELETE CASCADE
+    )
+    """
+]
+
+# Тарифні зони з датою початку дії (tariffs.py) і регістри лічильників з N регістрами.
+# start_minute/end_minute — вікно доби (хвилини від 00:00), коли зона діє для регістрів без власної зони
+TARIFF_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS tariff_zones (
+        zone VARCHAR(20) NOT NULL,
+        effective_from DATETIME NOT NULL,
+        rate FLOAT NOT NULL,
+        fake_increment FLOAT NOT NULL DEFAULT 0,
+        start_minute INT,
+        end_minute INT,
+        PRIMARY KEY (zone, effective_from)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS meter_registers (
+        meter_id VARCHAR(20) NOT NULL,
+        register_name VARCHAR(20) NOT NULL,
+        zone VARCHAR(20),
+        value FLOAT,
+        last_update DATETIME,
+        PRIMARY KEY (meter_id, register_name),
+        FOREIGN KEY (meter_id) REFERENCES meters(meter_id) ON DELETE CASCADE
+    )
+    """,
+]
+
+# Основні таблиці (як у DBcode.txt) і початкові налаштування: порожня база
+# готова до роботи після першого з'єднання, без ручного запуску DBcode.txt
+MYSQL_BASE_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS settings (
+        id INT PRIMARY KEY AUTO_INCREMENT,
+        setting_key VARCHAR(50) UNIQUE,
+        setting_value FLOAT
+    )
+    """,
+    """
+    INSERT IGNORE INTO settings (setting_key, setting_value) VALUES
+    ('day_tariff', 2.4),
+    ('night_tariff', 1.2),
+    ('day_fake_increment', 100),
+    ('night_fake_increment', 80)
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS meters (
+        meter_id VARCHAR(20) PRIMARY KEY,
+        password VARCHAR(255) NOT NULL,
+        last_update DATETIME,
+        day_value FLOAT,
+        night_value FLOAT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS meter_readings_history (
+        id INT PRIMARY KEY AUTO_INCREMENT,
+        meter_id VARCHAR(20),
+        reading_time DATETIME,
+        day_value FLOAT,
+        night_value FLOAT,
+        FOREIGN KEY (meter_id) REFERENCES meters(meter_id) ON DELETE CASCADE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS bills (
+        id INT PRIMARY KEY AUTO_INCREMENT,
+        meter_id VARCHAR(20),
+        bill_time DATETIME,
+        day_kwh_used FLOAT,
+        night_kwh_used FLOAT,
+        total_cost FLOAT,
+        FOREIGN KEY (meter_id) REFERENCES meters(meter_id) ON DELETE CASCADE
+    )
+    """,
+]
+
+# Таблиці, яких немає в старих базах, створених за DBcode.txt
+MYSQL_TABLES = ROLLUP_SCHEMA + PROCESSED_SCHEMA + SNAPSHOT_SCHEMA + TARIFF_SCHEMA + [
+    """
+    CREATE TABLE IF NOT EXISTS register_readings (
+        id INT PRIMARY KEY AUTO_INCREMENT,
+        meter_id VARCHAR(20) NOT NULL,
+        register_name VARCHAR(20) NOT NULL,
+        reading_time DATETIME NOT NULL,
+        value FLOAT NOT NULL,
+        zone VARCHAR(20) NOT NULL,
+        kwh_used FLOAT,
+        cost FLOAT,
+        fake_used BOOLEAN NOT NULL DEFAULT FALSE,
+        INDEX idx_register_readings_meter_time (meter_id, reading_time, id),
+        FOREIGN KEY (meter_id) REFERENCES meters(meter_id) ON DELETE CASCADE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS reading_anomalies (
+        id INT PRIMARY KEY AUTO_INCREMENT,
+        meter_id VARCHAR(20) NOT NULL,
+        reading_time DATETIME NOT NULL,
+        reason VARCHAR(10) NOT NULL,
+        score FLOAT NOT NULL,
+        INDEX idx_anomalies_meter_time (meter_id, reading_time, id)
+    )
+    """,
+]
+
+# Індекси, яких немає в старих базах, створених за DBcode.txt: (таблиця, назва, колонки).
+# Створюються один раз при першому з'єднанні, якщо їх ще немає
+MYSQL_INDEXES = [
+    ('meter_readings_history', 'idx_history_meter_time', 'meter_id, reading_time, id'),
+    ('meter_readings_history', 'idx_history_time', 'reading_time, id'),
+    ('bills', 'idx_bills_meter_time', 'meter_id, bill_time'),
+    ('bills', 'idx_bills_time', 'bill_time, id'),
+    ('meters', 'idx_meters_day', 'day_value, meter_id'),
+    ('meters', 'idx_meters_night', 'night_value, meter_id'),
+    ('meters', 'idx_meters_update', 'last_update, meter_id'),
+    ('processed_readings', 'idx_processed_time', 'processed_at'),
+    ('register_readings', 'idx_register_readings_time', 'reading_time, id'),
+    ('reading_anomalies', 'idx_anomalies_time', 'reading_time, id'),
+]
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+class _PooledConnection:
+    # З'єднання з пулу MySQL; close() перед поверненням у пул завершує транзакцію.
+    # Без скидання сесії (prepared_statements) пул цього не робить, а в REPEATABLE READ
+    # навіть транзакція лише з SELECT тримає знімок даних: наступний, хто отримає
+    # з'єднання, бачив би старі тарифи і показники без чужих commit
+
+    # Кеш підготовлених запитів з'єднання (None — запити не готуються)
+    statements = None
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def close(self):
+        try:
+            if self._conn.is_connected():
+                self._conn.rollback()
+        finally:
+            self._conn.close()
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+class MySQLBackend:
+    name = 'mysql'
+    # Блокування прочитаних рядків до кінця транзакції
+    for_update = " FOR UPDATE"
+
+    def __init__(self, config=DB_CONFIG):
+        if mysql is None:
+            raise RuntimeError("Для MySQL потрібен пакет mysql-connector-python")
+        # Посилання на словник, а не копія: тести підміняють у ньому назву бази
+        self.config = config
+        self._pool = None
+        self._pool_key = None
+        self._migrated_key = None
+        self._lock = threading.Lock()
+        # Кеш підготовлених запитів: справжнє з'єднання пулу -> {(sql, dictionary): курсор}.
+        # З'єднання живуть весь час роботи пулу, тож запит розбирається сервером один раз на з'єднання
+        self._statements = weakref.WeakKeyDictionary()
+        # Лічильники роботи пулу (можна виводити для моніторингу)
+        self.pool_stats = {
+            'acquired': 0,      # скільки разів видано з'єднання
+            'waits': 0,         # скільки разів довелося чекати вільне з'єднання
+            'wait_time': 0.0,   # сумарний час очікування, с
+            'timeouts': 0,      # скільки разів так і не дочекались
+            'reconnects': 0     # скільки "мертвих" з'єднань перепідключено
+        }
+
+    def cache_key(self):
+        return (self.name, self.config['host'], self.config['port'], self.config['database'])
+
+    @property
+    def prepared_statements(self):
+        return self.config.get('prepared_statements', True)
+
+    def _create_database(self, params):
+        # Порожній сервер: створюємо базу з DB_CONFIG, таблиці створить migrate()
+        server = {k: v for k, v in params.items() if k != 'database'}
+        conn = mysql.connector.connect(**server)
+        try:
+            conn.cursor().execute(f"CREATE DATABASE IF NOT EXISTS `{params['database']}`")
+        finally:
+            conn.close()
+
+    def _get_pool(self):
+        # Пул створюється ліниво і перебудовується, якщо змінився DB_CONFIG
+        params = {k: v for k, v in self.config.items() if k not in POOL_OPTIONS}
+        key = tuple(sorted(params.items())) + (self.config.get('pool_size', 5), self.prepared_statements)
+        with self._lock:
+            if self._pool is None or self._pool_key != key:
+                # Скидання сесії при поверненні в пул видаляє підготовлені запити на сервері,
+                # тож з prepared_statements з'єднання повертаються без скидання
+                # (застосунок не тримає в сесії змінних чи тимчасових таблиць);
+                # відкриту транзакцію в будь-якому разі завершує _PooledConnection.close()
+                options = dict(pool_name="electricity_pool", pool_size=self.config.get('pool_size', 5),
+                               pool_reset_session=not self.prepared_statements, **params)
+                try:
+                    self._pool = pooling.MySQLConnectionPool(**options)
+                except errors.ProgrammingError as e:
+                    if e.errno != MYSQL_UNKNOWN_DATABASE:
+                        raise
+                    self._create_database(params)
+                    self._pool = pooling.MySQLConnectionPool(**options)
+                self._pool_key = key
+            return self._pool
+
+    def connect(self):
+        # Повертає з'єднання з пулу; conn.close() повертає його назад у пул
+        pool = self._get_pool()
+        timeout = self.config.get('pool_timeout', 10)
+        start = time.monotonic()
+        waited = False
+
+        while True:
+            try:
+                conn = pool.get_connection()
+                break
+            except errors.PoolError:
+                # Усі з'єднання зайняті — чекаємо, поки якесь повернуть
+                waited = True
+                if time.monotonic() - start >= timeout:
+                    with self._lock:
+                        self.pool_stats['timeouts'] += 1
+                    raise
+                time.sleep(0.005)
+
+        with self._lock:
+            self.pool_stats['acquired'] += 1
+            if waited:
+                self.pool_stats['waits'] += 1
+                self.pool_stats['wait_time'] += time.monotonic() - start
+
+        # Перевірка "здоров'я": сервер міг закрити з'єднання (wait_timeout, рестарт)
+        raw = getattr(conn, '_cnx', conn)
+        if not conn.is_connected():
+            conn.reconnect(attempts=2, delay=0)
+            with self._lock:
+                self.pool_stats['reconnects'] += 1
+                # Нова сесія — підготовлені раніше запити на сервері вже не існують
+                self._statements.pop(raw, None)
+
+        conn = _PooledConnection(conn)
+        # db.prepared_cursor() бере звідси кеш підготовлених запитів цього з'єднання
+        if self.prepared_statements:
+            with self._lock:
+                conn.statements = self._statements.setdefault(raw, {})
+
+        if self._migrated_key != self._pool_key:
+            self.migrate(conn)
+            self._migrated_key = self._pool_key
+
+        return conn
+
+    def migrate(self, conn):
+        # Створює відсутні таблиці з MYSQL_BASE_SCHEMA і MYSQL_TABLES та індекси з MYSQL_INDEXES.
+        # Усе ідемпотентно: на готовій базі нічого не змінює
+        cursor = conn.cursor()
+        for statement in MYSQL_BASE_SCHEMA + MYSQL_TABLES:
+            cursor.execute(statement)
+        conn.commit()
+        for table, name, columns in MYSQL_INDEXES:
+            cursor.execute("""
+                SELECT
+                    (SELECT COUNT(*) FROM information_schema.tables
+                     WHERE table_schema = DATABASE() AND table_name = %s),
+                    (SELECT COUNT(*) FROM information_schema.statistics
+                     WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s)
+            """, (table, table, name))
+            table_exists, index_exists = cursor.fetchone()
+            if table_exists and not index_exists:
+                cursor.execute(f"CREATE INDEX {name} ON {table} ({columns})")
+        cursor.close()
+
+    def stats(self):
+        with self._lock:
+            return dict(self.pool_stats, pool_size=self.config.get('pool_size', 5))
+
+    def begin_write(self, conn):
+        # InnoDB блокує рядки через SELECT ... FOR UPDATE, окремий початок транзакції не потрібен
+        pass
+
+    def upsert(self, table, columns, update=(), add=(), conflict=None):
+        # INSERT, а при збігу ключа: update — перезаписати, add — додати до наявного.
+        # conflict (колонки унікального ключа) потрібен лише SQLite, MySQL визначає ключ сам
+        assignments = [f"{c} = VALUES({c})" for c in update] + [f"{c} = {c} + VALUES({c})" for c in add]
+        return (f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))}) "
+                f"ON DUPLICATE KEY UPDATE {', '.join(assignments)}")
+
+    def close(self):
+        self._pool = None
+        self._pool_key = None
+        self._statements = weakref.WeakKeyDictionary()
+
+
+# Схема для SQLite — відповідник DBcode.txt.
+# MySQL сам створює індекси під зовнішні ключі, у SQLite їх треба оголосити явно.
+SQLITE_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS settings (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        setting_key VARCHAR(50) UNIQUE,
+        setting_value FLOAT
+    )
+    """,
+    """
+    INSERT OR IGNORE INTO settings (setting_key, setting_value) VALUES
+    ('day_tariff', 2.4),
+    ('night_tariff', 1.2),
+    ('day_fake_increment', 100),
+    ('night_fake_increment', 80)
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS meters (
+        meter_id VARCHAR(20) PRIMARY KEY,
+        password VARCHAR(255) NOT NULL,
+        last_update DATETIME,
+        day_value FLOAT,
+        night_value FLOAT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_meters_day ON meters (day_value, meter_id)",
+    "CREATE INDEX IF NOT EXISTS idx_meters_night ON meters (night_value, meter_id)",
+    "CREATE INDEX IF NOT EXISTS idx_meters_update ON meters (last_update, meter_id)",
+    """
+    CREATE TABLE IF NOT EXISTS meter_readings_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        meter_id VARCHAR(20) REFERENCES meters(meter_id) ON DELETE CASCADE,
+        reading_time DATETIME,
+        day_value FLOAT,
+        night_value FLOAT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_history_meter_time ON meter_readings_history (meter_id, reading_time, id)",
+    "CREATE INDEX IF NOT EXISTS idx_history_time ON meter_readings_history (reading_time, id)",
+    """
+    CREATE TABLE IF NOT EXISTS bills (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        meter_id VARCHAR(20) REFERENCES meters(meter_id) ON DELETE CASCADE,
+        bill_time DATETIME,
+        day_kwh_used FLOAT,
+        night_kwh_used FLOAT,
+        total_cost FLOAT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_bills_meter_time ON bills (meter_id, bill_time)",
+    "CREATE INDEX IF NOT EXISTS idx_bills_time ON bills (bill_time, id)",
+] + ROLLUP_SCHEMA + PROCESSED_SCHEMA + SNAPSHOT_SCHEMA + TARIFF_SCHEMA + [
+    "CREATE INDEX IF NOT EXISTS idx_processed_time ON processed_readings (processed_at)",
+    """
+    CREATE TABLE IF NOT EXISTS register_readings (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        meter_id VARCHAR(20) NOT NULL REFERENCES meters(meter_id) ON DELETE CASCADE,
+        register_name VARCHAR(20) NOT NULL,
+        reading_time DATETIME NOT NULL,
+        value FLOAT NOT NULL,
+        zone VARCHAR(20) NOT NULL,
+        kwh_used FLOAT,
+        cost FLOAT,
+        fake_used BOOLEAN NOT NULL DEFAULT FALSE
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_register_readings_meter_time ON register_readings (meter_id, reading_time, id)",
+    "CREATE INDEX IF NOT EXISTS idx_register_readings_time ON register_readings (reading_time, id)",
+    """
+    CREATE TABLE IF NOT EXISTS reading_anomalies (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        meter_id VARCHAR(20) NOT NULL,
+        reading_time DATETIME NOT NULL,
+        reason VARCHAR(10) NOT NULL,
+        score FLOAT NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_anomalies_meter_time ON reading_anomalies (meter_id, reading_time, id)",
+    "CREATE INDEX IF NOT EXISTS idx_anomalies_time ON reading_anomalies (reading_time, id)",
+]
+
+# DATETIME/DATE зберігаємо як ISO-рядок і читаємо назад як datetime/date
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(" "))
+sqlite3.register_adapter(date, lambda value: value.isoformat())
+sqlite3.register_converter("DATETIME", lambda value: datetime.fromisoformat(value.decode()))
+sqlite3.register_converter("DATE", lambda value: date.fromisoformat(value.decode()))
+
+
+class _SQLiteCursor:
+    # Курсор з інтерфейсом mysql.connector: плейсхолдери %s і dictionary=True
+
+    def __init__(self, cursor, dictionary):
+        self._cursor = cursor
+        self._dictionary = dictionary
+
+    def execute(self, sql, params=()):
+        self._cursor.execute(sql.replace("%s", "?"), tuple(params or ()))
+
+    def executemany(self, sql, rows):
+        self._cursor.executemany(sql.replace("%s", "?"), rows)
+
+    def _convert(self, row):
+        if row is None:
+            return None
+        return dict(row) if self._dictionary else tuple(row)
+
+    def fetchone(self):
+        return self._convert(self._cursor.fetchone())
+
+    def fetchall(self):
+        return [self._convert(row) for row in self._cursor.fetchall()]
+
+    def fetchmany(self, size=1):
+        return [self._convert(row) for row in self._cursor.fetchmany(size)]
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    def close(self):
+        self._cursor.close()
+
+
+class _SQLiteConnection:
+    # Обгортка над sqlite3.Connection; close() лише завершує транзакцію,
+    # саме з'єднання лишається за потоком і використовується повторно
+
+    # Окремий кеш підготовлених запитів не потрібен: sqlite3 сам кешує скомпільовані запити з'єднання
+    statements = None
+
+    def __init__(self, raw):
+        self._raw = raw
+
+    def cursor(self, dictionary=False, **kwargs):
+        return _SQLiteCursor(self._raw.cursor(), dictionary)
+
+    def commit(self):
+        self._raw.commit()
+
+    def rollback(self):
+        self._raw.rollback()
+
+    def is_connected(self):
+        return True
+
+    def close(self):
+        if self._raw.in_transaction:
+            self._raw.rollback()
+
+
+class SQLiteBackend:
+    name = 'sqlite'
+    # FOR UPDATE у SQLite немає — замість нього begin_write() блокує запис до всієї бази
+    for_update = ""
+
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+        self._schema_ready = False
+        self.pool_stats = {'acquired': 0, 'opened': 0}
+
+    def cache_key(self):
+        return (self.name, os.path.abspath(self.path))
+
+    def connect(self):
+        # Одне з'єднання на потік: відкривається один раз, далі лише повторно видається
+        raw = getattr(self._local, 'conn', None)
+        if raw is None:
+            raw = sqlite3.connect(self.path, timeout=10, detect_types=sqlite3.PARSE_DECLTYPES,
+                                  check_same_thread=False)
+            raw.row_factory = sqlite3.Row
+            raw.execute("PRAGMA journal_mode=WAL")
+            raw.execute("PRAGMA synchronous=NORMAL")
+            raw.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = raw
+            with self._lock:
+                self._connections.append(raw)
+                self.pool_stats['opened'] += 1
+                if not self._schema_ready:
+                    for statement in SQLITE_SCHEMA:
+                        raw.execute(statement)
+                    raw.commit()
+                    self._schema_ready = True
+        with self._lock:
+            self.pool_stats['acquired'] += 1
+        return _SQLiteConnection(raw)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.pool_stats)
+
+    def begin_write(self, conn):
+        # BEGIN IMMEDIATE одразу бере блокування на запис: інша транзакція не встигне
+        # прочитати ті самі показники між нашими SELECT і UPDATE
+        if not conn._raw.in_transaction:
+            conn._raw.execute("BEGIN IMMEDIATE")
+
+    def upsert(self, table, columns, update=(), add=(), conflict=None):
+        # Те саме, що MySQLBackend.upsert; conflict — колонки унікального ключа
+        assignments = [f"{c} = excluded.{c}" for c in update] + [f"{c} = {c} + excluded.{c}" for c in add]
+        target = conflict or columns[:1]
+        return (f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))}) "
+                f"ON CONFLICT ({', '.join(target)}) DO UPDATE SET {', '.join(assignments)}")
+
+    def close(self):
+        with self._lock:
+            for raw in self._connections:
+                raw.close()
+            self._connections = []
+        self._local = threading.local()
+
+
+def get_backend():
+    # Рушій за замовчуванням береться з config.DB_BACKEND
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = SQLiteBackend() if DB_BACKEND == 'sqlite' else MySQLBackend()
+        return _backend
+
+
+def set_backend(backend):
+    # Підміна рушія (наприклад, SQLiteBackend у тестах або на периферійних пристроях).
+    # Повертає попередній рушій, щоб його можна було повернути; None — рушій з config
+    global _backend
+    with _backend_lock:
+        previous = _backend
+        if previous is not None and previous is not backend:
+            previous.close()
+        _backend = backend
+    return previous
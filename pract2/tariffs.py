@@ -0,0 +1,386 @@
+import time
+import threading
+from datetime import datetime
+import numpy as np
+from config import SETTINGS_CACHE_TTL
+from db import (get_connection, get_settings, in_write_transaction, update_rollups, mark_processed,
+                load_processed, NEW_METER_MESSAGE, ALREADY_PROCESSED_MESSAGE, BULK_CHUNK_SIZE)
+from storage import get_backend
+
+# Вікна доби (хвилини від 00:00) для зон з settings: день 07:00–23:00, ніч — решта
+SETTINGS_ZONES = {
+    'day': ('day_tariff', 'day_fake_increment', 7 * 60, 23 * 60),
+    'night': ('night_tariff', 'night_fake_increment', 23 * 60, 7 * 60),
+}
+# З цієї дати діють тарифи з settings, поки в tariff_zones немає новіших рядків
+BASE_EFFECTIVE = datetime(1970, 1, 1)
+
+# Скомпільований розклад тарифів: значення, момент, до якого воно дійсне, і ключ (база + settings)
+_table_cache = {'value': None, 'expires': 0.0, 'key': None}
+_table_lock = threading.Lock()
+
+
+# Скомпільований розклад тарифів.
+# Для кожної зони — відсортовані дати початку дії та масиви ставок і вікон доби,
+# тож ставки для цілого пакета показників знаходяться одним np.searchsorted на зону,
+# без запитів до БД на кожен показник.
+class TariffTable:
+    def __init__(self, rows):
+        # rows: (зона, effective_from, ставка, накрутка, start_minute, end_minute)
+        by_zone = {}
+        for zone, effective_from, rate, fake, start, end in sorted(rows, key=lambda row: (row[0], row[1])):
+            by_zone.setdefault(zone, []).append((effective_from, rate, fake, start, end))
+
+        self.zones = sorted(by_zone)
+        self.index = {zone: i for i, zone in enumerate(self.zones)}
+        self.starts, self.rates, self.fakes, self.windows = [], [], [], []
+        for zone in self.zones:
+            entries = by_zone[zone]
+            self.starts.append(np.array([e[0] for e in entries], dtype='datetime64[s]'))
+            self.rates.append(np.array([e[1] for e in entries], dtype=np.float64))
+            self.fakes.append(np.array([e[2] for e in entries], dtype=np.float64))
+            # Рядок без вікна успадковує вікно попереднього рядка зони (нова ставка — ті самі години);
+            # -1 — у зони немає вікна: вона діє лише для регістрів, прив'язаних до неї напряму
+            windows, window = [], (-1, -1)
+            for e in entries:
+                if e[3] is not None and e[4] is not None:
+                    window = (e[3], e[4])
+                windows.append(window)
+            self.windows.append(np.array(windows, dtype=np.int64))
+
+    def _positions(self, zone_id, times):
+        # Номер рядка розкладу зони, що діє в кожен із моментів; -1 — зона ще не діяла
+        return np.searchsorted(self.starts[zone_id], times, side='right') - 1
+
+    def zone_at(self, times):
+        # Зона за вікном доби для кожного моменту; -1 — жодне вікно не покриває момент
+        times = np.asarray(times, dtype='datetime64[s]')
+        minutes = (times - times.astype('datetime64[D]')).astype(np.int64) // 60
+        result = np.full(len(times), -1, dtype=np.int64)
+        for zone_id in range(len(self.zones)):
+            positions = self._positions(zone_id, times)
+            active = positions >= 0
+            window = self.windows[zone_id][np.maximum(positions, 0)]
+            start, end = window[:, 0], window[:, 1]
+            # Вікно через північ (23:00–07:00) — коли start > end
+            inside = np.where(start <= end,
+                              (minutes >= start) & (minutes < end),
+                              (minutes >= start) | (minutes < end))
+            hit = active & (start >= 0) & inside & (result < 0)
+            result[hit] = zone_id
+        return result
+
+    def lookup(self, zone_ids, times):
+        # Ставка і "накрутка" для кожної пари (зона, момент); NaN — тарифу немає
+        times = np.asarray(times, dtype='datetime64[s]')
+        rates = np.full(len(times), np.nan)
+        fakes = np.full(len(times), np.nan)
+        for zone_id in np.unique(zone_ids):
+            if zone_id < 0:
+                continue
+            mask = zone_ids == zone_id
+            positions = self._positions(zone_id, times[mask])
+            active = positions >= 0
+            safe = np.maximum(positions, 0)
+            rates[mask] = np.where(active, self.rates[zone_id][safe], np.nan)
+            fakes[mask] = np.where(active, self.fakes[zone_id][safe], np.nan)
+        return rates, fakes
+
+    def day_night_rates(self, times):
+        # Ставки й накрутки зон day/night у кожен із моментів: {ключ settings: масив}
+        times = np.asarray(times, dtype='datetime64[s]')
+        columns = {}
+        for zone, (rate_key, fake_key, _, _) in SETTINGS_ZONES.items():
+            columns[rate_key], columns[fake_key] = self.lookup(np.full(len(times), self.index[zone]), times)
+        return columns
+
+    def settings_at(self, times):
+        # Те саме у вигляді словника settings на кожен момент, який приймає db.calculate_bill:
+        # лічильники день/ніч рахуються за тим самим розкладом, що й регістри
+        columns = {key: values.tolist() for key, values in self.day_night_rates(times).items()}
+        return [dict(zip(columns, values)) for values in zip(*columns.values())]
+
+
+def _compile(rows, settings):
+    # Тарифи з settings — базовий рядок зон day/night; розклад з tariff_zones діє поверх нього
+    rows = list(rows)
+    for zone, (rate_key, fake_key, start, end) in SETTINGS_ZONES.items():
+        if not any(row[0] == zone and row[1] <= BASE_EFFECTIVE for row in rows):
+            rows.append((zone, BASE_EFFECTIVE, float(settings[rate_key]), float(settings[fake_key]), start, end))
+    return TariffTable(rows)
+
+
+def get_tariff_table(conn=None):
+    # Як і get_settings: з кешу, у БД — лише після TTL, invalidate_tariff_cache() або зміни settings
+    settings = get_settings(conn)
+    key = (get_backend().cache_key(), tuple(sorted(settings.items())))
+    with _table_lock:
+        if (_table_cache['value'] is not None and _table_cache['key'] == key
+                and time.monotonic() < _table_cache['expires']):
+            return _table_cache['value']
+
+    own_conn = conn is None
+    if own_conn:
+        conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT zone, effective_from, rate, fake_increment, start_minute, end_minute
+            FROM tariff_zones
+        """)
+        rows = cursor.fetchall()
+    finally:
+        if own_conn:
+            conn.close()
+
+    table = _compile(rows, settings)
+    with _table_lock:
+        _table_cache['value'] = table
+        _table_cache['expires'] = time.monotonic() + SETTINGS_CACHE_TTL
+        _table_cache['key'] = key
+    return table
+
+
+def invalidate_tariff_cache():
+    with _table_lock:
+        _table_cache['value'] = None
+        _table_cache['expires'] = 0.0
+
+
+def set_zone_tariff(zone, rate, effective_from=None, fake_increment=0.0, start_minute=None, end_minute=None):
+    # Нова ставка зони з дати effective_from (за замовчуванням — з цього моменту).
+    # Старі ставки лишаються: показники до цієї дати і далі рахуються за ними
+    effective_from = effective_from or datetime.now()
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(get_backend().upsert(
+            'tariff_zones', ('zone', 'effective_from', 'rate', 'fake_increment', 'start_minute', 'end_minute'),
+            update=('rate', 'fake_increment', 'start_minute', 'end_minute'), conflict=('zone', 'effective_from')
+        ), (zone, effective_from, rate, fake_increment, start_minute, end_minute))
+        conn.commit()
+    finally:
+        conn.close()
+    invalidate_tariff_cache()
+
+
+def get_tariffs():
+    # Ставки день/ніч, що діють зараз
+    current = get_tariff_table().settings_at([datetime.now()])[0]
+    return {key: current[key] for key in ('day_tariff', 'night_tariff')}
+
+
+def update_tariffs(day_tariff, night_tariff, effective_from=None):
+    # Нові ставки день/ніч з цього моменту (або з effective_from) — датованими рядками tariff_zones.
+    # settings не чіпаємо: це лише базовий рядок розкладу, і його зміна переоцінила б показники,
+    # що надійдуть із запізненням за минулі дати. Накрутки й вікна доби зон лишаються як були
+    effective_from = effective_from or datetime.now()
+    current = get_tariff_table().settings_at([effective_from])[0]
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.executemany(get_backend().upsert(
+            'tariff_zones', ('zone', 'effective_from', 'rate', 'fake_increment', 'start_minute', 'end_minute'),
+            update=('rate', 'fake_increment', 'start_minute', 'end_minute'), conflict=('zone', 'effective_from')
+        ), [(zone, effective_from, rate, current[SETTINGS_ZONES[zone][1]], None, None)
+            for zone, rate in (('day', day_tariff), ('night', night_tariff))])
+        conn.commit()
+    finally:
+        conn.close()
+    invalidate_tariff_cache()
+
+
+def _ensure_meters(cursor, last_updates):
+    # Лічильник має існувати: на нього посилаються регістри, історія і рахунки.
+    # Новий створюється з паролем за замовчуванням і нульовими показниками день/ніч, як в add_meter()
+    # (інакше звичайний показник цього лічильника рахувався б від NULL); заодно блокується рядок лічильника
+    cursor.executemany(get_backend().upsert(
+        'meters', ('meter_id', 'password', 'day_value', 'night_value', 'last_update'), update=('last_update',)
+    ), [(meter_id, '000000', 0.0, 0.0, moment) for meter_id, moment in sorted(last_updates.items())])
+
+
+def set_meter_registers(meter_id, registers):
+    # registers: {назва регістра: зона або None}. None — зона визначається вікном доби
+    # в момент показника (наприклад, фази L1/L2/L3 лічильника з денним і нічним тарифом)
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT meter_id FROM meters WHERE meter_id = %s", (meter_id,))
+        if cursor.fetchone() is None:
+            raise ValueError(f"Лічильник {meter_id} не знайдено")
+        cursor.executemany(get_backend().upsert(
+            'meter_registers', ('meter_id', 'register_name', 'zone'), update=('zone',),
+            conflict=('meter_id', 'register_name')
+        ), [(meter_id, name, zone) for name, zone in registers.items()])
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def compute_register_bills(lines, previous, table):
+    # Векторний розрахунок для пакета рядків (meter_id, регістр, зона або None, значення, час).
+    # previous: {(meter_id, регістр): значення до пакета}. Кілька показників одного регістра
+    # в пакеті рахуються ланцюжком, як при обробці по одному.
+    # Повертає масиви: номер зони, кВт, вартість, чи накрутка, чи це перший показник регістра
+    keys = [(line[0], line[1]) for line in lines]
+    codes_of = {key: code for code, key in enumerate(dict.fromkeys(keys))}
+    codes = np.array([codes_of[key] for key in keys], dtype=np.int64)
+    values = np.array([line[3] for line in lines], dtype=np.float64)
+    times = np.array([line[4] for line in lines], dtype='datetime64[s]')
+
+    # Попереднє значення: сусід ліворуч у тій самій групі після стабільного сортування за регістром
+    order = np.argsort(codes, kind='stable')
+    sorted_codes = codes[order]
+    sorted_values = values[order]
+    first = np.ones(len(lines), dtype=bool)
+    first[1:] = sorted_codes[1:] != sorted_codes[:-1]
+    before = list(codes_of)
+    prev_sorted = np.empty(len(lines))
+    prev_sorted[1:] = sorted_values[:-1]
+    prev_sorted[first] = [previous.get(before[code], np.nan) for code in sorted_codes[first]]
+    prev = np.empty(len(lines))
+    prev[order] = prev_sorted
+
+    zone_ids = np.array([table.index.get(line[2], -1) if line[2] is not None else -2 for line in lines],
+                        dtype=np.int64)
+    windowed = zone_ids == -2
+    if windowed.any():
+        zone_ids[windowed] = table.zone_at(times[windowed])
+    rates, fakes = table.lookup(zone_ids, times)
+
+    new = np.isnan(prev)
+    missing = ~new & np.isnan(rates)
+    if missing.any():
+        line = lines[int(np.argmax(missing))]
+        raise ValueError(f"Немає тарифу для регістра {line[1]} лічильника {line[0]} на {line[4]}")
+
+    diff = values - prev
+    fake = ~new & (diff < 0)
+    kwh = np.where(fake, fakes, diff)
+    cost = kwh * rates
+    return zone_ids, kwh, cost, fake, new
+
+
+def format_register_bill(parts):
+    # parts: (регістр, кВт, вартість, накрутка) по кожному регістру показника
+    total = sum(cost for _, _, cost, _ in parts)
+    used = ", ".join(f"{name}: {kwh} кВт" for name, kwh, _, _ in parts)
+    return f"Вартість: {total:.2f} грн\n({used})\n{'Накручено!' if any(p[3] for p in parts) else ''}"
+
+
+def save_register_readings(readings):
+    # readings: (meter_id, {регістр: значення}, timestamp або None[, message_id]) — показники
+    # лічильників з N регістрами. message_id — ключ ідемпотентності, як у save_meter_readings_bulk.
+    # Повертає повідомлення про рахунок для кожного показника, у тому ж порядку
+    readings = [(str(r[0]), dict(r[1]), r[2] or datetime.now(), r[3] if len(r) > 3 else None) for r in readings]
+    if any(not registers for _, registers, _, _ in readings):
+        raise ValueError("Показник має містити хоча б один регістр")
+    if not readings:
+        return []
+    return in_write_transaction(_save_register_readings, readings)
+
+
+def _load_registers(cursor, meter_ids):
+    state = {}
+    for i in range(0, len(meter_ids), BULK_CHUNK_SIZE):
+        chunk = meter_ids[i:i + BULK_CHUNK_SIZE]
+        placeholders = ", ".join(["%s"] * len(chunk))
+        cursor.execute(f"""
+            SELECT meter_id, register_name, zone, value FROM meter_registers
+            WHERE meter_id IN ({placeholders})
+        """ + get_backend().for_update, chunk)
+        for row in cursor.fetchall():
+            state[(row['meter_id'], row['register_name'])] = (row['value'], row['zone'])
+    return state
+
+
+def _save_register_readings(conn, readings):
+    cursor = conn.cursor(dictionary=True)
+    table = get_tariff_table(conn)
+
+    # Уже враховані (в т.ч. двічі в одному пакеті) повідомлення пропускаємо
+    processed = load_processed(cursor, list(dict.fromkeys(r[3] for r in readings if r[3] is not None)))
+    accepted, new_ids, new_id_meters = [], [], []
+    for reading in readings:
+        message_id = reading[3]
+        if message_id is not None:
+            if message_id in processed:
+                accepted.append(False)
+                continue
+            processed.add(message_id)
+            new_ids.append(message_id)
+            new_id_meters.append(reading[0])
+        accepted.append(True)
+    fresh = [reading for reading, ok in zip(readings, accepted) if ok]
+    if not fresh:
+        return [ALREADY_PROCESSED_MESSAGE] * len(readings)
+
+    last_updates = {}
+    for meter_id, _, ts, _ in fresh:
+        last_updates[meter_id] = max(ts, last_updates.get(meter_id, ts))
+    # Ключі по порядку: паралельні пакети блокують лічильники в однаковій послідовності
+    _ensure_meters(cursor, last_updates)
+    state = _load_registers(cursor, sorted(last_updates))
+
+    # Один рядок на регістр; новий регістр з назвою відомої зони прив'язується до неї
+    lines, owners = [], []
+    for number, (meter_id, registers, ts, _) in enumerate(fresh):
+        for name, value in registers.items():
+            if (meter_id, name) in state:
+                zone = state[(meter_id, name)][1]
+            else:
+                zone = name if name in table.index else None
+                state[(meter_id, name)] = (None, zone)
+            lines.append((meter_id, name, zone, float(value), ts))
+            owners.append(number)
+
+    previous = {key: value for key, (value, _) in state.items() if value is not None}
+    zone_ids, kwh, cost, fake, new = compute_register_bills(lines, previous, table)
+
+    registers, history, parts = {}, [], [[] for _ in fresh]
+    for i, (meter_id, name, zone, value, ts) in enumerate(lines):
+        zone_name = table.zones[zone_ids[i]] if zone_ids[i] >= 0 else (zone or '')
+        registers[(meter_id, name)] = (meter_id, name, zone, value, ts)
+        if new[i]:
+            history.append((meter_id, name, ts, value, zone_name, None, None, False))
+        else:
+            history.append((meter_id, name, ts, value, zone_name, float(kwh[i]), float(cost[i]), bool(fake[i])))
+            parts[owners[i]].append((name, float(kwh[i]), float(cost[i]), bool(fake[i]), zone_name))
+
+    if lines:
+        cursor.executemany(get_backend().upsert(
+            'meter_registers', ('meter_id', 'register_name', 'zone', 'value', 'last_update'),
+            update=('value', 'last_update'), conflict=('meter_id', 'register_name')
+        ), list(registers.values()))
+        cursor.executemany("""
+            INSERT INTO register_readings (meter_id, register_name, reading_time, value, zone, kwh_used, cost, fake_used)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        """, history)
+
+    # Рахунок на показник: загальна вартість; кВт зон day/night — у відповідні колонки bills.
+    # Колонок для інших зон у bills і підсумках немає: там лише їхня вартість,
+    # а кВт по кожній зоні зберігаються в register_readings (kwh_used, zone)
+    messages, bills = [], []
+    for (meter_id, _, ts, _), reading_parts in zip(fresh, parts):
+        if not reading_parts:
+            messages.append(NEW_METER_MESSAGE)
+            continue
+        day_kwh = sum(p[1] for p in reading_parts if p[4] == 'day')
+        night_kwh = sum(p[1] for p in reading_parts if p[4] == 'night')
+        total = sum(p[2] for p in reading_parts)
+        bills.append((meter_id, ts, day_kwh, night_kwh, total, any(p[3] for p in reading_parts)))
+        messages.append(format_register_bill([p[:4] for p in reading_parts]))
+
+    if bills:
+        cursor.executemany("""
+            INSERT INTO bills (meter_id, bill_time, day_kwh_used, night_kwh_used, total_cost)
+            VALUES (%s, %s, %s, %s, %s)
+        """, [bill[:5] for bill in bills])
+        update_rollups(cursor, bills)
+
+    if new_ids:
+        mark_processed(cursor, new_ids, new_id_meters, datetime.now())
+
+    conn.commit()
+    messages = iter(messages)
+    return [next(messages) if ok else ALREADY_PROCESSED_MESSAGE for ok in accepted]
@@ -1,5 +1,7 @@
+import threading
 import unittest
-from db import get_connection, add_meter, get_meter, save_meter_data_and_bill
+from db import (get_connection, add_meter, get_meter, save_meter_data_and_bill, save_meter_readings_bulk,
+                get_settings, update_tariff)
 from config import DB_CONFIG
 import mysql.connector
 
@@ -92,6 +94,7 @@ class TestElectricityDB(unittest.TestCase):
         cursor.execute("DELETE FROM meter_readings_history")
         cursor.execute("DELETE FROM bills")
         cursor.execute("DELETE FROM meters")
+        cursor.execute("DELETE FROM processed_readings")
         conn.commit()
         conn.close()
 
@@ -193,5 +196,74 @@ class TestElectricityDB(unittest.TestCase):
         self.assertEqual(bills[0]['total_cost'], 336.00)
         conn.close()
 
+    def test_bulk_matches_single(self):
+        # Пакетне збереження має давати ті самі рахунки, що й поодиноке
+        readings = [('201', 150, 70), ('201', 140, 90), ('202', 10, 5), ('202', 30, 4)]
+
+        add_meter('201', '111111', 100, 50)
+        single = [save_meter_data_and_bill(m, d, n) for m, d, n in readings]
+        single_bills = self._bills(['201', '202'])
+
+        self.setUp()
+        add_meter('201', '111111', 100, 50)
+        bulk = save_meter_readings_bulk([(m, d, n, None) for m, d, n in readings])
+
+        self.assertEqual(bulk, single)
+        self.assertEqual(self._bills(['201', '202']), single_bills)
+        self.assertEqual(get_meter('202')['day_value'], 30)
+        self.assertEqual(get_meter('202')['night_value'], 4)
+
+    def test_tariff_change_resets_cache(self):
+        # Після зміни тарифу кеш налаштувань не повинен віддавати старе значення
+        get_settings()
+        update_tariff('day_tariff', 3.0)
+        try:
+            add_meter('301', '111111', 100, 50)
+            result = save_meter_data_and_bill('301', 110, 50)
+            self.assertIn("Вартість: 30.00 грн", result)
+        finally:
+            update_tariff('day_tariff', 2.4)
+
+    def test_concurrent_submissions(self):
+        # Паралельні показники одного лічильника (з повторами повідомлень) не рахуються
+        # від того самого попереднього значення і не враховуються двічі
+        add_meter('401', '111111', 0, 0)
+        messages = [(f'msg-{i}', 10 * (i + 1)) for i in range(40)]
+
+        def submit(part):
+            for message_id, value in part + part:
+                save_meter_data_and_bill('401', value, value, message_id=message_id)
+
+        threads = [threading.Thread(target=submit, args=(messages[i::4],)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM bills WHERE meter_id = '401'")
+        self.assertEqual(cursor.fetchone()[0], len(messages))
+        cursor.execute("SELECT day_value FROM meter_readings_history WHERE meter_id = '401' ORDER BY id")
+        values = [row[0] for row in cursor.fetchall()]
+        cursor.execute("SELECT day_kwh_used FROM bills WHERE meter_id = '401' ORDER BY id")
+        used = [row[0] for row in cursor.fetchall()]
+        conn.close()
+
+        previous = 0
+        for value, kwh in zip(values, used):
+            self.assertEqual(kwh, value - previous if value >= previous else 100)
+            previous = value
+
+    def _bills(self, meter_ids):
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT meter_id, day_kwh_used, night_kwh_used, total_cost FROM bills "
+            "WHERE meter_id IN (%s, %s) ORDER BY id", tuple(meter_ids))
+        bills = cursor.fetchall()
+        conn.close()
+        return bills
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,524 @@
+import os
+import json
+import asyncio
+import shutil
+import tempfile
+import random
+import threading
+import unittest
+from storage import SQLiteBackend, set_backend, _PooledConnection
+from reading_log import ReadingLog, REJECTED_MESSAGE
+import query_stats
+from datetime import datetime, timedelta
+from retention import compact_history, purge
+from anomaly import AnomalyDetector
+from rebilling import rebill
+from process_queue import process_batch
+from ingest_server import IngestServer, parse_reading, MAX_BODY_BYTES
+from tariffs import (save_register_readings, set_meter_registers, set_zone_tariff, invalidate_tariff_cache,
+                     update_tariffs, get_tariffs)
+from db import (get_connection, add_meter, get_meter, save_meter_data_and_bill, save_meter_readings_bulk,
+                get_meter_history, get_meter_history_page, delete_meter, get_consumption, get_meters_page,
+                get_anomalies, save_anomalies, ALREADY_PROCESSED_MESSAGE)
+
+class TestSQLiteBackend(unittest.TestCase):
+    # Ті самі сценарії, що й у test_db.py, але на вбудованому SQLite — без живого MySQL
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.previous_backend = set_backend(SQLiteBackend(os.path.join(cls.tmp_dir, 'test.db')))
+
+    @classmethod
+    def tearDownClass(cls):
+        set_backend(cls.previous_backend)
+        shutil.rmtree(cls.tmp_dir)
+
+    def setUp(self):
+        # Очищення таблиць перед кожним тестом
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM meter_readings_history")
+        cursor.execute("DELETE FROM bills")
+        cursor.execute("DELETE FROM meters")
+        cursor.execute("DELETE FROM processed_readings")
+        cursor.execute("DELETE FROM register_readings")
+        cursor.execute("DELETE FROM meter_registers")
+        cursor.execute("DELETE FROM tariff_zones")
+        cursor.execute("DELETE FROM reading_anomalies")
+        conn.commit()
+        conn.close()
+        invalidate_tariff_cache()
+
+    def bills(self, meter_id):
+        conn = get_connection()
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("SELECT * FROM bills WHERE meter_id = %s ORDER BY id", (meter_id,))
+        result = cursor.fetchall()
+        conn.close()
+        return result
+
+    def test_update_existing_meter(self):
+        add_meter('123', '123123', 100, 50)
+        result = save_meter_data_and_bill('123', 150, 70)
+
+        self.assertIn("Вартість: 144.00 грн", result)
+        meter = get_meter('123')
+        self.assertEqual(meter['day_value'], 150)
+        self.assertEqual(meter['night_value'], 70)
+
+        bills = self.bills('123')
+        self.assertEqual(len(bills), 1)
+        self.assertEqual(bills[0]['day_kwh_used'], 50)
+        self.assertEqual(bills[0]['night_kwh_used'], 20)
+
+    def test_add_new_meter(self):
+        result = save_meter_data_and_bill('456', 200, 100)
+
+        self.assertIn("Додано новий лічильник", result)
+        self.assertEqual(get_meter('456')['day_value'], 200)
+        self.assertEqual(self.bills('456'), [])
+        self.assertEqual(len(get_meter_history('456')), 1)
+
+    def test_underreported_both(self):
+        add_meter('102', '111111', 100, 50)
+        result = save_meter_data_and_bill('102', 90, 40)
+
+        self.assertIn("Накручено!", result)
+        self.assertIn("Вартість: 336.00 грн", result)
+        bills = self.bills('102')
+        self.assertEqual(bills[0]['day_kwh_used'], 100)
+        self.assertEqual(bills[0]['night_kwh_used'], 80)
+
+    def test_duplicate_meter(self):
+        add_meter('123', '123123')
+        self.assertEqual(add_meter('123', '123123'), "Такий лічильник вже існує.")
+
+    def test_bulk_matches_single(self):
+        readings = [('201', 150, 70), ('201', 140, 90), ('202', 10, 5), ('202', 30, 4)]
+
+        add_meter('201', '111111', 100, 50)
+        single = [save_meter_data_and_bill(m, d, n) for m, d, n in readings]
+        single_bills = [(b['day_kwh_used'], b['night_kwh_used'], b['total_cost'])
+                        for m in ('201', '202') for b in self.bills(m)]
+
+        self.setUp()
+        add_meter('201', '111111', 100, 50)
+        bulk = save_meter_readings_bulk([(m, d, n, None) for m, d, n in readings])
+        bulk_bills = [(b['day_kwh_used'], b['night_kwh_used'], b['total_cost'])
+                      for m in ('201', '202') for b in self.bills(m)]
+
+        self.assertEqual(bulk, single)
+        self.assertEqual(bulk_bills, single_bills)
+        self.assertEqual(get_meter('202')['night_value'], 4)
+        self.assertEqual(get_meter('201')['password'], '111111')
+
+    def test_delete_cascades(self):
+        add_meter('301', '111111', 0, 0)
+        save_meter_data_and_bill('301', 10, 10)
+        delete_meter('301')
+        self.assertEqual(get_meter_history('301'), [])
+        self.assertEqual(self.bills('301'), [])
+
+    def test_history_pages(self):
+        # Сторінки йдуть від новіших до старіших без пропусків і повторів,
+        # навіть якщо кілька показників мають однаковий час
+        save_meter_readings_bulk([('401', i, i, None) for i in range(45)])
+        seen = []
+        before = None
+        while True:
+            rows, before = get_meter_history_page('401', limit=20, before=before)
+            seen.extend(row['day_value'] for row in rows)
+            if before is None:
+                break
+        self.assertEqual(seen, [float(i) for i in reversed(range(45))])
+
+    def test_rollups_follow_bills(self):
+        # Місячні підсумки збігаються з сумою рахунків, в т.ч. з накрутками
+        add_meter('501', '111111', 100, 50)
+        save_meter_data_and_bill('501', 150, 70)
+        save_meter_readings_bulk([('501', 140, 90, None), ('501', 160, 95, None)])
+
+        bills = self.bills('501')
+        month = get_consumption('501', 'month')
+        self.assertEqual(len(month), 1)
+        self.assertEqual(month[0]['bills_count'], 3)
+        self.assertEqual(month[0]['fake_count'], 1)
+        self.assertAlmostEqual(month[0]['day_kwh'], sum(b['day_kwh_used'] for b in bills))
+        self.assertAlmostEqual(month[0]['cost'], sum(b['total_cost'] for b in bills))
+        self.assertEqual(get_consumption('501', 'day')[0]['bills_count'], 3)
+
+    def test_rebill_same_second(self):
+        # Кілька показників лічильника в одну секунду: кожен рахунок зіставляється рівно з одним
+        moment = datetime(2024, 2, 1, 12, 0, 0)
+        save_meter_readings_bulk([('502', 10, 5, moment), ('502', 20, 6, moment), ('502', 25, 9, moment)])
+        before = get_consumption('502', 'month')
+
+        report = rebill(moment - timedelta(hours=1), moment + timedelta(hours=1), ['502'], dry_run=False)
+        self.assertEqual((report['bills_old'], report['bills_new'], report['bills_changed']), (2, 2, 0))
+        self.assertEqual([(b['day_kwh_used'], b['night_kwh_used']) for b in self.bills('502')], [(10, 1), (5, 3)])
+        self.assertEqual(get_consumption('502', 'month'), before)
+
+    def test_meters_pages(self):
+        # Сторінки таблиці лічильників: без пропусків при однакових значеннях, пошук за префіксом ID
+        for i in range(7):
+            add_meter(f'6{i:02d}', '111111', i % 3, 0)
+        add_meter('7_0', '111111', 0, 0)
+
+        def all_pages(**kwargs):
+            seen, after = [], None
+            while True:
+                rows, after = get_meters_page(limit=2, after=after, **kwargs)
+                seen.extend(row['meter_id'] for row in rows)
+                if after is None:
+                    return seen
+
+        self.assertEqual(all_pages(prefix='6'), [f'6{i:02d}' for i in range(7)])
+        by_day = all_pages(order='day_value', descending=True)
+        self.assertEqual(by_day, ['605', '602', '604', '601', '7_0', '606', '603', '600'])
+        self.assertEqual(all_pages(prefix='7_'), ['7_0'])
+        self.assertEqual(all_pages(prefix='7%'), [])
+        with self.assertRaises(ValueError):
+            get_meters_page(order='password')
+
+    def test_message_id_is_idempotent(self):
+        add_meter('801', '111111', 100, 50)
+        save_meter_data_and_bill('801', 150, 70, message_id='m1')
+        self.assertEqual(save_meter_data_and_bill('801', 150, 70, message_id='m1'), ALREADY_PROCESSED_MESSAGE)
+        results = save_meter_readings_bulk([('801', 150, 70, None, 'm1'), ('801', 160, 80, None, 'm2'),
+                                            ('801', 160, 80, None, 'm2')])
+        self.assertEqual(results[0], ALREADY_PROCESSED_MESSAGE)
+        self.assertEqual(results[2], ALREADY_PROCESSED_MESSAGE)
+        self.assertEqual(len(self.bills('801')), 2)
+
+    def test_reading_log_replay(self):
+        # Після "збою" (позиція журналу не збереглась) повторний перенос не дублює рахунки,
+        # а недописаний рядок у кінці файлу відкидається
+        path = os.path.join(self.tmp_dir, 'readings.log')
+        add_meter('901', '111111', 100, 50)
+        log = ReadingLog(path)
+        ids = [log.append('901', 110 + i, 60 + i) for i in range(3)]
+        log.file.write(b'{"id": "torn"')
+        log.file.flush()
+        log.close()
+
+        log = ReadingLog(path)
+        with open(path, 'rb') as f:
+            content = f.read()
+        self.assertEqual(content.count(b'\n'), 3)
+        applied = log.drain(batch_size=2)
+        self.assertEqual(list(applied), ids)
+        self.assertEqual(os.path.getsize(path), 0)
+
+        with open(path, 'ab') as f:
+            f.write(content)
+        log._write_offset(0)
+        self.assertEqual(set(log.drain().values()), {ALREADY_PROCESSED_MESSAGE})
+        self.assertEqual(len(self.bills('901')), 3)
+        self.assertEqual(get_meter('901')['day_value'], 112)
+        log.close()
+
+    def test_batch_fallback_keeps_time(self):
+        # Пакет з поганим показником обробляється по одному, а решта рахується за своїм часом
+        start = datetime(2024, 3, 1, 12)
+        results = process_batch([
+            {'meter_id': 'p1', 'day_value': 1, 'night_value': 1, 'timestamp': start},
+            {'meter_id': 'p1', 'day_value': None, 'night_value': 2, 'timestamp': start + timedelta(hours=1)},
+            {'meter_id': 'p1', 'day_value': 5, 'night_value': 3, 'timestamp': start + timedelta(hours=2)},
+        ], False)
+        self.assertTrue(results[1].startswith("Помилка"))
+        self.assertEqual([bill['bill_time'] for bill in self.bills('p1')], [start + timedelta(hours=2)])
+
+    def test_reading_log_rejects_bad_record(self):
+        # Запис, який БД відкидає, і пошкоджений рядок не блокують журнал: решта переноситься, вони йдуть у .failed
+        path = os.path.join(self.tmp_dir, 'rejects.log')
+        add_meter('902', '111111', 100, 50)
+        log = ReadingLog(path)
+        first = log.append('902', 110, 60)
+        log.file.write(b'{"id": "bad", "meter_id": "902", "day_value": null, "night_value": 61, '
+                       b'"timestamp": "2024-01-01T12:00:00"}\n')
+        log.file.write(b'{"id": "corrupt", "meter_\n')
+        last = log.append('902', 120, 62)
+
+        applied = log.drain()
+        self.assertEqual(list(applied), [first, 'bad', last])
+        self.assertTrue(applied['bad'].startswith(REJECTED_MESSAGE))
+        self.assertEqual(len(self.bills('902')), 2)
+        self.assertEqual(log.pending(), 0)
+        with open(log.failed_path, encoding='utf-8') as f:
+            failed = [json.loads(line) for line in f]
+        self.assertEqual(failed[0]['raw'], '{"id": "corrupt", "meter_')
+        self.assertEqual([entry['id'] for entry in failed[1:]], ['bad'])
+        log.close()
+
+    def test_ingest_rejects_bad_input(self):
+        # NaN/inf і недопустимий meter_id не потрапляють у рахунки, а тіло HTTP без коректного розміру не читається
+        for value in ('NaN', 'Infinity', '-inf'):
+            with self.assertRaises(ValueError):
+                parse_reading(json.dumps({'meter_id': '1', 'day_value': value, 'night_value': 1}))
+        with self.assertRaises(ValueError):
+            parse_reading(json.dumps({'meter_id': '1', 'registers': {'L1': float('nan')}}))
+        for meter_id in ('', '   ', 'x' * 21):
+            with self.assertRaises(ValueError):
+                parse_reading(json.dumps({'meter_id': meter_id, 'day_value': 1, 'night_value': 1}))
+        self.assertEqual(parse_reading(json.dumps({'meter_id': ' 7 ', 'day_value': 1, 'night_value': 1}))['meter_id'], '7')
+
+        class Writer:
+            def __init__(self):
+                self.data = b""
+
+            def write(self, data):
+                self.data += data
+
+            async def drain(self):
+                pass
+
+        async def post(headers):
+            reader = asyncio.StreamReader()
+            reader.feed_data(headers + b"\r\n")
+            reader.feed_eof()
+            writer = Writer()
+            await IngestServer(workers=1).handle_http(reader, writer)
+            return writer.data.split(b"\r\n", 1)[0]
+
+        self.assertEqual(asyncio.run(post(b"")), b"HTTP/1.1 400 Bad Request")
+        self.assertEqual(asyncio.run(post(b"Content-Length: -5\r\n")), b"HTTP/1.1 400 Bad Request")
+        self.assertEqual(asyncio.run(post(f"Content-Length: {MAX_BODY_BYTES + 1}\r\n".encode())),
+                         b"HTTP/1.1 413 Payload Too Large")
+
+    def test_concurrent_billing(self):
+        # Кілька потоків одночасно шлють показники одного лічильника, поодинці й пакетами,
+        # з повторами повідомлень. Кожне повідомлення враховується рівно раз, і кожен рахунок
+        # порахований від показника, збереженого безпосередньо перед ним
+        add_meter('A1', '111111', 0, 0)
+        messages = [(f'msg-{i}', random.randint(0, 1000), random.randint(0, 1000)) for i in range(120)]
+        errors = []
+
+        def submit(part, bulk):
+            try:
+                # Кожне повідомлення потоку надсилається двічі
+                for start in range(0, len(part), 5):
+                    chunk = part[start:start + 5] * 2
+                    if bulk:
+                        save_meter_readings_bulk([('A1', d, n, None, m) for m, d, n in chunk])
+                    else:
+                        for m, d, n in chunk:
+                            save_meter_data_and_bill('A1', d, n, message_id=m)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=submit, args=(messages[i::8], i % 2 == 0)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+        conn = get_connection()
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("SELECT day_value, night_value FROM meter_readings_history WHERE meter_id = 'A1' ORDER BY id")
+        history = cursor.fetchall()
+        conn.close()
+        bills = self.bills('A1')
+        self.assertEqual(len(history), len(messages))
+        self.assertEqual(len(bills), len(messages))
+
+        previous = (0, 0)
+        for row, bill in zip(history, bills):
+            day_diff = row['day_value'] - previous[0]
+            night_diff = row['night_value'] - previous[1]
+            self.assertEqual(bill['day_kwh_used'], day_diff if day_diff >= 0 else 100)
+            self.assertEqual(bill['night_kwh_used'], night_diff if night_diff >= 0 else 80)
+            previous = (row['day_value'], row['night_value'])
+        self.assertEqual((get_meter('A1')['day_value'], get_meter('A1')['night_value']), previous)
+
+    def test_checkout_sees_other_commits(self):
+        # Знімок даних читання не повертається в пул разом із з'єднанням
+        add_meter('snap', '123123', 10, 5)
+        self.assertEqual(get_meter('snap')['day_value'], 10)
+
+        def update():
+            conn = get_connection()
+            conn.cursor().execute("UPDATE meters SET day_value = 42 WHERE meter_id = %s", ('snap',))
+            conn.commit()
+            conn.close()
+
+        worker = threading.Thread(target=update)
+        worker.start()
+        worker.join()
+        self.assertEqual(get_meter('snap')['day_value'], 42)
+
+        # З'єднання пулу MySQL перед поверненням завершує транзакцію
+        calls = []
+
+        class Connection:
+            def is_connected(self):
+                return True
+
+            def rollback(self):
+                calls.append('rollback')
+
+            def close(self):
+                calls.append('close')
+
+        _PooledConnection(Connection()).close()
+        self.assertEqual(calls, ['rollback', 'close'])
+
+    def test_query_stats(self):
+        # Кожен запит потрапляє в статистику під своєю міткою, повільні — в журнал повільних запитів
+        add_meter('B1', '111111', 100, 50)
+        slow_log = os.path.join(self.tmp_dir, 'slow.log')
+        saved = query_stats.SLOW_QUERY_MS, query_stats.SLOW_QUERY_LOG
+        query_stats.SLOW_QUERY_MS, query_stats.SLOW_QUERY_LOG = 0, slow_log
+        query_stats.reset()
+        try:
+            save_meter_data_and_bill('B1', 150, 70)
+        finally:
+            query_stats.SLOW_QUERY_MS, query_stats.SLOW_QUERY_LOG = saved
+
+        stats = query_stats.snapshot()
+        self.assertEqual(stats['queries']['UPDATE meters']['count'], 1)
+        self.assertEqual(stats['queries']['UPDATE meters']['rows'], 1)
+        self.assertEqual(stats['queries']['SELECT meters']['rows'], 1)
+        self.assertEqual(stats['acquire']['count'], 1)
+        self.assertIn('db_query_duration_seconds_count{query="INSERT bills"} 1', query_stats.prometheus_text())
+        with open(slow_log, encoding='utf-8') as f:
+            self.assertIn("UPDATE meters", f.read())
+
+    def test_compact_history(self):
+        # Старі показники стискаються до останнього за день, нові лишаються як є
+        old = datetime(2020, 1, 1, 8, 0)
+        readings = [('C1', 10 * i, i, old + timedelta(hours=6 * i), f'c-{i}') for i in range(8)]
+        readings.append(('C1', 500, 50, datetime.now(), 'c-new'))
+        save_meter_readings_bulk(readings)
+
+        self.assertEqual(compact_history(datetime(2021, 1, 1), chunk_size=3, pause=0), 8)
+        self.assertEqual([row['day_value'] for row in get_meter_history('C1')], [500])
+
+        conn = get_connection()
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("SELECT * FROM meter_readings_daily WHERE meter_id = 'C1' ORDER BY snapshot_date")
+        snapshots = cursor.fetchall()
+        conn.close()
+        self.assertEqual([(s['day_value'], s['readings_count']) for s in snapshots], [(20, 3), (60, 4), (70, 1)])
+        self.assertEqual(len(self.bills('C1')), 8)
+
+        self.assertEqual(purge('bills', datetime(2021, 1, 1), chunk_size=3, pause=0), 7)
+        self.assertEqual(purge('processed', datetime.now() + timedelta(days=1), pause=0), 9)
+
+        # Показники регістрів і записи про підозрілі показники теж мають строк зберігання
+        save_register_readings([('C2', {'L1': 1}, old), ('C2', {'L1': 2}, datetime.now())])
+        save_anomalies([('C2', old, 'jump', 99.0), ('C2', datetime.now(), 'spike', 5.0)])
+        self.assertEqual(purge('registers', datetime(2021, 1, 1), pause=0), 1)
+        self.assertEqual(purge('anomalies', datetime(2021, 1, 1), pause=0), 1)
+        self.assertEqual([row['reason'] for row in get_anomalies('C2')], ['spike'])
+
+    def test_registers_match_day_night(self):
+        # Лічильник з регістрами day/night рахується так само, як звичайний
+        add_meter('reg', '123123')
+        set_meter_registers('reg', {'day': 'day', 'night': 'night'})
+        moment = datetime(2024, 1, 1, 12)
+        save_register_readings([('reg', {'day': 100, 'night': 50}, moment)])
+        result = save_register_readings([('reg', {'day': 150, 'night': 40}, moment + timedelta(hours=1))])[0]
+
+        self.assertIn("Вартість: 216.00 грн", result)
+        self.assertIn("Накручено!", result)
+        bills = self.bills('reg')
+        self.assertEqual((bills[0]['day_kwh_used'], bills[0]['night_kwh_used']), (50, 80))
+
+    def test_dated_tariffs(self):
+        # Нові ставки діють з дати зміни і однаково для лічильників день/ніч і з регістрами;
+        # показники, що прийшли із запізненням, рахуються за старими ставками
+        update_tariffs(3.0, 1.5, effective_from=datetime(2024, 1, 1, 18))
+        self.assertEqual(get_tariffs(), {'day_tariff': 3.0, 'night_tariff': 1.5})
+        add_meter('dn', '123123', 0, 0)
+        add_meter('reg', '123123')
+        set_meter_registers('reg', {'day': 'day', 'night': 'night'})
+        save_register_readings([('reg', {'day': 0, 'night': 0}, datetime(2024, 1, 1, 6))])
+
+        save_meter_readings_bulk([('dn', 10, 10, datetime(2024, 1, 1, 12)), ('dn', 20, 20, datetime(2024, 1, 1, 20))])
+        save_register_readings([('reg', {'day': 10, 'night': 10}, datetime(2024, 1, 1, 12)),
+                                ('reg', {'day': 20, 'night': 20}, datetime(2024, 1, 1, 20))])
+
+        for meter_id in ('dn', 'reg'):
+            self.assertEqual([round(bill['total_cost'], 2) for bill in self.bills(meter_id)], [36.0, 45.0])
+
+        # Перерахунок бере ті самі датовані ставки, тож рахунки не змінюються
+        report = rebill(datetime(2024, 1, 1), datetime(2024, 1, 2), ['dn'], dry_run=False)
+        self.assertEqual((report['bills_new'], report['bills_changed']), (2, 0))
+
+    def test_register_time_windows(self):
+        # Фази без власної зони рахуються за вікном доби; нова ставка діє з дати effective_from
+        add_meter('3ph', '123123')
+        set_meter_registers('3ph', {'L1': None, 'L2': None, 'L3': None})
+        start = datetime(2024, 1, 1, 6)
+        set_zone_tariff('day', 3.0, effective_from=datetime(2024, 1, 1, 18))
+        results = save_register_readings([
+            ('3ph', {'L1': 10, 'L2': 20, 'L3': 30}, start),
+            ('3ph', {'L1': 11, 'L2': 22, 'L3': 33}, start + timedelta(hours=6)),   # 12:00, день, 2.4
+            ('3ph', {'L1': 12, 'L2': 24, 'L3': 36}, start + timedelta(hours=14)),  # 20:00, день, 3.0
+            ('3ph', {'L1': 13, 'L2': 26, 'L3': 39}, start + timedelta(hours=18)),  # 00:00, ніч, 1.2
+        ])
+
+        self.assertEqual(results[0], "Додано новий лічильник. Початкові дані збережено.")
+        self.assertEqual([round(bill['total_cost'], 2) for bill in self.bills('3ph')], [14.4, 18.0, 7.2])
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT zone, COUNT(*) FROM register_readings WHERE kwh_used IS NOT NULL GROUP BY zone ORDER BY zone")
+        self.assertEqual(cursor.fetchall(), [('day', 6), ('night', 3)])
+        conn.close()
+
+    def test_register_message_id(self):
+        add_meter('idem', '123123')
+        save_register_readings([('idem', {'day': 1}, datetime(2024, 1, 1, 12))])
+        reading = ('idem', {'day': 5}, datetime(2024, 1, 1, 13), 'msg-1')
+        save_register_readings([reading])
+        self.assertEqual(save_register_readings([reading]), [ALREADY_PROCESSED_MESSAGE])
+        self.assertEqual(len(self.bills('idem')), 1)
+
+        # Лічильник, створений показником з регістрами, приймає і звичайні показники день/ніч
+        save_register_readings([('regs', {'L1': 1}, datetime(2024, 1, 1, 12))])
+        self.assertEqual((get_meter('regs')['day_value'], get_meter('regs')['night_value']), (0, 0))
+        self.assertIn("Вартість", save_meter_data_and_bill('regs', 10, 5))
+
+    def test_anomaly_detection(self):
+        # Рівне споживання ~1 кВт·год за годину, потім сплеск, скручування і неможливий стрибок
+        detector = AnomalyDetector()
+        start = datetime(2024, 1, 1)
+        batch = [{'meter_id': 'a1', 'day_value': 100 + hour + hour % 2 * 0.2, 'night_value': 50,
+                  'timestamp': start + timedelta(hours=hour)} for hour in range(20)]
+        self.assertEqual(detector.check_batch(batch), [])
+
+        later = start + timedelta(hours=20)
+        anomalies = detector.check_batch([
+            {'meter_id': 'a1', 'day_value': 130, 'night_value': 50, 'timestamp': later},
+            {'meter_id': 'a1', 'day_value': 125, 'night_value': 51, 'timestamp': later + timedelta(hours=1)},
+            {'meter_id': 'a1', 'day_value': 900, 'night_value': 51, 'timestamp': later + timedelta(hours=2)},
+        ])
+        self.assertEqual([reason for _, _, reason, _ in anomalies], ['spike', 'rollback', 'jump'])
+
+        # Два показники з одного пакета мають власний час надходження, а повтор у той самий момент
+        # не вважається стрибком
+        first = parse_reading(json.dumps({'meter_id': 'a4', 'day_value': 100, 'night_value': 50}))
+        second = parse_reading(json.dumps({'meter_id': 'a4', 'day_value': 101, 'night_value': 50}))
+        first['timestamp'] = second['timestamp'] - timedelta(hours=1)
+        repeat = dict(second, day_value=150)
+        self.assertEqual(AnomalyDetector(max_kw=10).check_batch([first, second, repeat]), [])
+
+        # Підозрілі показники все одно рахуються і записуються для перевірки
+        process_batch([{'meter_id': 'a2', 'day_value': 1, 'night_value': 1},
+                       {'meter_id': 'a2', 'day_value': 0, 'night_value': 1}], False, AnomalyDetector())
+        self.assertEqual(len(self.bills('a2')), 1)
+        self.assertEqual([row['reason'] for row in get_anomalies('a2')], ['rollback'])
+
+        # Показники, що йдуть через локальний журнал, перевіряються так само
+        log = ReadingLog(os.path.join(self.tmp_dir, 'anomalies.log'), AnomalyDetector())
+        log.append('a3', 10, 10, start)
+        log.append('a3', 5, 11, start + timedelta(hours=1))
+        log.drain()
+        log.close()
+        self.assertEqual([row['reason'] for row in get_anomalies('a3')], ['rollback'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+# Як часто головний потік Tk перевіряє готові результати, мс
+POLL_MS = 30
+
+
+# Фоновий виконавець для вікон customtkinter.
+# Запити до БД виконуються в окремих потоках, а колбеки з результатом
+# викликаються в головному потоці через after() — Tk не можна чіпати з інших потоків.
+# Повторний запуск задачі з тим самим ключем, поки попередня не завершилась,
+# ігнорується: швидкі повторні кліки не ставлять у чергу однакові запити.
+# Якщо поки йшов запит користувач перейшов на інший екран (next_screen()),
+# результат для старого екрана вже не показується. Ключ читання діє в межах екрана:
+# повернувшись на екран, користувач отримає новий запит, а не чекатиме на старий.
+# Ключ запису (write=True) діє для всіх екранів: повернувшись на екран, поки збереження
+# ще триває, користувач не відправить той самий запис удруге.
+class BackgroundTasks:
+    def __init__(self, root, workers=2):
+        self.root = root
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.running = set()
+        self.results = queue.Queue()
+        self.polling = False
+        self.screen = 0
+
+    def next_screen(self):
+        self.screen += 1
+
+    def run(self, key, func, *args, on_done=None, on_error=None, write=False):
+        # Повертає False, якщо задача з таким ключем ще виконується для цього екрана
+        # (для write=True — для будь-якого екрана)
+        screen = self.screen
+        if self.busy(key):
+            return False
+        entry = (None if write else screen, key)
+        self.running.add(entry)
+        future = self.executor.submit(func, *args)
+        future.add_done_callback(lambda f: self.results.put((entry, screen, f, on_done, on_error)))
+        if not self.polling:
+            self.polling = True
+            self.root.after(POLL_MS, self._poll)
+        return True
+
+    def busy(self, key):
+        return (self.screen, key) in self.running or (None, key) in self.running
+
+    def _poll(self):
+        while True:
+            try:
+                entry, screen, future, on_done, on_error = self.results.get_nowait()
+            except queue.Empty:
+                break
+            self.running.discard(entry)
+            key = entry[1]
+            error = future.exception()
+            if screen != self.screen:
+                if error is not None:
+                    print(f"Помилка фонової задачі {key}: {error}")
+                continue
+            try:
+                if error is None:
+                    if on_done is not None:
+                        on_done(future.result())
+                elif on_error is not None:
+                    on_error(error)
+                else:
+                    print(f"Помилка фонової задачі {key}: {error}")
+            except Exception as e:
+                print(f"Помилка обробки результату {key}: {e}")
+
+        if self.running:
+            self.root.after(POLL_MS, self._poll)
+        else:
+            self.polling = False
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
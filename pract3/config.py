@@ -1,8 +1,14 @@
-# config.py
-DB_CONFIG = {
-    'host': 'localhost',
-    'user': 'root',
-    'password': '123456', 
-    'database': 'weather_data',
-    'port': 3306
-}
\ No newline at end of file
+# config.py
+DB_CONFIG = {
+    'host': 'localhost',
+    'user': 'root',
+    'password': '123456', 
+    'database': 'weather_data',
+    'port': 3306
+}
+
+# Станція, для якої main.py будує прогноз
+LOCATION = 'Basel'
+
+# Тека локального кешу get_weather_data (Feather, потрібен pyarrow); None — завжди читати з БД
+WEATHER_CACHE_DIR = '.weather_cache'
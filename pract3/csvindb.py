@@ -1,70 +1,298 @@
-# csvinDB.py
-import pandas as pd
-from mysql.connector import Error
-from db import get_connection
-
-# Наповнення бази даними з CSV
-csv_file = 'dataexport_20250508T130923.csv'
-
-try:
-    # Завантаження CSV, вказуємо рядок із заголовками
-    data = pd.read_csv(csv_file, header=9)
-    print("Назви стовпців у CSV:", list(data.columns))
-    if 'timestamp' not in data.columns:
-        raise ValueError("Стовпець 'timestamp' не знайдено в CSV")
-
-    print("Перші 5 значень стовпця timestamp:", data['timestamp'].head().tolist())
-    data['timestamp'] = pd.to_datetime(data['timestamp'], format='%Y%m%dT%H%M')
-
-    conn = get_connection()
-    cursor = conn.cursor()
-
-    insert_query = """
-    INSERT INTO weather_data (
-        timestamp, temperature, precipitation, humidity, snowfall,
-        snow_depth, wind_gust, wind_speed_10m, wind_direction_10m,
-        wind_speed_100m, wind_direction_100m, cloud_cover_total,
-        cloud_cover_high, cloud_cover_medium, cloud_cover_low, pressure
-    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-    """
-
-    count = 0
-    for index, row in data.iterrows():
-        print(f"Обробка рядка {index}: timestamp={row['timestamp']}, temperature={row['Basel Temperature [2 m elevation corrected]']}")
-        values = (
-            row['timestamp'].to_pydatetime(),
-            row['Basel Temperature [2 m elevation corrected]'],
-            row['Basel Precipitation Total'],
-            row['Basel Relative Humidity [2 m]'],
-            row['Basel Snowfall Amount'],
-            row['Basel Snow Depth'],
-            row['Basel Wind Gust'],
-            row['Basel Wind Speed [10 m]'],
-            row['Basel Wind Direction [10 m]'],
-            row['Basel Wind Speed [100 m]'],
-            row['Basel Wind Direction [100 m]'],
-            row['Basel Cloud Cover Total'],
-            row['Basel Cloud Cover High [high cld lay]'],
-            row['Basel Cloud Cover Medium [mid cld lay]'],
-            row['Basel Cloud Cover Low [low cld lay]'],
-            row['Basel Mean Sea Level Pressure [MSL]']
-        )
-        cursor.execute(insert_query, values)
-        count += 1
-
-    conn.commit()
-    print(f"Успішно вставлено {count} записів у таблицю weather_data.")
-except Error as e:
-    print(f"Помилка бази даних: {e}")
-except FileNotFoundError:
-    print(f"Файл {csv_file} не знайдено. Перевірте шлях до файлу.")
-except ValueError as e:
-    print(f"Помилка даних: {e}")
-except Exception as e:
-    print(f"Інша помилка: {e}")
-finally:
-    if 'cursor' in locals():
-        cursor.close()
-    if 'conn' in locals() and conn.is_connected():
-        conn.close()
-        print("Підключення до MySQL закрито.")
\ No newline at end of file
+# csvinDB.py
+import os
+import csv
+import glob
+import time
+import argparse
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from mysql.connector import Error
+from db import get_connection, get_location_ids, ensure_schema
+
+# Наповнення бази даними з CSV
+csv_file = 'dataexport_20250508T130923.csv'
+
+# Рядок із заголовками стовпців (перед ним — метадані meteoblue: location, lat, lon, ...)
+HEADER_ROW = 9
+# Скільки рядків CSV читати за раз і скільки рядків іде в БД одним INSERT
+CHUNK_SIZE = 50000
+BATCH_SIZE = 2000
+
+# Як часто режим спостереження перевіряє теку з експортами, с
+WATCH_INTERVAL = 60
+# Скільки файлів завантажувати одночасно (окремими процесами)
+WORKERS = min(4, os.cpu_count() or 1)
+
+# Змінна meteoblue (назва стовпця без назви станції) -> стовпець таблиці weather_data
+COLUMN_MAP = {
+    'Temperature [2 m elevation corrected]': 'temperature',
+    'Precipitation Total': 'precipitation',
+    'Relative Humidity [2 m]': 'humidity',
+    'Snowfall Amount': 'snowfall',
+    'Snow Depth': 'snow_depth',
+    'Wind Gust': 'wind_gust',
+    'Wind Speed [10 m]': 'wind_speed_10m',
+    'Wind Direction [10 m]': 'wind_direction_10m',
+    'Wind Speed [100 m]': 'wind_speed_100m',
+    'Wind Direction [100 m]': 'wind_direction_100m',
+    'Cloud Cover Total': 'cloud_cover_total',
+    'Cloud Cover High [high cld lay]': 'cloud_cover_high',
+    'Cloud Cover Medium [mid cld lay]': 'cloud_cover_medium',
+    'Cloud Cover Low [low cld lay]': 'cloud_cover_low',
+    'Mean Sea Level Pressure [MSL]': 'pressure',
+}
+WEATHER_COLUMNS = list(COLUMN_MAP.values())
+
+# Повторне завантаження того самого періоду оновлює рядки за унікальним індексом (location_id, timestamp)
+insert_query = f"""
+INSERT INTO weather_data (location_id, timestamp, {', '.join(WEATHER_COLUMNS)})
+VALUES ({', '.join(['%s'] * (len(WEATHER_COLUMNS) + 2))})
+ON DUPLICATE KEY UPDATE {', '.join(f'{c} = VALUES({c})' for c in WEATHER_COLUMNS)}
+"""
+
+
+def read_header(path):
+    """Повертає (назви стовпців, метадані) із заголовка експорту meteoblue.
+
+    Метадані — {назва рядка: значення по стовпцях}, наприклад {'location': [...], 'lat': [...]}.
+    """
+    with open(path, newline='', encoding='utf-8') as f:
+        rows = [row for _, row in zip(range(HEADER_ROW + 1), csv.reader(f))]
+    if len(rows) <= HEADER_ROW or 'timestamp' not in rows[HEADER_ROW]:
+        raise ValueError("Стовпець 'timestamp' не знайдено в CSV")
+    meta = {row[0]: row for row in rows[:HEADER_ROW] if row}
+    return rows[HEADER_ROW], meta
+
+
+def _number(values, index):
+    try:
+        return float(values[index])
+    except (IndexError, ValueError):
+        return None
+
+
+def map_columns(path, locations=None):
+    """Один раз зіставляє стовпці CSV зі стовпцями weather_data для кожної станції експорту.
+
+    Повертає {станція: {'coords': (lat, lon, asl), 'columns': {стовпець CSV: стовпець таблиці}}}.
+    locations — назви станцій, які треба завантажити (None — усі).
+    """
+    columns, meta = read_header(path)
+    names = meta.get('location', [''] * len(columns))
+    stations = {}
+    for index, column in enumerate(columns):
+        name = names[index] if index < len(names) else ''
+        if column == 'timestamp' or not name or (locations is not None and name not in locations):
+            continue
+        variable = column[len(name):].strip() if column.startswith(name) else column
+        if variable not in COLUMN_MAP:
+            continue
+        station = stations.setdefault(name, {
+            'coords': tuple(_number(meta.get(key, []), index) for key in ('lat', 'lon', 'asl')),
+            'columns': {},
+        })
+        station['columns'][column] = COLUMN_MAP[variable]
+
+    if not stations:
+        raise ValueError("У CSV не знайдено жодної станції" + (f" з {', '.join(locations)}" if locations else ""))
+    for name, station in stations.items():
+        missing = set(WEATHER_COLUMNS) - set(station['columns'].values())
+        if missing:
+            raise ValueError(f"У CSV немає стовпців для {name}: {', '.join(sorted(missing))}")
+    return stations
+
+
+def iter_chunks(path, stations, chunk_size=CHUNK_SIZE):
+    """Читає CSV частинами і повертає (станція, DataFrame) для кожної станції кожної частини.
+
+    Читаються лише потрібні стовпці, дати перетворюються для всієї частини одразу.
+    """
+    usecols = ['timestamp'] + [column for station in stations.values() for column in station['columns']]
+    reader = pd.read_csv(path, header=HEADER_ROW, usecols=usecols, chunksize=chunk_size)
+    for chunk in reader:
+        timestamps = pd.to_datetime(chunk['timestamp'], format='%Y%m%dT%H%M')
+        for name, station in stations.items():
+            frame = chunk[list(station['columns'])].rename(columns=station['columns'])
+            frame.insert(0, 'timestamp', timestamps)
+            yield name, frame[['timestamp'] + WEATHER_COLUMNS]
+
+
+def chunk_rows(chunk, location_id):
+    """Рядки для executemany: id станції, datetime і float, пропуски (NaN) -> NULL."""
+    values = chunk[WEATHER_COLUMNS].astype(object).where(chunk[WEATHER_COLUMNS].notna(), None)
+    return list(zip([location_id] * len(chunk), chunk['timestamp'].dt.to_pydatetime(),
+                    *(values[c].tolist() for c in WEATHER_COLUMNS)))
+
+
+def _rewrites_history(cursor, location_id, first):
+    """Чи торкається частина, що починається з first, уже збережених годин станції."""
+    # MAX по індексу (location_id, timestamp) — один перехід по індексу
+    cursor.execute("SELECT MAX(timestamp) FROM weather_data WHERE location_id = %s", (location_id,))
+    last = cursor.fetchone()[0]
+    return last is not None and first <= last
+
+
+def read_last_timestamp(path):
+    """Дата останнього рядка CSV без читання всього файлу (None, якщо даних немає)."""
+    with open(path, 'rb') as f:
+        end = f.seek(0, os.SEEK_END)
+        f.seek(max(0, end - 4096))
+        lines = [line for line in f.read().splitlines() if line.strip()]
+    if not lines:
+        return None
+    try:
+        return pd.to_datetime(lines[-1].split(b',', 1)[0].decode(), format='%Y%m%dT%H%M').to_pydatetime()
+    except ValueError:
+        return None
+
+
+def get_last_timestamps():
+    """Найновіша збережена дата для кожної станції: {назва: datetime}."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        # MAX по індексу (location_id, timestamp) — без перегляду таблиці
+        cursor.execute("""
+        SELECT l.name, MAX(w.timestamp)
+        FROM weather_data w JOIN locations l ON l.id = w.location_id
+        GROUP BY l.name
+        """)
+        return dict(cursor.fetchall())
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def load_csv(path, locations=None, chunk_size=CHUNK_SIZE, batch_size=BATCH_SIZE, since=None):
+    """Завантажує експорт у weather_data. Повертає кількість завантажених рядків.
+
+    Кожна частина CSV вставляється багаторядковими INSERT по batch_size рядків
+    і підтверджується окремим commit. since — {станція: datetime}: для станції
+    завантажуються лише рядки, новіші за її дату. Якщо частина переписує чи доповнює
+    вже збережені години, у тій самій транзакції зростає locations.revision —
+    за нею локальні кеші (weather_cache.py) дізнаються, що треба перебудуватись.
+    """
+    stations = map_columns(path, locations)
+    conn = get_connection()
+    cursor = conn.cursor()
+    count = 0
+    try:
+        ids = get_location_ids({name: station['coords'] for name, station in stations.items()}, conn)
+        for name, chunk in iter_chunks(path, stations, chunk_size):
+            if since and since.get(name) is not None:
+                chunk = chunk[chunk['timestamp'] > since[name]]
+            rows = chunk_rows(chunk, ids[name])
+            if rows and _rewrites_history(cursor, ids[name], chunk['timestamp'].min()):
+                cursor.execute("UPDATE locations SET revision = revision + 1 WHERE id = %s", (ids[name],))
+            for i in range(0, len(rows), batch_size):
+                cursor.executemany(insert_query, rows[i:i + batch_size])
+            conn.commit()
+            count += len(rows)
+    finally:
+        cursor.close()
+        conn.close()
+    return count
+
+
+def load_files(paths, locations=None, since=None, workers=WORKERS):
+    """Завантажує кілька експортів паралельно: один файл на процес.
+
+    Розбір CSV і підготовка рядків займають процесор, тож окремі процеси
+    (а не потоки) справді працюють одночасно; кожен має власне з'єднання з БД.
+    Повертає загальну кількість завантажених рядків.
+    """
+    ensure_schema()
+    if workers <= 1 or len(paths) <= 1:
+        return sum(load_csv(path, locations, since=since) for path in paths)
+    with ProcessPoolExecutor(max_workers=min(workers, len(paths))) as pool:
+        return sum(pool.map(partial(load_csv, locations=locations, since=since), paths))
+
+
+def list_exports(path):
+    """Файл або всі .csv у теці — за назвою, тобто за датою експорту (dataexport_YYYYMMDDTHHMMSS.csv)."""
+    if os.path.isdir(path):
+        return sorted(glob.glob(os.path.join(path, '*.csv')))
+    return [path]
+
+
+def load_incremental(path, locations=None, workers=WORKERS):
+    """Дозавантажує лише рядки, новіші за MAX(timestamp) своєї станції у weather_data.
+
+    path — файл або тека з експортами. Файли, останній рядок яких не новіший
+    за вже збережені дані всіх їхніх станцій, пропускаються без читання.
+    Повертає кількість нових рядків.
+    """
+    ensure_schema()
+    since = get_last_timestamps()
+    pending = []
+    for export in list_exports(path):
+        last = read_last_timestamp(export)
+        if last is None:
+            continue
+        names = set(read_header(export)[1].get('location', [])[1:])
+        if locations is not None:
+            names &= set(locations)
+        if names and all(since.get(name) is not None and last <= since[name] for name in names):
+            continue
+        pending.append(export)
+    return load_files(pending, locations, since, workers)
+
+
+def watch(directory, locations=None, interval=WATCH_INTERVAL):
+    """Стежить за текою і дозавантажує нові експорти, щойно вони з'являються.
+
+    Файл береться в роботу, коли його розмір і час зміни не змінились між двома
+    перевірками (тобто його вже дописано). Працює, доки не перервати (Ctrl+C).
+    """
+    seen = {}
+    loaded = {}
+    while True:
+        for export in list_exports(directory):
+            try:
+                stat = os.stat(export)
+            except FileNotFoundError:
+                continue
+            state = (stat.st_size, stat.st_mtime)
+            previous, seen[export] = seen.get(export), state
+            if state != previous or loaded.get(export) == state:
+                continue
+            count = load_incremental(export, locations)
+            loaded[export] = state
+            if count:
+                print(f"{os.path.basename(export)}: завантажено {count} нових записів.")
+        time.sleep(interval)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Завантаження експорту meteoblue у weather_data")
+    parser.add_argument('path', nargs='?', default=csv_file, help="CSV-файл або тека з експортами")
+    parser.add_argument('--incremental', action='store_true',
+                        help="лише рядки, новіші за останній збережений timestamp")
+    parser.add_argument('--watch', type=float, metavar='SEC', nargs='?', const=WATCH_INTERVAL,
+                        help="стежити за текою і дозавантажувати нові файли кожні SEC секунд")
+    parser.add_argument('--location', action='append', dest='locations', metavar='NAME',
+                        help="завантажувати лише цю станцію (можна кілька разів; за замовчуванням — усі)")
+    parser.add_argument('--workers', type=int, default=WORKERS, help="скільки файлів завантажувати одночасно")
+    args = parser.parse_args()
+    try:
+        if args.watch:
+            print(f"Спостереження за {args.path} (Ctrl+C — зупинити)")
+            watch(args.path, args.locations, args.watch)
+        started = time.perf_counter()
+        if args.incremental:
+            count = load_incremental(args.path, args.locations, args.workers)
+        else:
+            count = load_files(list_exports(args.path), args.locations, workers=args.workers)
+        print(f"Успішно завантажено {count} записів у таблицю weather_data "
+              f"за {time.perf_counter() - started:.2f} с.")
+    except KeyboardInterrupt:
+        print("Зупинено.")
+    except Error as e:
+        print(f"Помилка бази даних: {e}")
+    except FileNotFoundError:
+        print(f"Файл {args.path} не знайдено. Перевірте шлях до файлу.")
+    except ValueError as e:
+        print(f"Помилка даних: {e}")
+    except Exception as e:
+        print(f"Інша помилка: {e}")
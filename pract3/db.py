@@ -1,104 +1,286 @@
-# db.py
-import mysql.connector
-import pandas as pd
-from sqlalchemy import create_engine
-from mysql.connector import Error
-from config import DB_CONFIG
-
-def get_connection():
-    """Повертає з'єднання з базою даних через mysql-connector."""
-    return mysql.connector.connect(**DB_CONFIG)
-
-def get_weather_data():
-    """Повертає всі дані з таблиці weather_data через SQLAlchemy."""
-    try:
-        db_uri = f"mysql+pymysql://{DB_CONFIG['user']}:{DB_CONFIG['password']}@{DB_CONFIG['host']}:{DB_CONFIG['port']}/{DB_CONFIG['database']}"
-        engine = create_engine(db_uri)
-        query = "SELECT * FROM weather_data ORDER BY timestamp"
-        data = pd.read_sql(query, engine)
-        return data
-    except Exception as e:
-        print(f"Помилка: {e}")
-        return None
-    finally:
-        engine.dispose()
-
-def save_prediction(forecast_date, predicted_temperature, predicted_gdd, predicted_precipitation,
-                   predicted_humidity, predicted_snowfall, predicted_snow_depth, predicted_wind_gust,
-                   predicted_wind_speed_10m, predicted_wind_direction_10m, predicted_wind_speed_100m,
-                   predicted_wind_direction_100m, predicted_cloud_cover_total, predicted_cloud_cover_high,
-                   predicted_cloud_cover_medium, predicted_cloud_cover_low, predicted_pressure):
-    """Зберігає прогноз у таблицю predictions."""
-    conn = None
-    cursor = None
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-
-        # Створення таблиці predictions, якщо не існує
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS predictions (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            forecast_date DATETIME NOT NULL,
-            predicted_temperature FLOAT,
-            predicted_gdd FLOAT,
-            predicted_precipitation FLOAT,
-            predicted_humidity FLOAT,
-            predicted_snowfall FLOAT,
-            predicted_snow_depth FLOAT,
-            predicted_wind_gust FLOAT,
-            predicted_wind_speed_10m FLOAT,
-            predicted_wind_direction_10m FLOAT,
-            predicted_wind_speed_100m FLOAT,
-            predicted_wind_direction_100m FLOAT,
-            predicted_cloud_cover_total FLOAT,
-            predicted_cloud_cover_high FLOAT,
-            predicted_cloud_cover_medium FLOAT,
-            predicted_cloud_cover_low FLOAT,
-            predicted_pressure FLOAT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        """)
-
-        # Конвертація всіх параметрів у float
-        params = (
-            forecast_date,
-            float(predicted_temperature),
-            float(predicted_gdd),
-            float(predicted_precipitation),
-            float(predicted_humidity),
-            float(predicted_snowfall),
-            float(predicted_snow_depth),
-            float(predicted_wind_gust),
-            float(predicted_wind_speed_10m),
-            float(predicted_wind_direction_10m),
-            float(predicted_wind_speed_100m),
-            float(predicted_wind_direction_100m),
-            float(predicted_cloud_cover_total),
-            float(predicted_cloud_cover_high),
-            float(predicted_cloud_cover_medium),
-            float(predicted_cloud_cover_low),
-            float(predicted_pressure)
-        )
-
-        # Вставка прогнозу
-        cursor.execute("""
-        INSERT INTO predictions (
-            forecast_date, predicted_temperature, predicted_gdd, predicted_precipitation,
-            predicted_humidity, predicted_snowfall, predicted_snow_depth, predicted_wind_gust,
-            predicted_wind_speed_10m, predicted_wind_direction_10m, predicted_wind_speed_100m,
-            predicted_wind_direction_100m, predicted_cloud_cover_total, predicted_cloud_cover_high,
-            predicted_cloud_cover_medium, predicted_cloud_cover_low, predicted_pressure
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """, params)
-
-        conn.commit()
-        print("Прогноз збережено в таблиці predictions.")
-    except Error as e:
-        print(f"Помилка: {e}")
-    finally:
-        if cursor is not None:
-            cursor.close()
-        if conn is not None and conn.is_connected():
-            conn.close()
+# db.py
+import atexit
+import mysql.connector
+import pandas as pd
+from sqlalchemy import create_engine, text, bindparam
+from mysql.connector import Error
+from config import DB_CONFIG, WEATHER_CACHE_DIR
+import weather_cache
+
+# Станція, з якої завантажувались дані до появи таблиці locations
+# (csvindb.py брав лише стовпці "Basel ..." з dataexport_20250508T130923.csv)
+LEGACY_LOCATION = ('Basel', 47.75, 7.5, 363.653)
+
+# Тип стовпців погоди у get_weather_data: float32 вдвічі менший за float64,
+# а точності FLOAT з БД (4 байти) він не втрачає
+WEATHER_DTYPE = 'float32'
+
+_schema_ready = False
+_engine = None
+
+def get_connection():
+    """Повертає з'єднання з базою даних через mysql-connector."""
+    return mysql.connector.connect(**DB_CONFIG)
+
+def get_engine():
+    """Повертає спільний для модуля SQLAlchemy engine з пулом з'єднань.
+
+    Engine створюється при першому виклику і далі перевикористовується:
+    з'єднання беруться з пулу, а не відкриваються заново на кожен запит.
+    """
+    global _engine
+    if _engine is None:
+        db_uri = f"mysql+pymysql://{DB_CONFIG['user']}:{DB_CONFIG['password']}@{DB_CONFIG['host']}:{DB_CONFIG['port']}/{DB_CONFIG['database']}"
+        # pool_pre_ping і pool_recycle — щоб не отримати з пулу з'єднання, яке MySQL уже закрив
+        _engine = create_engine(db_uri, pool_size=5, pool_pre_ping=True, pool_recycle=3600)
+    return _engine
+
+@atexit.register
+def dispose_engine():
+    """Закриває всі з'єднання пулу (наступний get_engine() створить новий engine)."""
+    global _engine
+    if _engine is not None:
+        _engine.dispose()
+        _engine = None
+
+def ensure_schema():
+    """Доводить стару схему (одна станція) до схеми з кількома станціями.
+
+    Створює таблицю locations (або додає до неї revision), а в weather_data додає
+    location_id і унікальний індекс (location_id, timestamp) замість idx_timestamp.
+    Наявні рядки прив'язуються до LEGACY_LOCATION. На новій схемі нічого не змінює.
+    Викликається при запуску (main.py) і завантажувачем, а не при кожному читанні.
+    """
+    global _schema_ready
+    if _schema_ready:
+        return
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS locations (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            name VARCHAR(100) NOT NULL,
+            lat FLOAT,
+            lon FLOAT,
+            asl FLOAT,
+            revision INT NOT NULL DEFAULT 0,
+            UNIQUE INDEX idx_location_name (name)
+        )
+        """)
+        cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = 'locations' AND column_name = 'revision'
+        """)
+        if cursor.fetchone()[0] == 0:
+            cursor.execute("ALTER TABLE locations ADD COLUMN revision INT NOT NULL DEFAULT 0")
+        cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = 'weather_data' AND column_name = 'location_id'
+        """)
+        if cursor.fetchone()[0] == 0:
+            legacy_id = get_location_ids({LEGACY_LOCATION[0]: LEGACY_LOCATION[1:]}, conn)[LEGACY_LOCATION[0]]
+            cursor.execute(f"""
+            ALTER TABLE weather_data
+                ADD COLUMN location_id INT NOT NULL DEFAULT {int(legacy_id)} AFTER id,
+                DROP INDEX idx_timestamp,
+                ADD UNIQUE INDEX idx_location_timestamp (location_id, timestamp),
+                ADD FOREIGN KEY (location_id) REFERENCES locations(id)
+            """)
+            cursor.execute("ALTER TABLE weather_data ALTER COLUMN location_id DROP DEFAULT")
+        conn.commit()
+        _schema_ready = True
+    finally:
+        cursor.close()
+        conn.close()
+
+def get_location_ids(stations, conn=None):
+    """Повертає {назва станції: id}, додаючи нові станції в locations.
+
+    stations — {назва: (lat, lon, asl)} із заголовка експорту meteoblue.
+    """
+    own_conn = conn is None
+    if own_conn:
+        conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        # Кілька процесів можуть одночасно додавати ту саму станцію — дублікат лише оновить координати
+        cursor.executemany("""
+        INSERT INTO locations (name, lat, lon, asl) VALUES (%s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE lat = VALUES(lat), lon = VALUES(lon), asl = VALUES(asl)
+        """, [(name, *coords) for name, coords in stations.items()])
+        conn.commit()
+        names = list(stations)
+        cursor.execute(f"SELECT name, id FROM locations WHERE name IN ({', '.join(['%s'] * len(names))})", names)
+        return dict(cursor.fetchall())
+    finally:
+        cursor.close()
+        if own_conn:
+            conn.close()
+
+def _query_weather(engine, locations=None, columns=None, start=None, end=None, after=None):
+    """Запит до weather_data: станції, стовпці, проміжок [start, end] і рядки новіші за after."""
+    select = "w.*" if columns is None else ", ".join(f"w.{c}" for c in ['timestamp'] + [c for c in columns if c != 'timestamp'])
+    query = f"""
+    SELECT l.name AS location, {select}
+    FROM weather_data w JOIN locations l ON l.id = w.location_id
+    WHERE 1 = 1
+    """
+    params = {}
+    if locations is not None:
+        query += " AND l.name IN :names"
+        params['names'] = list(locations)
+    if start is not None:
+        query += " AND w.timestamp >= :start"
+        params['start'] = start
+    if end is not None:
+        query += " AND w.timestamp <= :end"
+        params['end'] = end
+    if after is not None:
+        query += " AND w.timestamp > :after"
+        params['after'] = after
+    query += " ORDER BY w.location_id, w.timestamp"
+    statement = text(query)
+    if locations is not None:
+        statement = statement.bindparams(bindparam('names', expanding=True))
+    data = pd.read_sql(statement, engine, params=params)
+    return data.drop(columns=[c for c in ('id', 'location_id') if c in data.columns])
+
+def _cached_weather(engine, cache, names, columns, start, end):
+    """Дані станцій з локального кешу, який спершу дописується новими рядками з БД.
+
+    Якщо завантажувач переписав або додав години, не новіші за вже наявні
+    (locations.revision змінився), кеш станції будується заново.
+    """
+    # revision читається до самих даних: зміна між двома запитами лише змусить перебудувати кеш ще раз
+    revisions = pd.read_sql(text("SELECT name, revision FROM locations ORDER BY id"), engine)
+    revisions = dict(zip(revisions['name'], revisions['revision']))
+    if names is None:
+        names = list(revisions)
+    frames = []
+    for name in names:
+        if name not in revisions:
+            continue
+        # Інший процес у цей час може оновлювати кеш тієї самої станції
+        with cache.lock(name):
+            if cache.revision(name) != revisions[name]:
+                cache.clear(name)
+            # З БД — лише години, новіші за останню в кеші станції
+            new_rows = _query_weather(engine, [name], after=cache.last_timestamp(name))
+            cache.append(name, new_rows.drop(columns=['location']))
+            cache.set_revision(name, revisions[name])
+            data = cache.load(name, columns, start, end)
+        if data is not None:
+            data.insert(0, 'location', name)
+            frames.append(data)
+    if not frames:
+        return _query_weather(engine, names, columns, start, end)
+    return pd.concat(frames, ignore_index=True)
+
+def get_weather_data(locations=None, columns=None, start=None, end=None, use_cache=True, dtype=WEATHER_DTYPE):
+    """Повертає дані з таблиці weather_data через SQLAlchemy.
+
+    locations — назва станції або список назв; None — усі станції.
+    columns — потрібні стовпці (timestamp додається завжди), start/end — межі часу;
+    фільтри виконуються в SQL, тож з БД приходять лише потрібні рядки і стовпці.
+    Рядки впорядковані за станцією і часом, назва станції — у стовпці location.
+    Стовпці погоди мають тип dtype (за замовчуванням float32; None — як повернув драйвер).
+    Якщо задано WEATHER_CACHE_DIR і встановлено pyarrow, дані читаються з локального
+    кешу (weather_cache.py), а з БД довантажуються лише нові години.
+    """
+    try:
+        engine = get_engine()
+        names = [locations] if isinstance(locations, str) else (None if locations is None else list(locations))
+        if use_cache and WEATHER_CACHE_DIR and weather_cache.available():
+            cache = weather_cache.WeatherCache(
+                WEATHER_CACHE_DIR, f"{DB_CONFIG['host']}_{DB_CONFIG['port']}_{DB_CONFIG['database']}")
+            data = _cached_weather(engine, cache, names, columns, start, end)
+        else:
+            data = _query_weather(engine, names, columns, start, end)
+        if dtype is not None:
+            values = data.columns.difference(['location', 'timestamp'])
+            data[values] = data[values].astype(dtype)
+        return data
+    except Exception as e:
+        print(f"Помилка: {e}")
+        return None
+
+def save_prediction(forecast_date, predicted_temperature, predicted_gdd, predicted_precipitation,
+                   predicted_humidity, predicted_snowfall, predicted_snow_depth, predicted_wind_gust,
+                   predicted_wind_speed_10m, predicted_wind_direction_10m, predicted_wind_speed_100m,
+                   predicted_wind_direction_100m, predicted_cloud_cover_total, predicted_cloud_cover_high,
+                   predicted_cloud_cover_medium, predicted_cloud_cover_low, predicted_pressure):
+    """Зберігає прогноз у таблицю predictions."""
+    conn = None
+    cursor = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+
+        # Створення таблиці predictions, якщо не існує
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS predictions (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            forecast_date DATETIME NOT NULL,
+            predicted_temperature FLOAT,
+            predicted_gdd FLOAT,
+            predicted_precipitation FLOAT,
+            predicted_humidity FLOAT,
+            predicted_snowfall FLOAT,
+            predicted_snow_depth FLOAT,
+            predicted_wind_gust FLOAT,
+            predicted_wind_speed_10m FLOAT,
+            predicted_wind_direction_10m FLOAT,
+            predicted_wind_speed_100m FLOAT,
+            predicted_wind_direction_100m FLOAT,
+            predicted_cloud_cover_total FLOAT,
+            predicted_cloud_cover_high FLOAT,
+            predicted_cloud_cover_medium FLOAT,
+            predicted_cloud_cover_low FLOAT,
+            predicted_pressure FLOAT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """)
+
+        # Конвертація всіх параметрів у float
+        params = (
+            forecast_date,
+            float(predicted_temperature),
+            float(predicted_gdd),
+            float(predicted_precipitation),
+            float(predicted_humidity),
+            float(predicted_snowfall),
+            float(predicted_snow_depth),
+            float(predicted_wind_gust),
+            float(predicted_wind_speed_10m),
+            float(predicted_wind_direction_10m),
+            float(predicted_wind_speed_100m),
+            float(predicted_wind_direction_100m),
+            float(predicted_cloud_cover_total),
+            float(predicted_cloud_cover_high),
+            float(predicted_cloud_cover_medium),
+            float(predicted_cloud_cover_low),
+            float(predicted_pressure)
+        )
+
+        # Вставка прогнозу
+        cursor.execute("""
+        INSERT INTO predictions (
+            forecast_date, predicted_temperature, predicted_gdd, predicted_precipitation,
+            predicted_humidity, predicted_snowfall, predicted_snow_depth, predicted_wind_gust,
+            predicted_wind_speed_10m, predicted_wind_direction_10m, predicted_wind_speed_100m,
+            predicted_wind_direction_100m, predicted_cloud_cover_total, predicted_cloud_cover_high,
+            predicted_cloud_cover_medium, predicted_cloud_cover_low, predicted_pressure
+        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        """, params)
+
+        conn.commit()
+        print("Прогноз збережено в таблиці predictions.")
+    except Error as e:
+        print(f"Помилка: {e}")
+    finally:
+        if cursor is not None:
+            cursor.close()
+        if conn is not None and conn.is_connected():
+            conn.close()
             print("Підключення до MySQL закрито.")
\ No newline at end of file
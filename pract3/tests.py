@@ -1,37 +1,111 @@
-# test_main.py
-import unittest
-import pandas as pd
-import numpy as np
-from main import get_weather_data, save_prediction
-
-class TestWeatherPrediction(unittest.TestCase):
-    def test_data_loading(self):
-        """Тест завантаження даних з бази"""
-        data = get_weather_data()
-        self.assertIsNotNone(data, "Дані не завантажилися з бази")
-        self.assertGreater(len(data), 0, "Дані порожні")
-        self.assertIn('temperature', data.columns, "Відсутній стовпець temperature")
-
-    def test_lag_creation(self):
-        """Тест створення лагів"""
-        data = get_weather_data()
-        lag_dict = {}
-        for target in ['temperature']:
-            for lag in range(1, 3):
-                lag_dict[f'{target}_lag_{lag}'] = data[target].shift(lag)
-        lag_df = pd.DataFrame(lag_dict)
-        data = pd.concat([data, lag_df], axis=1)
-        self.assertIn('temperature_lag_1', data.columns, "Лаги не створені")
-
-    def test_save_prediction(self):
-        """Тест збереження прогнозу"""
-        save_prediction(
-            '2024-03-07 00:00:00', 5.0, 0.0, 0.1, 90.0, 0.0, 0.0, 7.0,
-            2.0, 200.0, 3.0, 250.0, 80.0, 20.0, 70.0, 80.0, 1020.0
-        )
-        # Перевіряємо, що запис є в базі
-        data = get_weather_data()
-        self.assertTrue(any(data['timestamp'] == '2024-03-07 00:00:00'), "Прогноз не зберігся")
-
-if __name__ == '__main__':
+# test_main.py
+import unittest
+import pandas as pd
+import numpy as np
+from main import get_weather_data, save_prediction
+from db import get_engine, get_connection
+from csvindb import csv_file, map_columns, iter_chunks, chunk_rows, read_last_timestamp, load_incremental, load_csv, WEATHER_COLUMNS
+
+class TestWeatherPrediction(unittest.TestCase):
+    def test_data_loading(self):
+        """Тест завантаження даних з бази"""
+        data = get_weather_data()
+        self.assertIsNotNone(data, "Дані не завантажилися з бази")
+        self.assertGreater(len(data), 0, "Дані порожні")
+        self.assertIn('temperature', data.columns, "Відсутній стовпець temperature")
+
+    def test_lag_creation(self):
+        """Тест створення лагів"""
+        data = get_weather_data()
+        lag_dict = {}
+        for target in ['temperature']:
+            for lag in range(1, 3):
+                lag_dict[f'{target}_lag_{lag}'] = data[target].shift(lag)
+        lag_df = pd.DataFrame(lag_dict)
+        data = pd.concat([data, lag_df], axis=1)
+        self.assertIn('temperature_lag_1', data.columns, "Лаги не створені")
+
+    def test_save_prediction(self):
+        """Тест збереження прогнозу"""
+        save_prediction(
+            '2024-03-07 00:00:00', 5.0, 0.0, 0.1, 90.0, 0.0, 0.0, 7.0,
+            2.0, 200.0, 3.0, 250.0, 80.0, 20.0, 70.0, 80.0, 1020.0
+        )
+        # Перевіряємо, що запис є в базі
+        data = get_weather_data()
+        self.assertTrue(any(data['timestamp'] == '2024-03-07 00:00:00'), "Прогноз не зберігся")
+
+    def test_csv_chunks(self):
+        """Тест читання CSV частинами"""
+        stations = map_columns(csv_file)
+        self.assertEqual(list(stations), ['Basel'], "Станцію не знайдено в заголовку")
+        self.assertEqual(stations['Basel']['coords'], (47.75, 7.5, 363.653))
+        self.assertEqual(sorted(stations['Basel']['columns'].values()), sorted(WEATHER_COLUMNS),
+                         "Не всі стовпці зіставлено")
+        chunks = list(iter_chunks(csv_file, stations, chunk_size=1000))
+        self.assertGreater(len(chunks), 1, "CSV не поділено на частини")
+        rows = [row for _, chunk in chunks for row in chunk_rows(chunk, 1)]
+        self.assertEqual(len(rows), sum(len(chunk) for _, chunk in chunks))
+        self.assertEqual(len(rows[0]), len(WEATHER_COLUMNS) + 2)
+        self.assertEqual(str(rows[0][1]), '2023-08-29 00:00:00', "Дата перетворена неправильно")
+
+    def test_incremental_load(self):
+        """Тест дозавантаження: повторний запуск на тому ж файлі нічого не додає"""
+        self.assertEqual(str(read_last_timestamp(csv_file)), '2024-03-06 23:00:00', "Неправильна остання дата")
+        load_incremental(csv_file)
+        self.assertEqual(load_incremental(csv_file), 0, "Повторно завантажено вже наявні рядки")
+
+    def test_station_filter(self):
+        """Тест вибірки даних по станціях"""
+        data = get_weather_data('Basel')
+        self.assertIsNotNone(data, "Дані не завантажилися з бази")
+        self.assertEqual(set(data['location']), {'Basel'}, "У вибірці є інші станції")
+        self.assertTrue(data['timestamp'].is_monotonic_increasing, "Дані не впорядковані за часом")
+        self.assertEqual(len(get_weather_data(['Basel', 'Немає такої станції'])), len(data))
+
+    def test_weather_cache(self):
+        """Тест кешу: дані з кешу збігаються з даними напряму з БД"""
+        direct = get_weather_data('Basel', use_cache=False)
+        get_weather_data('Basel')
+        cached = get_weather_data('Basel')
+        self.assertEqual(len(cached), len(direct), "Кеш повернув іншу кількість рядків")
+        self.assertTrue((cached['temperature'].values == direct['temperature'].values).all())
+        part = get_weather_data('Basel', columns=['temperature'], start='2024-01-01', end='2024-01-31 23:00')
+        self.assertEqual(list(part.columns), ['location', 'timestamp', 'temperature'])
+        self.assertEqual(len(part), 31 * 24, "Неправильна вибірка за проміжок часу")
+
+    def test_cache_follows_reload(self):
+        """Тест кешу: повторне завантаження вже наявних годин перебудовує кеш"""
+        hour = '2024-01-15 12:00:00'
+        conn = get_connection()
+        cursor = conn.cursor()
+        # Змінюємо годину так само, як завантажувач: разом з revision станції,
+        # інакше кеш, збудований попереднім запуском тесту, цієї зміни не побачить
+        cursor.execute("UPDATE weather_data SET temperature = 999 WHERE timestamp = %s", (hour,))
+        cursor.execute("UPDATE locations SET revision = revision + 1 WHERE name = 'Basel'")
+        conn.commit()
+        cached = get_weather_data('Basel', start=hour, end=hour)
+        self.assertEqual(cached['temperature'].iloc[0], 999, "Кеш не збудовано з поточних даних")
+
+        # Завантажувач повертає справжнє значення і змінює revision станції
+        load_csv(csv_file)
+        cursor.execute("SELECT temperature FROM weather_data WHERE timestamp = %s", (hour,))
+        expected = cursor.fetchone()[0]
+        cursor.close()
+        conn.close()
+        cached = get_weather_data('Basel', start=hour, end=hour, dtype=None)
+        self.assertAlmostEqual(cached['temperature'].iloc[0], expected, places=4, msg="Кеш віддав застарілі дані")
+
+    def test_typed_projection(self):
+        """Тест вибірки стовпців: лише потрібні стовпці, float32 і спільний engine"""
+        columns = ['temperature', 'precipitation', 'wind_gust', 'pressure']
+        data = get_weather_data('Basel', columns=columns, start='2024-03-01', use_cache=False)
+        self.assertEqual(list(data.columns), ['location', 'timestamp'] + columns)
+        self.assertTrue((data[columns].dtypes == np.float32).all(), "Стовпці погоди не float32")
+        self.assertTrue((data['timestamp'] >= '2024-03-01').all(), "Фільтр за часом не застосовано")
+        self.assertIs(get_engine(), get_engine(), "Engine створюється заново")
+        wide = get_weather_data('Basel', columns=['temperature'], start='2024-03-01', use_cache=False, dtype=None)
+        self.assertEqual(wide['temperature'].dtype, np.float64)
+
+if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
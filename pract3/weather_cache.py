@@ -0,0 +1,179 @@
+# weather_cache.py
+# Локальний кеш weather_data у форматі Feather (Arrow IPC).
+# Дані кожної станції лежать у теці як набір сегментів "перша_дата-остання_дата.feather":
+# нові години дописуються окремим сегментом, тож оновлення кешу коштує лише нових рядків,
+# а читаються тільки потрібні стовпці і сегменти, що перетинають потрібний проміжок часу.
+# Сегменти без стиснення відкриваються через memory map — без копіювання всього файлу в пам'ять.
+# Поруч із сегментами — ревізія станції (locations.revision): якщо завантажувач переписав
+# чи дозавантажив старіші години, ревізія в БД зміниться, і кеш станції буде збудовано заново.
+import os
+import glob
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from urllib.parse import quote
+import pandas as pd
+
+# pyarrow потрібен лише для кешу; без нього get_weather_data читає дані напряму з БД
+try:
+    import pyarrow as pa
+    from pyarrow import feather
+except ImportError:
+    pa = None
+
+# Блокування файлу між процесами: fcntl на Linux/macOS, msvcrt на Windows
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+# Формат дат у назвах сегментів
+SEGMENT_TIME = '%Y%m%dT%H%M%S'
+# Скільки сегментів може накопичитись у станції, перш ніж їх буде об'єднано в один
+MAX_SEGMENTS = 32
+
+
+def available():
+    """Чи можна користуватися кешем (встановлено pyarrow)."""
+    return pa is not None
+
+
+def _lock_file(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        return
+    f.seek(0)
+    while True:
+        try:
+            # LK_LOCK сам чекає близько 10 с, після чого кидає OSError — тоді чекаємо далі
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            time.sleep(0.1)
+
+
+def _unlock_file(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class WeatherCache:
+    """Кеш однієї бази даних: key (хост, порт, база) відокремлює кеші різних баз у спільній теці."""
+
+    def __init__(self, directory, key):
+        self.directory = os.path.join(directory, quote(key, safe=''))
+
+    def _station_dir(self, station):
+        return os.path.join(self.directory, quote(station, safe=''))
+
+    def _segments(self, station):
+        """Сегменти станції в хронологічному порядку: [(перша дата, остання дата, шлях)]."""
+        segments = []
+        for path in sorted(glob.glob(os.path.join(self._station_dir(station), '*.feather'))):
+            first, last = os.path.basename(path)[:-len('.feather')].split('-')
+            segments.append((datetime.strptime(first, SEGMENT_TIME), datetime.strptime(last, SEGMENT_TIME), path))
+        return segments
+
+    def last_timestamp(self, station):
+        """Найновіша дата в кеші станції (з назви останнього сегмента) або None."""
+        segments = self._segments(station)
+        return segments[-1][1] if segments else None
+
+    def revision(self, station):
+        """Ревізія станції (locations.revision), з якою збудовано кеш, або None."""
+        try:
+            with open(os.path.join(self._station_dir(station), 'revision')) as f:
+                return int(f.read().strip())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def set_revision(self, station, revision):
+        directory = self._station_dir(station)
+        os.makedirs(directory, exist_ok=True)
+        temp_path = os.path.join(directory, 'revision.tmp')
+        with open(temp_path, 'w') as f:
+            f.write(str(int(revision)))
+        os.replace(temp_path, os.path.join(directory, 'revision'))
+
+    @contextmanager
+    def lock(self, station):
+        """Блокування кешу станції між процесами на час оновлення і читання.
+
+        Без нього два процеси, що одночасно дописують ту саму станцію,
+        записали б сегменти з однаковими годинами.
+        """
+        directory = self._station_dir(station)
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, 'lock'), 'a+b') as f:
+            _lock_file(f)
+            try:
+                yield
+            finally:
+                _unlock_file(f)
+
+    def append(self, station, frame):
+        """Дописує нові рядки станції (frame впорядкований за timestamp) окремим сегментом.
+
+        Години, що вже є в кеші, відкидаються — сегменти ніколи не перетинаються.
+        """
+        last = self.last_timestamp(station)
+        if last is not None:
+            frame = frame[frame['timestamp'] > last]
+        if frame.empty:
+            return
+        directory = self._station_dir(station)
+        os.makedirs(directory, exist_ok=True)
+        first, last = frame['timestamp'].iloc[0], frame['timestamp'].iloc[-1]
+        path = os.path.join(directory, f"{first:{SEGMENT_TIME}}-{last:{SEGMENT_TIME}}.feather")
+        self._write(pa.Table.from_pandas(frame.reset_index(drop=True), preserve_index=False), path)
+        if len(self._segments(station)) > MAX_SEGMENTS:
+            self.compact(station)
+
+    def _write(self, table, path):
+        # Без стиснення: лише такі файли читаються через memory map без розпакування.
+        # Запис у тимчасовий файл і перейменування — недописаний сегмент ніколи не буде прочитано
+        temp_path = path + '.tmp'
+        feather.write_feather(table, temp_path, compression='uncompressed')
+        os.replace(temp_path, path)
+
+    def compact(self, station):
+        """Об'єднує всі сегменти станції в один."""
+        segments = self._segments(station)
+        if len(segments) < 2:
+            return
+        table = pa.concat_tables([feather.read_table(path, memory_map=True) for _, _, path in segments])
+        path = os.path.join(self._station_dir(station),
+                            f"{segments[0][0]:{SEGMENT_TIME}}-{segments[-1][1]:{SEGMENT_TIME}}.feather")
+        self._write(table, path + '.new')
+        for _, _, old in segments:
+            os.remove(old)
+        os.replace(path + '.new', path)
+
+    def load(self, station, columns=None, start=None, end=None):
+        """Дані станції з кешу: лише columns (None — усі) і лише рядки з [start, end]."""
+        start = None if start is None else pd.Timestamp(start)
+        end = None if end is None else pd.Timestamp(end)
+        segments = [path for first, last, path in self._segments(station)
+                    if (start is None or last >= start) and (end is None or first <= end)]
+        if not segments:
+            return None
+        read_columns = None if columns is None else ['timestamp'] + [c for c in columns if c != 'timestamp']
+        table = pa.concat_tables([feather.read_table(path, columns=read_columns, memory_map=True)
+                                  for path in segments])
+        data = table.to_pandas()
+        if start is not None:
+            data = data[data['timestamp'] >= start]
+        if end is not None:
+            data = data[data['timestamp'] <= end]
+        return data.reset_index(drop=True)
+
+    def clear(self, station=None):
+        """Видаляє кеш станції (або всіх станцій) — наступне читання завантажить усе з БД заново."""
+        pattern = os.path.join(self._station_dir(station) if station else os.path.join(self.directory, '*'),
+                               '*.feather')
+        for path in glob.glob(pattern):
+            os.remove(path)